@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.utils import timezone
+
+from heartstringApp.models import Ticket
+
+# Ticket QR codes carry a short signed token instead of the buyer's details:
+#   HS1.<ticket id>.<showtime id>.<signature>
+# Ids are base 36 and the signature is a truncated HMAC in base 32, so the token only uses characters of the QR
+# alphanumeric mode and fits a small, quickly scanned code.
+TICKET_TOKEN_SECRET = getattr(settings, 'TICKET_TOKEN_SECRET', settings.SECRET_KEY)
+TOKEN_PREFIX = 'HS1'
+
+# Outcomes of a door scan
+ADMITTED = 'admitted'
+ALREADY_ADMITTED = 'already_admitted'
+INVALID = 'invalid'
+NOT_PAID = 'not_paid'
+WRONG_SHOW = 'wrong_show'
+
+
+def _base36(number):
+    digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    encoded = ''
+    while True:
+        number, digit = divmod(number, 36)
+        encoded = digits[digit] + encoded
+        if not number:
+            return encoded
+
+
+def _signature(body):
+    digest = hmac.new(TICKET_TOKEN_SECRET.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b32encode(digest[:15]).decode()
+
+
+def token(ticket_id, showtime_id):
+    body = f"{TOKEN_PREFIX}.{_base36(ticket_id)}.{_base36(showtime_id or 0)}"
+    return f"{body}.{_signature(body)}"
+
+
+def ticket_token(ticket):
+    return token(ticket.pk, ticket.showtime_id)
+
+
+def parse(value):
+    """
+    Return (ticket_id, showtime_id) for a genuine token, else None. showtime_id is None for tickets without a show.
+    """
+    parts = str(value).strip().upper().split('.')
+    if len(parts) != 4 or parts[0] != TOKEN_PREFIX:
+        return None
+    if not hmac.compare_digest(_signature('.'.join(parts[:3])), parts[3]):
+        return None
+    try:
+        ticket_id, showtime_id = int(parts[1], 36), int(parts[2], 36)
+    except ValueError:
+        return None
+    return ticket_id, showtime_id or None
+
+
+def token_hash(value):
+    # What offline scanners compare against; they never hold the signing secret
+    return hashlib.sha256(str(value).strip().upper().encode()).hexdigest()[:20]
+
+
+def admit(value, showtime_id=None):
+    """
+    Check a scanned token and admit its ticket. The admission is one guarded UPDATE by primary key, so a ticket
+    scanned at two doors at once is let in only once. showtime_id is the show being scanned for, if the scanner
+    knows it. Returns (outcome, ticket); ticket is None for invalid tokens and show ids.
+    """
+    parsed = parse(value)
+    if parsed is None:
+        return INVALID, None
+    ticket_id, token_showtime_id = parsed
+    if showtime_id is not None:
+        try:
+            showtime_id = int(showtime_id)
+        except (TypeError, ValueError):
+            return INVALID, None
+        if token_showtime_id != showtime_id:
+            return WRONG_SHOW, None
+
+    admitted = Ticket.objects.filter(pk=ticket_id, showtime_id=token_showtime_id, purchased=True,
+                                     admitted_at__isnull=True).update(admitted_at=timezone.now())
+    ticket = Ticket.objects.filter(pk=ticket_id) \
+        .only('id', 'ticket_number', 'seat_numbers', 'showtime_id', 'purchased', 'admitted_at').first()
+    if admitted:
+        return ADMITTED, ticket
+    if ticket is None:
+        return INVALID, None
+    if ticket.showtime_id != token_showtime_id:
+        # The ticket was moved to another show after its code was issued
+        return WRONG_SHOW, ticket
+    if not ticket.purchased:
+        return NOT_PAID, ticket
+    return ALREADY_ADMITTED, ticket
+
+
+def bundle(showtime_id):
+    """
+    Everything a scanner needs to check tickets for one show without a connection: the hashes of the valid tokens
+    and of those already admitted.
+    """
+    showtime_id = int(showtime_id)
+    tickets = Ticket.objects.filter(showtime_id=showtime_id, purchased=True).values_list('pk', 'admitted_at')
+    valid, admitted = [], []
+    for ticket_id, admitted_at in tickets:
+        hashed = token_hash(token(ticket_id, showtime_id))
+        valid.append(hashed)
+        if admitted_at is not None:
+            admitted.append(hashed)
+    return {
+        "showtime_id": showtime_id,
+        "generated_at": timezone.now(),
+        "hash": "sha256(token)[:20]",
+        "tickets": valid,
+        "admitted": admitted,
+    }
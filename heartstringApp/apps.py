@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class HeartstringappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'heartstringApp'
+
+    def ready(self):
+        # Connect the receivers that keep response versions current
+        from heartstringApp import signals  # noqa: F401
@@ -0,0 +1,314 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from heartstringApp import events, seating, versions
+from heartstringApp.models import Seat
+
+# How long seats stay held for a ticket while its payment is in flight
+SEAT_HOLD_SECONDS = getattr(settings, 'SEAT_HOLD_SECONDS', 10 * 60)
+
+
+class BookingConflict(Exception):
+    """
+    Raised inside the booking transaction when the guarded UPDATE claimed fewer rows than were seen free,
+    i.e. a concurrent booking committed between our read and our write.
+    """
+
+
+class BookingResult:
+    def __init__(self, claimed=None, conflicting=None, missing=None, held_until=None):
+        self.claimed = claimed or []
+        self.conflicting = conflicting or []
+        self.missing = missing or []
+        self.held_until = held_until
+
+    @property
+    def complete(self):
+        return not self.conflicting and not self.missing
+
+    def as_dict(self):
+        return {
+            'booked_seats': self.claimed,
+            'already_booked_seats': self.conflicting,
+            'not_found_seats': self.missing,
+        }
+
+
+def _is_available(is_booked, held_until, hold_ticket_id, now, ticket):
+    if is_booked:
+        return False
+    if held_until is None or held_until <= now:
+        return True
+    return ticket is not None and hold_ticket_id == ticket.pk
+
+
+def _normalize_ids(seat_ids):
+    # Keep the caller's order but drop duplicates so a repeated id is not reported as a conflict with itself
+    seen = set()
+    normalized = []
+    for seat_id in seat_ids:
+        seat_id = int(seat_id)
+        if seat_id not in seen:
+            seen.add(seat_id)
+            normalized.append(seat_id)
+    return normalized
+
+
+def _state(changes):
+    return events.BOOKED if changes.get('is_booked') else events.HELD
+
+
+def _announce(changed, state, held_until=None):
+    """
+    Propagate seat changes, given as (showtime_id, seat_number), to the cached bitmaps, the live event log and
+    the response versions once the transaction commits. Held seats free up by themselves at held_until.
+    """
+    showtime_ids = {showtime_id for showtime_id, seat_number in changed}
+    if state == events.FREE:
+        seating.invalidate_bitmaps(showtime_ids)
+    else:
+        seating.mark_unavailable(changed, held_until)
+    events.publish(changed, state)
+    versions.bump([versions.showtime_scope(showtime_id) for showtime_id in showtime_ids], expires=held_until)
+
+
+def _claim(seat_ids, changes, all_or_nothing, ticket):
+    now = timezone.now()
+    with transaction.atomic():
+        # One read to classify the request, taking row locks on backends that support them
+        rows = {
+            pk: (_is_available(is_booked, held_until, hold_ticket_id, now, ticket), (showtime_id, seat_number))
+            for pk, is_booked, held_until, hold_ticket_id, showtime_id, seat_number
+            in Seat.objects.select_for_update().filter(pk__in=seat_ids).values_list(
+                'pk', 'is_booked', 'held_until', 'hold_ticket_id', 'showtime_id', 'seat_number')
+        }
+        missing = [seat_id for seat_id in seat_ids if seat_id not in rows]
+        conflicting = [seat_id for seat_id in seat_ids if seat_id in rows and not rows[seat_id][0]]
+        free = [seat_id for seat_id in seat_ids if seat_id in rows and rows[seat_id][0]]
+
+        if all_or_nothing and (missing or conflicting):
+            return BookingResult(conflicting=conflicting, missing=missing)
+
+        if free:
+            # One conditional write; the guard keeps it correct even where row locks are a no-op (SQLite)
+            updated = Seat.objects.filter(seating.available_q(now, ticket), pk__in=free).update(**changes)
+            if updated != len(free):
+                raise BookingConflict()
+            _announce([rows[seat_id][1] for seat_id in free], _state(changes), changes.get('held_until'))
+
+        return BookingResult(claimed=free, conflicting=conflicting, missing=missing,
+                             held_until=changes.get('held_until'))
+
+
+def _claim_ids(seat_ids, changes, all_or_nothing, ticket, retries):
+    seat_ids = _normalize_ids(seat_ids)
+    if not seat_ids:
+        return BookingResult()
+
+    for attempt in range(retries):
+        try:
+            return _claim(seat_ids, changes, all_or_nothing, ticket)
+        except BookingConflict:
+            # Lost a race against another buyer; the transaction was rolled back, so re-read and try again
+            continue
+
+    # Still contended after several attempts: report every existing seat as conflicting
+    existing = set(Seat.objects.filter(pk__in=seat_ids).values_list('pk', flat=True))
+    return BookingResult(
+        conflicting=[seat_id for seat_id in seat_ids if seat_id in existing],
+        missing=[seat_id for seat_id in seat_ids if seat_id not in existing],
+    )
+
+
+def _claim_numbers(showtime, seat_numbers, wings, changes, all_or_nothing, ticket):
+    now = timezone.now()
+    with transaction.atomic():
+        rows = {
+            seat_number: (pk, _is_available(is_booked, held_until, hold_ticket_id, now, ticket))
+            for pk, seat_number, is_booked, held_until, hold_ticket_id in Seat.objects.select_for_update()
+            .filter(showtime=showtime, seat_number__in=seat_numbers)
+            .values_list('pk', 'seat_number', 'is_booked', 'held_until', 'hold_ticket_id')
+        }
+        conflicting = [seat_number for seat_number in seat_numbers
+                       if seat_number in rows and not rows[seat_number][1]]
+        if all_or_nothing and conflicting:
+            return BookingResult(conflicting=conflicting)
+
+        # Seats that already have a row (eager maps, released holds) are claimed with the guarded UPDATE,
+        # the rest get a row inserted; the unique constraint rejects a concurrent insert of the same seat
+        free_rows = [rows[seat_number][0] for seat_number in seat_numbers
+                     if seat_number in rows and rows[seat_number][1]]
+        if free_rows:
+            updated = Seat.objects.filter(seating.available_q(now, ticket), pk__in=free_rows).update(**changes)
+            if updated != len(free_rows):
+                raise BookingConflict()
+
+        new_seats = [
+            Seat(showtime=showtime, play_time_id=showtime.play_time_id, play_date=showtime.play_date,
+                 seat_number=seat_number, wing=wings[seat_number], time_slot=showtime.time_slot, **changes)
+            for seat_number in seat_numbers if seat_number not in rows
+        ]
+        if new_seats:
+            try:
+                with transaction.atomic():
+                    Seat.objects.bulk_create(new_seats)
+            except IntegrityError:
+                raise BookingConflict()
+
+        claimed = [seat_number for seat_number in seat_numbers if seat_number not in conflicting]
+        _announce([(showtime.id, seat_number) for seat_number in claimed], _state(changes), changes.get('held_until'))
+        return BookingResult(claimed=claimed, conflicting=conflicting, held_until=changes.get('held_until'))
+
+
+def _claim_seat_numbers(showtime, seat_numbers, changes, all_or_nothing, ticket, retries):
+    current_layout_id, seats = seating.layout_index(showtime.theater)
+    wings = {seat_number: wing for wing, seat_number in seats}
+    requested = list(dict.fromkeys(str(seat_number) for seat_number in seat_numbers))
+    missing = [seat_number for seat_number in requested if seat_number not in wings]
+    requested = [seat_number for seat_number in requested if seat_number in wings]
+
+    if all_or_nothing and missing:
+        return BookingResult(missing=missing)
+    if not requested:
+        return BookingResult(missing=missing)
+
+    for attempt in range(retries):
+        try:
+            result = _claim_numbers(showtime, requested, wings, changes, all_or_nothing, ticket)
+            result.missing = missing
+            return result
+        except BookingConflict:
+            continue
+
+    # Still contended after several attempts: nothing could be claimed
+    return BookingResult(conflicting=requested, missing=missing)
+
+
+def _book_changes(ticket):
+    # hold_ticket always names the seat's current owner, so a booking overwrites what an expired hold left behind
+    return {'is_booked': True, 'held_until': None, 'hold_ticket': ticket}
+
+
+def book_seats(seat_ids, all_or_nothing=False, ticket=None, retries=3):
+    """
+    Claim the given seats in a single transaction: one SELECT to classify the request and one guarded bulk
+    UPDATE to book the free seats. Returns a BookingResult with the exact claimed, conflicting and missing ids.
+
+    With all_or_nothing=True nothing is booked unless every requested seat is free. Seats held for another
+    ticket are reported as conflicting; seats held for the given ticket can be booked.
+    """
+    return _claim_ids(seat_ids, _book_changes(ticket), all_or_nothing, ticket, retries)
+
+
+def book_seat_numbers(showtime, seat_numbers, all_or_nothing=False, ticket=None, retries=3):
+    """
+    Book seats of one show by seat number. Works for lazy seat maps, where free seats have no row yet:
+    numbers that are not in the theater's layout are reported as missing.
+    """
+    return _claim_seat_numbers(showtime, seat_numbers, _book_changes(ticket), all_or_nothing, ticket, retries)
+
+
+def _hold_changes(ticket, seconds):
+    return {'held_until': timezone.now() + timedelta(seconds=seconds or SEAT_HOLD_SECONDS), 'hold_ticket': ticket}
+
+
+def hold_seats(seat_ids, ticket, seconds=None, retries=3):
+    """
+    Hold seats for a ticket while its payment is in flight. Holds are all-or-nothing and expire on their own;
+    calling this again for the same ticket extends its holds.
+    """
+    return _claim_ids(seat_ids, _hold_changes(ticket, seconds), True, ticket, retries)
+
+
+def hold_seat_numbers(showtime, seat_numbers, ticket, seconds=None, retries=3):
+    changes = _hold_changes(ticket, seconds)
+    return _claim_seat_numbers(showtime, seat_numbers, changes, True, ticket, retries)
+
+
+def confirm_holds(ticket):
+    """
+    Turn the seats held for a ticket into bookings once its payment succeeds. A hold that has expired is still
+    confirmed as long as nobody else claimed the seat in the meantime.
+    """
+    with transaction.atomic():
+        seats = Seat.objects.filter(hold_ticket=ticket, is_booked=False)
+        shows = list(seats.values_list('showtime_id', 'seat_number'))
+        confirmed = seats.update(is_booked=True, held_until=None)
+        _announce(shows, events.BOOKED)
+    return confirmed
+
+
+def _release(seats):
+    changed = list(seats.values_list('showtime_id', 'seat_number'))
+    if seating.lazy_seat_maps():
+        # Lazy seat maps only keep rows for booked or held seats
+        released, _ = seats.delete()
+    else:
+        released = seats.update(is_booked=False, held_until=None, hold_ticket=None)
+    _announce(changed, events.FREE)
+    return released
+
+
+def release_holds(ticket):
+    """
+    Give back the seats held for a ticket, e.g. when its payment fails.
+    """
+    with transaction.atomic():
+        return _release(Seat.objects.filter(hold_ticket=ticket, is_booked=False))
+
+
+def release_tickets(tickets):
+    """
+    Give back every seat held or booked for the given tickets, e.g. before deleting them.
+    """
+    with transaction.atomic():
+        return _release(Seat.objects.filter(hold_ticket__in=tickets))
+
+
+def release_expired_holds(now=None):
+    """
+    Sweep holds whose time has passed. Reads already treat them as free; this clears them from the table.
+    """
+    with transaction.atomic():
+        return _release(Seat.objects.filter(held_until__lte=now or timezone.now(), is_booked=False))
+
+
+def allocate_seats(showtime, party_size, wing=None, ticket=None, attempts=3):
+    """
+    Pick the best contiguous block of party_size free seats for one show and claim it atomically.
+    With a ticket the block is held for it, otherwise it is booked outright.
+
+    Candidates come from the cached availability bitmap; when another buyer wins a block first, the next best
+    block that does not overlap it is tried, up to `attempts` blocks.
+    """
+    bitmap = seating.availability_bitmap(showtime)
+    current_layout_id, seats = seating.layout_index(showtime.theater)
+    if bitmap["layout_id"] != current_layout_id:
+        # Cached for a layout that has changed since; build it again against the current one
+        seating.invalidate_bitmaps([showtime.id])
+        bitmap = seating.availability_bitmap(showtime, rebuild=True)
+        current_layout_id, seats = seating.layout_index(showtime.theater)
+        if bitmap["layout_id"] != current_layout_id:
+            return BookingResult()
+
+    lost = set()
+    tried = 0
+    for block in seating.best_blocks(bitmap, seats, party_size, wing):
+        if lost.intersection(block):
+            continue
+        if ticket is not None:
+            result = hold_seat_numbers(showtime, block, ticket)
+        else:
+            result = book_seat_numbers(showtime, block, all_or_nothing=True)
+        if result.complete:
+            return result
+        lost.update(result.conflicting)
+        # The bitmap was out of date; let the next reader rebuild it
+        seating.invalidate_bitmaps([showtime.id])
+        tried += 1
+        if tried >= attempts:
+            break
+    return BookingResult()
@@ -0,0 +1,128 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a dependency whose circuit is open.
+    """
+
+
+class BulkheadFull(Exception):
+    """
+    Raised when every slot for calls to a dependency is taken.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency once too many recent calls failed or were slow, then lets a single probe through
+    after a cool-down to find out whether it recovered.
+
+    State lives in the cache so every worker process shares it: closed (calls go through and are counted per
+    window), open (calls fail fast until open_seconds have passed) and half_open (one probe decides whether to
+    close again or re-open).
+    """
+
+    def __init__(self, name, failure_rate=0.5, min_calls=10, window_seconds=60, slow_call_seconds=5,
+                 open_seconds=30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+
+    def _key(self, suffix):
+        return f"breaker:{self.name}:{suffix}"
+
+    def _window_keys(self, now):
+        window = int(now // self.window_seconds)
+        return self._key(f"calls:{window}"), self._key(f"failures:{window}")
+
+    def state(self, now=None):
+        now = now or time.time()
+        entry = cache.get(self._key('state'))
+        if entry is None or entry["state"] == CLOSED:
+            return CLOSED
+        if entry["state"] == OPEN and now - entry["since"] >= self.open_seconds:
+            return HALF_OPEN
+        return entry["state"]
+
+    def _transition(self, state, now):
+        previous = self.state(now)
+        cache.set(self._key('state'), {"state": state, "since": now}, None)
+        if previous != state:
+            cache.add(self._key(f"transitions:{state}"), 0, None)
+            cache.incr(self._key(f"transitions:{state}"))
+            print(f"Circuit {self.name}: {previous} -> {state}")
+
+    def before_call(self):
+        """
+        Raise CircuitOpen unless a call may go ahead now. In half-open state only one caller gets the probe.
+        """
+        now = time.time()
+        state = self.state(now)
+        if state == OPEN:
+            raise CircuitOpen(f"{self.name} is unavailable")
+        if state == HALF_OPEN and not cache.add(self._key('probe'), now, self.open_seconds):
+            raise CircuitOpen(f"{self.name} is recovering")
+
+    def record(self, success, elapsed):
+        now = time.time()
+        failed = not success or elapsed >= self.slow_call_seconds
+        state = self.state(now)
+
+        if state == HALF_OPEN:
+            cache.delete(self._key('probe'))
+            self._transition(OPEN if failed else CLOSED, now)
+            return
+
+        calls_key, failures_key = self._window_keys(now)
+        cache.add(calls_key, 0, self.window_seconds * 2)
+        cache.add(failures_key, 0, self.window_seconds * 2)
+        calls = cache.incr(calls_key)
+        failures = cache.incr(failures_key) if failed else cache.get(failures_key, 0)
+        if state == CLOSED and calls >= self.min_calls and failures / calls >= self.failure_rate:
+            # Start the next window from scratch once the circuit closes again
+            cache.delete_many([calls_key, failures_key])
+            self._transition(OPEN, now)
+
+    def stats(self):
+        now = time.time()
+        calls_key, failures_key = self._window_keys(now)
+        counters = cache.get_many([calls_key, failures_key] + [self._key(f"transitions:{state}")
+                                                                for state in (OPEN, CLOSED)])
+        return {
+            "state": self.state(now),
+            "window_calls": counters.get(calls_key, 0),
+            "window_failures": counters.get(failures_key, 0),
+            "times_opened": counters.get(self._key(f"transitions:{OPEN}"), 0),
+            "times_closed": counters.get(self._key(f"transitions:{CLOSED}"), 0),
+        }
+
+
+class Bulkhead:
+    """
+    Caps concurrent calls to a dependency within this process so a slow dependency cannot take every thread.
+    """
+
+    def __init__(self, name, max_concurrent, wait_seconds=0.5):
+        self.name = name
+        self.wait_seconds = wait_seconds
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def __enter__(self):
+        if not self._slots.acquire(timeout=self.wait_seconds):
+            raise BulkheadFull(f"Too many concurrent calls to {self.name}")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._slots.release()
+        return False
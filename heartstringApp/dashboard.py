@@ -0,0 +1,111 @@
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import DateField, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from heartstringApp import versions
+from heartstringApp.models import Play, Video, UserAccount, RevenueRollup
+
+Kind = RevenueRollup.Kind
+
+# The dashboard is the same for every admin, so one worker computes it and the rest share that snapshot until a sale
+# or a catalog write changes its version. The TTL bounds how stale the parts without a version (the user count) get.
+DASHBOARD_CACHE_SECONDS = getattr(settings, 'DASHBOARD_CACHE_SECONDS', 30)
+# How long one worker may spend recomputing before another may take over
+DASHBOARD_LOCK_SECONDS = 10
+# How long a worker with no snapshot to show waits for the one recomputing it
+DASHBOARD_WAIT_SECONDS = 2
+DASHBOARD_SCOPES = [versions.DASHBOARD, versions.PLAYS, versions.VIDEOS]
+SNAPSHOT_KEY = "dashboard:snapshot"
+LOCK_KEY = "dashboard:computing"
+
+
+def _total(field):
+    return Coalesce(Sum(field), Value(0), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def daily(kind):
+    """
+    Revenue per day as [{"date", "amt"}] in date order, straight from the rollup.
+    """
+    rows = RevenueRollup.objects.filter(kind=kind).order_by('day').values_list('day', 'amount')
+    return [{"date": day, "amt": float(amount)} for day, amount in rows]
+
+
+def monthly(kind):
+    """
+    Revenue per month as [{"date", "amt"}], dated the first of the month; one grouped query over the daily rows.
+    """
+    rows = RevenueRollup.objects.filter(kind=kind).order_by() \
+        .annotate(month=TruncMonth('day', output_field=DateField())).values('month') \
+        .annotate(amt=_total('amount')).order_by('month')
+    return [{"date": row['month'], "amt": float(row['amt'])} for row in rows]
+
+
+def week_total(kind, today):
+    week = RevenueRollup.objects.filter(kind=kind, day__week=today.isocalendar()[1], day__year=today.year)
+    return float(week.aggregate(amt=_total('amount'))['amt'])
+
+
+def summary(today=None):
+    """
+    Everything the admin dashboard shows: headline counts and ticket and stream revenue for this week, per day and
+    per month. Revenue comes from RevenueRollup, so the cost does not grow with the number of sales.
+    """
+    today = today or datetime.today()
+    return {
+        "users": UserAccount.objects.filter(is_staff=False).count(),
+        "active_streams": Video.objects.count(),
+        "active_plays": Play.objects.filter(is_available=True).count(),
+        "tickets_sold": RevenueRollup.objects.filter(kind=Kind.TICKET).aggregate(sold=Sum('count'))['sold'] or 0,
+        "weekly_tickets": [{"date": today.strftime("%Y-%m-%d"), "amt": week_total(Kind.TICKET, today)}],
+        "weekly_streams": [{"date": today.strftime("%Y-%m-%d"), "amt": week_total(Kind.STREAM, today)}],
+        "daily_tickets": daily(Kind.TICKET),
+        "daily_stream": daily(Kind.STREAM),
+        "monthly_stream": monthly(Kind.STREAM),
+        "monthly_ticket": monthly(Kind.TICKET),
+    }
+
+
+def _generation():
+    found = versions.get_versions(DASHBOARD_SCOPES)
+    return ".".join(found[scope]["token"] for scope in DASHBOARD_SCOPES)
+
+
+def _fresh(snapshot, generation):
+    return snapshot is not None and snapshot["generation"] == generation and snapshot["until"] > time.time()
+
+
+def cached_summary():
+    """
+    summary(), computed at most once per change across all workers. While one worker recomputes, the others answer
+    with the previous snapshot instead of piling onto the same queries.
+    """
+    generation = _generation()
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if _fresh(snapshot, generation):
+        return snapshot["data"]
+
+    if not cache.add(LOCK_KEY, True, DASHBOARD_LOCK_SECONDS):
+        if snapshot is not None:
+            return snapshot["data"]
+        # Nothing to show yet (cold cache): give the worker recomputing it a moment before doing the work too
+        deadline = time.time() + DASHBOARD_WAIT_SECONDS
+        while time.time() < deadline:
+            time.sleep(0.05)
+            snapshot = cache.get(SNAPSHOT_KEY)
+            if snapshot is not None:
+                return snapshot["data"]
+        return summary()
+
+    try:
+        data = summary()
+        # Kept well past its TTL so there is always something to serve while the next one is computed
+        cache.set(SNAPSHOT_KEY, {"generation": generation, "until": time.time() + DASHBOARD_CACHE_SECONDS,
+                                 "data": data}, DASHBOARD_CACHE_SECONDS * 10)
+    finally:
+        cache.delete(LOCK_KEY)
+    return data
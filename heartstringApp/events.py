@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+# Seat-state deltas are kept in the cache as a short per-showtime log: a sequence counter plus one entry per
+# event. Every open stream polls the cache every SEAT_EVENT_POLL_SECONDS, so the load grows with the number of
+# clients: with the database cache backend each poll is a database query, so prefer Redis or Memcached where many
+# clients watch seat maps.
+SEAT_EVENT_TTL = getattr(settings, 'SEAT_EVENT_TTL', 2 * 60)
+SEAT_EVENT_POLL_SECONDS = getattr(settings, 'SEAT_EVENT_POLL_SECONDS', 0.5)
+SEAT_EVENT_HEARTBEAT_SECONDS = 15
+# Streams are closed after a while; EventSource reconnects with Last-Event-ID and picks up where it left off
+SEAT_EVENT_STREAM_SECONDS = getattr(settings, 'SEAT_EVENT_STREAM_SECONDS', 5 * 60)
+# Seconds between polls for clients that get the JSON fallback instead of a stream
+SEAT_EVENT_POLL_FALLBACK_SECONDS = getattr(settings, 'SEAT_EVENT_POLL_FALLBACK_SECONDS', 3)
+
+# How many sequence numbers a publisher tries before giving up on an event
+SEAT_EVENT_MAX_CLAIMS = 100
+
+BOOKED = 'booked'
+HELD = 'held'
+FREE = 'free'
+
+
+def _seq_key(showtime_id):
+    return f"seatevents:{showtime_id}"
+
+
+def _event_key(showtime_id, seq):
+    return f"seatevents:{showtime_id}:{seq}"
+
+
+def _next_seq(seq_key):
+    cache.add(seq_key, 0, None)
+    try:
+        return cache.incr(seq_key)
+    except ValueError:
+        # The counter was evicted between add and incr
+        cache.add(seq_key, 0, None)
+        return cache.incr(seq_key)
+
+
+def _append(showtime_id, state, seat_numbers):
+    """
+    Store one event under the next free sequence number and return it, or None when none could be claimed.
+    incr() is not atomic on every backend (the database cache reads and then writes), so two publishers can be
+    handed the same number; add() is, so each number is claimed with it and the loser moves on to the next one.
+    """
+    seq_key = _seq_key(showtime_id)
+    event = {"state": state, "seats": seat_numbers}
+    for _ in range(SEAT_EVENT_MAX_CLAIMS):
+        seq = _next_seq(seq_key)
+        if cache.add(_event_key(showtime_id, seq), event, SEAT_EVENT_TTL):
+            return seq
+    print(f"Seat event for show {showtime_id} dropped: no free sequence number")
+    return None
+
+
+def publish(changes, state):
+    """
+    Announce seat-state changes once the surrounding transaction commits.
+    changes is an iterable of (showtime_id, seat_number); state is one of BOOKED, HELD or FREE.
+    """
+    by_show = {}
+    for showtime_id, seat_number in changes:
+        if showtime_id is not None:
+            by_show.setdefault(showtime_id, []).append(seat_number)
+
+    def send():
+        for showtime_id, seat_numbers in by_show.items():
+            _append(showtime_id, state, seat_numbers)
+
+    if by_show:
+        transaction.on_commit(send)
+
+
+def last_seq(showtime_id):
+    return cache.get(_seq_key(showtime_id)) or 0
+
+
+def since(showtime_id, after):
+    """
+    Return (events, seq, gap) for the events after `after`: events is a list of (seq, event) and seq is the position
+    to continue from. gap is the first sequence number whose event could not be found, or None. A gap is either an
+    event that is still being written or one that expired, in which case the client has to reload the whole map.
+    """
+    current = last_seq(showtime_id)
+    if current < after:
+        # The counter was reset (cache flushed or evicted); the position moves backwards
+        return [], current, None
+    if current == after:
+        return [], after, None
+
+    keys = [_event_key(showtime_id, seq) for seq in range(after + 1, current + 1)]
+    found = cache.get_many(keys)
+    events = []
+    for seq, key in enumerate(keys, start=after + 1):
+        if key not in found:
+            return events, seq - 1, seq
+        events.append((seq, found[key]))
+    return events, current, None
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream(showtime_id, after, snapshot):
+    """
+    Yield Server-Sent Events for one show: the snapshot (when given) and then every seat delta as it is published.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SEAT_EVENT_STREAM_SECONDS
+    next_heartbeat = loop.time() + SEAT_EVENT_HEARTBEAT_SECONDS
+    # Tell EventSource to wait a little before reconnecting when the stream ends
+    yield "retry: 2000\n\n"
+    if snapshot is not None:
+        yield format_event("snapshot", snapshot, after)
+
+    pending = None
+    while True:
+        previous = after
+        events, after, gap = await sync_to_async(since)(showtime_id, after)
+        for event_seq, event in events:
+            yield format_event("seats", event, event_seq)
+        if after < previous:
+            yield format_event("reset", {}, after)
+        elif gap is not None and gap == pending:
+            # Still missing one poll later, so it is gone for good
+            after = await sync_to_async(last_seq)(showtime_id)
+            yield format_event("reset", {}, after)
+            gap = None
+        pending = gap
+
+        now = loop.time()
+        if now >= deadline:
+            return
+        if now >= next_heartbeat:
+            yield ": keep-alive\n\n"
+            next_heartbeat = now + SEAT_EVENT_HEARTBEAT_SECONDS
+        await asyncio.sleep(SEAT_EVENT_POLL_SECONDS)
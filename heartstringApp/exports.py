@@ -0,0 +1,108 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
+
+from heartstringApp.models import Ticket, Payment, VideoPayments
+
+# Exports read this many rows per database round trip and hold no more than that in memory, however long the export
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+# Export name: (model, columns, the field ?play= filters on)
+EXPORTS = {
+    'tickets': (Ticket, [
+        'id', 'ticket_number', 'added_on', 'purchased', 'admitted_at', 'price', 'ticket_type', 'seat_numbers',
+        'play_id', 'play_id__title', 'showtime_id', 'play_date', 'play_time', 'user_id', 'user__email', 'email',
+    ], 'play_id'),
+    'payments': (Payment, [
+        'id', 'added_on', 'ref_number', 'payment_mode', 'amount', 'msisdn', 'msisdn_idnum', 'ticket_id',
+        'ticket__ticket_number', 'ticket__play_id', 'user_id', 'user__email',
+    ], 'ticket__play_id'),
+    'video-payments': (VideoPayments, [
+        'id', 'added_on', 'ref_number', 'payment_mode', 'amount', 'msisdn', 'msisdn_idnum', 'video_id',
+        'video__title', 'user_id', 'user__email',
+    ], 'video_id'),
+}
+
+
+class Echo:
+    """
+    A file-like object for csv.writer that hands each written line straight back instead of buffering it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _date(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"'{name}' must be a date like 2024-01-31.")
+    return parsed
+
+
+def queryset(name, params):
+    """
+    The rows of an export as value tuples in id order. ?from= and ?to= are inclusive dates on added_on; ?play=
+    (?video= for video payments) narrows to one title. Raises ValueError for malformed filters.
+    """
+    model, columns, play_field = EXPORTS[name]
+    rows = model.objects.all()
+
+    # A range on the column itself, so an index on added_on can serve it
+    start, end = _date(params, 'from'), _date(params, 'to')
+    if start:
+        rows = rows.filter(added_on__gte=datetime.combine(start, time.min))
+    if end:
+        rows = rows.filter(added_on__lt=datetime.combine(end + timedelta(days=1), time.min))
+
+    play = params.get('video' if play_field == 'video_id' else 'play')
+    if play:
+        if not play.isdigit():
+            raise ValueError("'play' must be an id.")
+        rows = rows.filter(**{play_field: int(play)})
+    return rows.order_by('id').values_list(*columns)
+
+
+def csv_rows(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_rows(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+def stream(name, export_format, params):
+    """
+    A response streaming export name in export_format ('csv' or 'ndjson'). Rows are fetched EXPORT_CHUNK_SIZE at a
+    time while the response is being sent, never all at once.
+    """
+    content_type, extension = FORMATS[export_format]
+    columns = EXPORTS[name][1]
+    rows = queryset(name, params).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    lines = csv_rows(columns, rows) if export_format == 'csv' else ndjson_rows(columns, rows)
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    filename = f"{name}-{datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,190 @@
+import hashlib
+import hmac
+import re
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from heartstringApp.breaker import CircuitBreaker, Bulkhead
+
+# Point at a local run_ipay_simulator (http://127.0.0.1:8765/payments/v2) for load tests
+IPAY_URL = getattr(settings, 'IPAY_URL', 'https://apis.ipayafrica.com/payments/v2')
+IPAY_VENDOR_ID = getattr(settings, 'IPAY_VENDOR_ID', 'hstring')
+IPAY_HASH_KEY = getattr(settings, 'IPAY_HASH_KEY', 'V5BHqdsbRBSc2#9rkky7kC2$NQ%fEEg8')
+IPAY_CALLBACK_URL = getattr(settings, 'IPAY_CALLBACK_URL', 'http://heartstringsentertainment.co.ke')
+# (connect, read) seconds for every gateway request
+IPAY_TIMEOUT = getattr(settings, 'IPAY_TIMEOUT', (3.05, 15))
+# Kept-alive connections per process; size it to the number of threads that call the gateway at once
+IPAY_POOL_SIZE = getattr(settings, 'IPAY_POOL_SIZE', 10)
+# Gateway calls allowed at once per process; further callers wait briefly and then fail fast
+IPAY_MAX_CONCURRENCY = getattr(settings, 'IPAY_MAX_CONCURRENCY', 8)
+
+# Trips when half of at least 10 calls in a minute failed or took 5s or more, then probes again after 30s
+breaker = CircuitBreaker(
+    'ipay',
+    failure_rate=getattr(settings, 'IPAY_BREAKER_FAILURE_RATE', 0.5),
+    min_calls=getattr(settings, 'IPAY_BREAKER_MIN_CALLS', 10),
+    slow_call_seconds=getattr(settings, 'IPAY_BREAKER_SLOW_CALL_SECONDS', 5),
+    open_seconds=getattr(settings, 'IPAY_BREAKER_OPEN_SECONDS', 30),
+)
+bulkhead = Bulkhead('ipay', IPAY_MAX_CONCURRENCY)
+
+# Values of "status" in a transaction status response
+STATUS_COMPLETE = 'aei7p7yrx4ae34'
+STATUS_PENDING = 'bdi6p2yy76etrs'
+
+
+class GatewayError(Exception):
+    """
+    The gateway refused a request or answered with something we could not use.
+    """
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """
+    The process-wide gateway session. Its connection pool keeps TLS connections to the gateway open between
+    requests instead of handshaking for every step of every payment.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                gateway = requests.Session()
+                # Creating a transaction or sending a prompt must not be repeated once the gateway may have seen it,
+                # so those only retry connections that were never established
+                gateway.mount(f'{IPAY_URL}/', HTTPAdapter(
+                    pool_connections=1, pool_maxsize=IPAY_POOL_SIZE,
+                    max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.2)))
+                # Status checks only read, so they also retry timeouts and gateway errors with backoff
+                gateway.mount(f'{IPAY_URL}/transact/mobilemoney', HTTPAdapter(
+                    pool_connections=1, pool_maxsize=IPAY_POOL_SIZE,
+                    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                                      allowed_methods=None, raise_on_status=False)))
+                _session = gateway
+    return _session
+
+
+def post(path, **kwargs):
+    """
+    POST to the gateway through the circuit breaker and the bulkhead. Raises breaker.CircuitOpen or
+    breaker.BulkheadFull without calling the gateway when it is known to be failing or already saturated.
+    """
+    kwargs.setdefault('timeout', IPAY_TIMEOUT)
+    # A slot first: a half-open probe taken by a call the bulkhead then turned away would never be given back
+    with bulkhead:
+        breaker.before_call()
+        started = time.monotonic()
+        try:
+            response = session().post(f'{IPAY_URL}{path}', **kwargs)
+        except requests.RequestException:
+            breaker.record(False, time.monotonic() - started)
+            raise
+    # 4xx answers are the gateway working as intended (the status check even relies on a 400)
+    breaker.record(response.status_code < 500, time.monotonic() - started)
+    return response
+
+
+def sign(data_string):
+    return hmac.new(IPAY_HASH_KEY.encode(), data_string.encode(), hashlib.sha256).hexdigest()
+
+
+def create_transaction(oid, inv, amount, phone, email, crl="1", callback_url=None):
+    """
+    Register a transaction with the gateway and return its session id (sid).
+    """
+    live = "1"
+    curr = "KES"
+    p1 = p2 = p3 = p4 = ""
+    cst = "0"
+    cbk = callback_url or IPAY_CALLBACK_URL
+    data_string = live + oid + inv + amount + phone + email + IPAY_VENDOR_ID + curr + p1 + p2 + p3 + p4 + cst + cbk
+
+    request_data = {
+        'live': live,
+        'oid': oid,
+        'inv': inv,
+        'amount': amount,
+        'tel': phone,
+        'eml': email,
+        'vid': IPAY_VENDOR_ID,
+        'curr': curr,
+        'p1': p1,
+        'p2': p2,
+        'p3': p3,
+        'p4': p4,
+        'cst': cst,
+        'crl': crl,
+        'hash': sign(data_string),
+        'autopay': "1",
+        'cbk': cbk,
+    }
+    response = post('/transact', data=request_data)
+    try:
+        sid = response.json().get('data', {}).get('sid')
+    except ValueError:
+        sid = None
+    if not sid:
+        raise GatewayError(f"Transaction request failed with status code: {response.status_code}")
+    return sid
+
+
+def push(channel, phone, sid):
+    """
+    Send the payment prompt (STK push) to the buyer's phone; channel is "mpesa" or "airtel".
+    """
+    request_data = {
+        'phone': phone,
+        'sid': sid,
+        'vid': IPAY_VENDOR_ID,
+        'hash': sign(phone + IPAY_VENDOR_ID + sid),
+    }
+    response = post(f'/transact/push/{channel}', json=request_data)
+    if response.status_code != 200:
+        raise GatewayError(f"STK PUSH request failed with status code: {response.status_code}")
+    header_status = response.json().get('header_status')
+    if header_status != 200:
+        raise GatewayError(f"STK PUSH request failed with status: {header_status}")
+
+
+def status_hash(sid):
+    """
+    The status endpoint expects a hash that it only reveals in the error text of a first request signed with
+    vid + sid. Return that hash.
+    """
+    request_data = {
+        'vid': IPAY_VENDOR_ID,
+        'sid': sid,
+        'hash': sign(IPAY_VENDOR_ID + sid),
+    }
+    response = post('/transact/mobilemoney', json=request_data)
+    if response.status_code != 400:
+        raise GatewayError("First Callback request failed")
+    callback_text = response.json().get('error', [{}])[0].get('text') or ''
+    match = re.search(r'hash ([a-fA-F0-9]+)', callback_text)
+    if match is None:
+        raise GatewayError("First Callback request failed")
+    return match.group(1)
+
+
+def transaction_status(sid, hash_value):
+    """
+    Return the gateway's status data for a transaction: "status" is STATUS_COMPLETE or STATUS_PENDING, and a
+    completed transaction carries txncd, channel, msisdn_id, msisdn_idnum and mc (the amount).
+    """
+    request_data = {
+        'vid': IPAY_VENDOR_ID,
+        'sid': sid,
+        'hash': hash_value,
+    }
+    response = post('/transact/mobilemoney', json=request_data)
+    if response.status_code != 200:
+        raise GatewayError("Second Callback request failed")
+    return response.json()
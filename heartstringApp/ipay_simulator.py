@@ -0,0 +1,167 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from heartstringApp import ipay
+
+# Gateway status for a buyer who declined or failed the prompt
+STATUS_FAILED = 'fe2707etr5s4wq'
+
+
+class IpaySimulator:
+    """
+    A stand-in for the iPay mobile-money API, for load and latency tests that must not reach the real gateway.
+    It speaks the same requests and answers that ipay.py relies on: transact, transact/push/<channel> and the
+    two-step transact/mobilemoney status check, and checks the request hashes with IPAY_HASH_KEY.
+
+    latency (+ up to jitter) seconds are added to every request, error_rate of requests answer 503, and each pushed
+    transaction completes confirm_seconds after the prompt unless it is one of the decline_rate that fail.
+    With callbacks, the outcome is also sent to the transaction's callback URL like the real gateway does.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, decline_rate=0.0, confirm_seconds=2.0,
+                 callbacks=False, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.confirm_seconds = confirm_seconds
+        self.callbacks = callbacks
+        self.random = random.Random(seed)
+        self.requests = 0
+        self._transactions = {}
+        self._lock = threading.Lock()
+
+    def handle(self, path, data):
+        """
+        Answer one gateway request. Returns (status_code, payload).
+        """
+        with self._lock:
+            self.requests += 1
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.random.random() < self.error_rate:
+            return 503, {"header_status": 503, "error": [{"text": "Service temporarily unavailable"}]}
+
+        # Accept the paths with or without the /payments/v2 prefix of IPAY_URL
+        route = path[path.find('/transact'):] if '/transact' in path else path
+        if route == '/transact':
+            return self._transact(data)
+        if route in ('/transact/push/mpesa', '/transact/push/airtel'):
+            return self._push(data, route.rsplit('/', 1)[1])
+        if route == '/transact/mobilemoney':
+            return self._status(data)
+        return 404, {"header_status": 404, "error": [{"text": "Not found"}]}
+
+    def _error(self, text):
+        return 400, {"header_status": 400, "error": [{"text": text}]}
+
+    def _transact(self, data):
+        fields = ('live', 'oid', 'inv', 'amount', 'tel', 'eml', 'vid', 'curr', 'p1', 'p2', 'p3', 'p4', 'cst', 'cbk')
+        if data.get('hash') != ipay.sign("".join(str(data.get(field, '')) for field in fields)):
+            return self._error("Invalid hash.")
+        sid = f"SIM{uuid.uuid4().hex[:16]}"
+        with self._lock:
+            self._transactions[sid] = {
+                "oid": data['oid'], "amount": data['amount'], "phone": data['tel'], "cbk": data.get('cbk'),
+                "pushed_at": None, "channel": None, "declined": False,
+            }
+        return 200, {"header_status": 200, "status": True,
+                     "data": {"sid": sid, "oid": data['oid'], "amount": data['amount']}}
+
+    def _push(self, data, channel):
+        sid = data.get('sid', '')
+        transaction = self._transactions.get(sid)
+        if transaction is None or data.get('hash') != ipay.sign(data.get('phone', '') + data.get('vid', '') + sid):
+            return 200, {"header_status": 400, "text": "Invalid transaction or hash."}
+        with self._lock:
+            transaction.update(pushed_at=time.monotonic(), channel=channel.upper(),
+                               declined=self.random.random() < self.decline_rate)
+        if self.callbacks and transaction["cbk"]:
+            timer = threading.Timer(self.confirm_seconds, self._send_callback, [transaction])
+            timer.daemon = True
+            timer.start()
+        return 200, {"header_status": 200, "text": "A push request has been sent to the customer."}
+
+    def status_hash(self, sid):
+        return ipay.sign(f"status:{sid}")
+
+    def _status(self, data):
+        sid = data.get('sid', '')
+        transaction = self._transactions.get(sid)
+        if transaction is None:
+            return self._error("Invalid sid.")
+        if data.get('hash') == ipay.sign(data.get('vid', '') + sid):
+            # The real gateway reveals the hash to check the status with in this error text
+            return self._error(f"Invalid request, use hash {self.status_hash(sid)}")
+        if data.get('hash') != self.status_hash(sid):
+            return self._error("Invalid hash.")
+        return 200, self._result(transaction)
+
+    def _result(self, transaction):
+        pushed_at = transaction["pushed_at"]
+        if pushed_at is None or time.monotonic() - pushed_at < self.confirm_seconds:
+            return {"header_status": 200, "status": ipay.STATUS_PENDING}
+        if transaction["declined"]:
+            return {"header_status": 200, "status": STATUS_FAILED}
+        return {
+            "header_status": 200,
+            "status": ipay.STATUS_COMPLETE,
+            "txncd": f"SIM{transaction['oid'][-8:].upper()}",
+            "channel": transaction["channel"],
+            "msisdn_id": "SIMULATED BUYER",
+            "msisdn_idnum": transaction["phone"],
+            "mc": transaction["amount"],
+            "id": transaction["oid"],
+        }
+
+    def _send_callback(self, transaction):
+        params = dict(self._result(transaction))
+        params.pop("header_status")
+        try:
+            requests.get(transaction["cbk"], params=params, timeout=5)
+        except requests.RequestException as e:
+            print(f"Simulated callback for {transaction['oid']} failed: {e}")
+
+
+def make_server(simulator, host='127.0.0.1', port=0):
+    """
+    An HTTP server for the simulator; point IPAY_URL at http://<host>:<port>/payments/v2 to use it.
+    Call serve_forever() on it, from a thread if needed.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections alive so ipay's connection pool behaves as it does against the real gateway
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            try:
+                if 'json' in (self.headers.get('Content-Type') or ''):
+                    data = json.loads(body or b'{}')
+                else:
+                    data = dict(parse_qsl(body.decode()))
+            except ValueError:
+                status_code, payload = 400, {"header_status": 400, "error": [{"text": "Malformed request."}]}
+            else:
+                status_code, payload = simulator.handle(urlsplit(self.path).path, data)
+
+            response = json.dumps(payload).encode()
+            self.send_response(status_code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
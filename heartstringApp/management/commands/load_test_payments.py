@@ -0,0 +1,224 @@
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+from rest_framework.test import APIClient
+
+from heartstringApp import booking, ipay, payments, seating
+from heartstringApp.ipay_simulator import IpaySimulator, make_server
+from heartstringApp.models import Payment, PaymentAttempt, Showtime, Ticket, UserAccount, Video, VideoPayments
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+class Command(BaseCommand):
+    help = ("Measure purchase throughput end to end against a simulated gateway: start ticket purchases (hold a seat, "
+            "then pay) and video payments through the API, drive them with payment workers until they settle, and "
+            "report latencies. Use a scratch database; the tickets, seats and payments of the run are released and "
+            "deleted afterwards, and taken back out of the revenue rollup, unless --keep is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=100, help="Payments to start")
+        parser.add_argument('--clients', type=int, default=None,
+                            help="Concurrent API clients starting payments (default 8, or 1 on SQLite)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Concurrent payment workers (default 4, or 1 on SQLite, which takes one writer)")
+        parser.add_argument('--ticket-share', type=float, default=0.5,
+                            help="Share of the payments that buy a ticket rather than a video")
+        parser.add_argument('--user', help="Email of the buyer (default: the first user)")
+        parser.add_argument('--video', type=int, help="Id of the video to buy (default: the first video)")
+        parser.add_argument('--showtime', type=int,
+                            help="Id of the show to buy tickets for (default: the first with enough free seats)")
+        parser.add_argument('--amount', default="100")
+        parser.add_argument('--poll-seconds', type=float, default=0.5,
+                            help="Seconds between status checks, in place of PAYMENT_POLL_SECONDS")
+        parser.add_argument('--timeout', type=float, default=120, help="Give up on settling after this long")
+        parser.add_argument('--keep', action='store_true', help="Keep the payments made during the run")
+        parser.add_argument('--simulate', action='store_true',
+                            help="Run the gateway simulator in this process instead of using IPAY_URL")
+        parser.add_argument('--latency', type=float, default=0.2)
+        parser.add_argument('--jitter', type=float, default=0.1)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--decline-rate', type=float, default=0.0)
+        parser.add_argument('--confirm-seconds', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        simulator = server = None
+        if options['simulate']:
+            simulator = IpaySimulator(latency=options['latency'], jitter=options['jitter'],
+                                      error_rate=options['error_rate'], decline_rate=options['decline_rate'],
+                                      confirm_seconds=options['confirm_seconds'])
+            server = make_server(simulator)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            ipay.IPAY_URL = f"http://127.0.0.1:{server.server_address[1]}/payments/v2"
+        elif urlsplit(ipay.IPAY_URL).hostname not in ('127.0.0.1', 'localhost'):
+            raise CommandError(f"IPAY_URL is {ipay.IPAY_URL}; point it at run_ipay_simulator or pass --simulate.")
+        payments.PAYMENT_POLL_SECONDS = options['poll_seconds']
+
+        users = UserAccount.objects.all()
+        user = (users.filter(email=options['user']) if options['user'] else users.order_by('id')).first()
+        if user is None:
+            raise CommandError("A buyer is needed; pass --user.")
+        tickets = round(options['payments'] * min(max(options['ticket_share'], 0), 1))
+        kinds = ['ticket'] * tickets + ['video'] * (options['payments'] - tickets)
+        random.shuffle(kinds)
+        video = self.video(options) if tickets < options['payments'] else None
+        showtime, seat_numbers = self.seats(options, tickets) if tickets else (None, [])
+
+        run = uuid.uuid4().hex[:8]
+        self.ticket_ids = []
+        try:
+            attempt_ids = self.initiate(run, user, video, showtime, seat_numbers, kinds, options)
+            self.settle(attempt_ids, options)
+            self.report(attempt_ids, simulator)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            if not options['keep']:
+                self.clean_up(run)
+
+    def video(self, options):
+        videos = Video.objects.all()
+        video = (videos.filter(pk=options['video']) if options['video'] else videos.order_by('id')).first()
+        if video is None:
+            raise CommandError("A video to pay for is needed; pass --video or --ticket-share 1.")
+        return video
+
+    def seats(self, options, count):
+        showtimes = Showtime.objects.all()
+        if options['showtime']:
+            showtimes = showtimes.filter(pk=options['showtime'])
+        for showtime in showtimes.order_by('id').iterator():
+            seat_numbers = [seat["seat_number"] for seat in seating.available_seats([showtime])][:count]
+            if len(seat_numbers) == count:
+                return showtime, seat_numbers
+        raise CommandError(f"No show has {count} free seats; pass --showtime or a lower --ticket-share.")
+
+    def latencies(self, name, latencies):
+        self.stdout.write(f"  {name} latency p50 {percentile(latencies, 0.5) * 1000:.0f}ms, "
+                          f"p95 {percentile(latencies, 0.95) * 1000:.0f}ms, "
+                          f"max {max(latencies, default=0) * 1000:.0f}ms")
+
+    def initiate(self, run, user, video, showtime, seat_numbers, kinds, options):
+        # The tickets are set up before the clocks start; holding their seats and paying is what gets measured
+        tickets = []
+        for seat_number in seat_numbers:
+            tickets.append(Ticket.objects.create(
+                seat_numbers=seat_number, price=options['amount'], email=user.email, user=user,
+                play_id_id=showtime.play_id_id, showtime=showtime, play_date=showtime.play_date,
+                play_time=showtime.time_slot, ticket_number=uuid.uuid4().hex[:10].upper()))
+            self.ticket_ids.append(tickets[-1].pk)
+        purchases = iter(tickets)
+        plan = [(kind, next(purchases) if kind == 'ticket' else None) for kind in kinds]
+
+        def start(n):
+            kind, ticket = plan[n]
+            client = APIClient(SERVER_NAME='localhost')
+            client.force_authenticate(user)
+            hold_latency = None
+            started = time.monotonic()
+            try:
+                if kind == 'ticket':
+                    response = client.post('/api/seats/hold/', {"ticket_id": ticket.pk, "showtime": showtime.pk,
+                                                                 "seat_numbers": [ticket.seat_numbers]}, format='json')
+                    hold_latency = time.monotonic() - started
+                    if response.status_code == 200:
+                        response = client.post('/api/payments/initiate_payment/',
+                                               {"ticket_id": ticket.pk, "amount": options['amount'],
+                                                "phone": f"2547{n:08d}"}, HTTP_IDEMPOTENCY_KEY=f"load-{run}-{n}")
+                else:
+                    response = client.post('/api/video-payments/initiate_payment/',
+                                           {"video_id": video.pk, "amount": options['amount'],
+                                            "phone": f"2547{n:08d}"}, HTTP_IDEMPOTENCY_KEY=f"load-{run}-{n}")
+            except DatabaseError:
+                # The test client raises what a server would answer with a 500
+                return kind, 500, time.monotonic() - started, hold_latency, {}
+            finally:
+                connection.close()
+            data = getattr(response, 'data', None) or {}
+            return kind, response.status_code, time.monotonic() - started, hold_latency, data.get("data") or {}
+
+        clients = options['clients'] or (1 if connection.vendor == 'sqlite' else 8)
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(start, range(len(plan))))
+        elapsed = time.monotonic() - started
+
+        codes = Counter((kind, code) for kind, code, _, _, _ in results)
+        self.stdout.write(f"Initiated {len(results)} payments in {elapsed:.2f}s "
+                          f"({len(results) / elapsed:.1f}/s), responses {dict(codes)}")
+        for kind in ('ticket', 'video'):
+            latencies = [latency for result_kind, _, latency, _, _ in results if result_kind == kind]
+            if latencies:
+                self.latencies(f"{kind} purchase", latencies)
+        holds = [hold_latency for _, _, _, hold_latency, _ in results if hold_latency is not None]
+        if holds:
+            self.latencies("seat hold", holds)
+        return [data["payment_id"] for _, _, _, _, data in results if "payment_id" in data]
+
+    def settle(self, attempt_ids, options):
+        deadline = time.monotonic() + options['timeout']
+        workers = options['workers'] or (1 if connection.vendor == 'sqlite' else 4)
+        self.worker_errors = Counter()
+
+        def work():
+            try:
+                while time.monotonic() < deadline:
+                    if not PaymentAttempt.objects.filter(pk__in=attempt_ids,
+                                                         status__in=payments.OPEN_STATUSES).exists():
+                        return
+                    try:
+                        processed = payments.process_due(limit=10)
+                    except DatabaseError as e:
+                        # Part of the measurement; the attempt is picked up again once its lease runs out
+                        self.worker_errors[str(e)] += 1
+                        processed = 0
+                    if not processed:
+                        time.sleep(0.05)
+            finally:
+                connection.close()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(work) for _ in range(workers)]:
+                future.result()
+        self.elapsed = time.monotonic() - started
+
+    def report(self, attempt_ids, simulator):
+        attempts = PaymentAttempt.objects.filter(pk__in=attempt_ids)
+        statuses = Counter(attempts.values_list('status', flat=True))
+        settle_times = [(updated_on - added_on).total_seconds() for added_on, updated_on in
+                        attempts.exclude(status__in=payments.OPEN_STATUSES).values_list('added_on', 'updated_on')]
+        completed = statuses.get(PaymentAttempt.Status.COMPLETED, 0)
+
+        self.stdout.write(f"Settled in {self.elapsed:.2f}s: {dict(statuses)}, "
+                          f"{completed / self.elapsed if self.elapsed else 0:.1f} completed payments/s")
+        self.stdout.write(f"  time to settle p50 {percentile(settle_times, 0.5):.2f}s, "
+                          f"p95 {percentile(settle_times, 0.95):.2f}s, max {max(settle_times, default=0):.2f}s")
+        if simulator is not None:
+            self.stdout.write(f"  gateway requests: {simulator.requests}")
+        if self.worker_errors:
+            self.stdout.write(f"  worker errors: {dict(self.worker_errors)}")
+        self.stdout.write(f"  gateway circuit: {ipay.breaker.stats()}")
+
+    def clean_up(self, run):
+        tickets = Ticket.objects.filter(pk__in=self.ticket_ids)
+        attempts = PaymentAttempt.objects.filter(idempotencykey__key__startswith=f"load-{run}-")
+        booking.release_tickets(tickets)
+        Payment.objects.filter(ticket__in=tickets).delete()
+        # Deleting sold tickets and video payments takes them back out of the revenue rollup
+        VideoPayments.objects.filter(pk__in=attempts.values('video_payment')).delete()
+        attempts.delete()
+        tickets.delete()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from heartstringApp import seating
+from heartstringApp.models import PlayTime
+
+
+class Command(BaseCommand):
+    help = "Create missing seat rows for plays' dates and time slots using batched inserts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--play', type=int, help="Only materialize seats for this play id")
+        parser.add_argument('--play-time', type=int, help="Only materialize seats for this play time id")
+        parser.add_argument('--batch-size', type=int, default=seating.SEAT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        play_times = PlayTime.objects.select_related('play_id')
+        if options['play']:
+            play_times = play_times.filter(play_id=options['play'])
+        if options['play_time']:
+            play_times = play_times.filter(pk=options['play_time'])
+        if not play_times.exists():
+            raise CommandError("No play times matched.")
+
+        sent = seating.materialize_seats(play_times, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {sent} seats for {play_times.count()} play times."))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from heartstringApp import payments
+
+
+class Command(BaseCommand):
+    help = "Drive open payment attempts through the gateway. Run with --loop as a long-running worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep processing until interrupted")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds to wait when nothing is due")
+        parser.add_argument('--limit', type=int, default=50, help="Attempts to process per round")
+
+    def handle(self, *args, **options):
+        while True:
+            processed = payments.process_due(limit=options['limit'])
+            if processed:
+                self.stdout.write(f"Processed {processed} payment attempts.")
+            if not options['loop']:
+                break
+            if processed < options['limit']:
+                time.sleep(options['interval'])
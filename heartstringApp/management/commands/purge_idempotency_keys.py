@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from heartstringApp import payments
+
+
+class Command(BaseCommand):
+    help = "Delete payment idempotency keys older than IDEMPOTENCY_KEY_TTL. Run daily from cron."
+
+    def handle(self, *args, **options):
+        deleted = payments.purge_idempotency_keys()
+        self.stdout.write(f"Deleted {deleted} idempotency keys.")
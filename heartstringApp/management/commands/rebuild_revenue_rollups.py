@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from heartstringApp import revenue
+
+
+class Command(BaseCommand):
+    help = ("Recompute the dashboard's daily revenue rollup from all purchased tickets and video payments. Deleted "
+            "sales are taken out as they happen; run it after refunding tickets or writing sales outside the payment "
+            "flow, or nightly to correct any drift.")
+
+    def handle(self, *args, **options):
+        days = revenue.rebuild()
+        self.stdout.write(f"Rebuilt revenue rollup for {days} days.")
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from heartstringApp import payments
+
+
+class Command(BaseCommand):
+    help = ("Settle failed and expired payments that the gateway reports as paid after all. Picks up where the "
+            "previous run stopped; run every minute from cron, or with --loop.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep reconciling until interrupted")
+        parser.add_argument('--interval', type=int, default=60, help="Seconds between runs with --loop")
+        parser.add_argument('--batch-size', type=int, default=payments.RECONCILE_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=payments.RECONCILE_CONCURRENCY,
+                            help="Concurrent gateway status requests")
+
+    def handle(self, *args, **options):
+        while True:
+            # Work through the backlog a batch at a time; a short batch means it is caught up
+            while True:
+                checked, settled = payments.reconcile(options['batch_size'], options['workers'])
+                if checked:
+                    self.stdout.write(f"Checked {checked} ended payments, settled {settled}.")
+                if checked < options['batch_size']:
+                    break
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from heartstringApp import booking
+
+
+class Command(BaseCommand):
+    help = "Release seat holds whose time has passed. Run from cron, or with --loop as a long-running sweeper."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping until interrupted")
+        parser.add_argument('--interval', type=int, default=30, help="Seconds between sweeps with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            released = booking.release_expired_holds()
+            if released:
+                self.stdout.write(f"Released {released} expired seat holds.")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from heartstringApp import qr
+
+
+class Command(BaseCommand):
+    help = ("Render the QR codes of purchased tickets that have none, e.g. because the process that was to render "
+            "them stopped. Run from cron, or with --loop.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping until interrupted")
+        parser.add_argument('--interval', type=int, default=60, help="Seconds between sweeps with --loop")
+        parser.add_argument('--limit', type=int, default=100, help="Tickets to render per round")
+        parser.add_argument('--workers', type=int, default=qr.QR_RENDER_WORKERS, help="Concurrent renders")
+
+    def handle(self, *args, **options):
+        while True:
+            rendered = qr.render_pending(options['limit'], max(options['workers'], 1))
+            if rendered:
+                self.stdout.write(f"Rendered {rendered} ticket QR codes.")
+            if not options['loop']:
+                break
+            if rendered < options['limit']:
+                time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from heartstringApp.ipay_simulator import IpaySimulator, make_server
+
+
+class Command(BaseCommand):
+    help = ("Serve a simulated iPay gateway for load and latency tests. "
+            "Set IPAY_URL to the printed URL in the app and the process_payments worker.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds added to every request")
+        parser.add_argument('--jitter', type=float, default=0.1, help="Up to this many more seconds, at random")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with 503")
+        parser.add_argument('--decline-rate', type=float, default=0.0, help="Share of payments the buyer declines")
+        parser.add_argument('--confirm-seconds', type=float, default=2.0,
+                            help="Seconds after the prompt at which the buyer confirms")
+        parser.add_argument('--callbacks', action='store_true', help="Also send outcomes to the callback URL")
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        simulator = IpaySimulator(latency=options['latency'], jitter=options['jitter'],
+                                  error_rate=options['error_rate'], decline_rate=options['decline_rate'],
+                                  confirm_seconds=options['confirm_seconds'], callbacks=options['callbacks'],
+                                  seed=options['seed'])
+        server = make_server(simulator, options['host'], options['port'])
+        host, port = server.server_address[:2]
+        self.stdout.write(f"Simulated iPay gateway on IPAY_URL = 'http://{host}:{port}/payments/v2'")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {simulator.requests} requests.")
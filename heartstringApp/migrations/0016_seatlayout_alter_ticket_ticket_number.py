@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 00:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0015_ticket_play_date_ticket_play_time_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatLayout',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('theater', models.CharField(choices=[('Alliance Francaise', 'Alliance Francaise'), ('Kenya National Theater', 'Kenya National Theater'), ('Nairobi Cinemas', 'Nairobi Cinemas')], max_length=255, unique=True)),
+                ('layout', models.JSONField()),
+                ('added_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='DEE6FF1E82', max_length=10, unique=True),
+        ),
+    ]
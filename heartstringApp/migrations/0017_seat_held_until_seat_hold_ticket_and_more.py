@@ -0,0 +1,29 @@
+# Generated by Django 4.2 on 2026-10-18 00:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0016_seatlayout_alter_ticket_ticket_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seat',
+            name='held_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='seat',
+            name='hold_ticket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='held_seats', to='heartstringApp.ticket'),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='1E36748761', max_length=10, unique=True),
+        ),
+    ]
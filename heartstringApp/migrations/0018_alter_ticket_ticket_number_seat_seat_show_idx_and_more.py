@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-18 00:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0017_seat_held_until_seat_hold_ticket_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='55B96729BA', max_length=10, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(fields=['play_time', 'time_slot', 'is_booked'], name='seat_show_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(fields=['play_date', 'time_slot'], name='seat_date_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(condition=models.Q(('is_booked', False)), fields=['play_time', 'time_slot'], name='seat_unbooked_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(condition=models.Q(('held_until__isnull', False)), fields=['held_until'], name='seat_hold_expiry_idx'),
+        ),
+    ]
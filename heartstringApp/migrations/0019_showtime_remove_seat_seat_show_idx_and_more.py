@@ -0,0 +1,74 @@
+# Generated by Django 4.2 on 2026-10-18 00:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0018_alter_ticket_ticket_number_seat_seat_show_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Showtime',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('play_date', models.DateField()),
+                ('time_slot', models.CharField(max_length=255)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('theater', models.CharField(choices=[('Alliance Francaise', 'Alliance Francaise'), ('Kenya National Theater', 'Kenya National Theater'), ('Nairobi Cinemas', 'Nairobi Cinemas')], max_length=255)),
+                ('added_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='seat',
+            name='seat_show_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='seat',
+            name='seat_unbooked_idx',
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='1C82226847', max_length=10, unique=True),
+        ),
+        migrations.AddField(
+            model_name='showtime',
+            name='play_id',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='heartstringApp.play'),
+        ),
+        migrations.AddField(
+            model_name='showtime',
+            name='play_time',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='heartstringApp.playtime'),
+        ),
+        migrations.AddField(
+            model_name='seat',
+            name='showtime',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='heartstringApp.showtime'),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='showtime',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='heartstringApp.showtime'),
+        ),
+        migrations.AddIndex(
+            model_name='seat',
+            index=models.Index(condition=models.Q(('is_booked', False)), fields=['showtime'], name='seat_unbooked_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='seat',
+            constraint=models.UniqueConstraint(fields=('showtime', 'seat_number'), name='seat_showtime_number_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='showtime',
+            index=models.Index(fields=['play_id', 'starts_at'], name='showtime_play_start_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='showtime',
+            unique_together={('play_time', 'time_slot')},
+        ),
+    ]
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from django.db import migrations
+
+# Frozen copy of seating.SHOW_TIME_FORMATS so this migration does not depend on app code
+SHOW_TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M%p", "%I %p", "%I%p", "%H.%M")
+
+
+def parse_show_time(play_date, time_slot):
+    text = str(time_slot).strip().upper()
+    for time_format in SHOW_TIME_FORMATS:
+        try:
+            return datetime.combine(play_date, datetime.strptime(text, time_format).time())
+        except ValueError:
+            continue
+    return None
+
+
+def backfill_showtimes(apps, schema_editor):
+    PlayTime = apps.get_model('heartstringApp', 'PlayTime')
+    Seat = apps.get_model('heartstringApp', 'Seat')
+    Ticket = apps.get_model('heartstringApp', 'Ticket')
+    Showtime = apps.get_model('heartstringApp', 'Showtime')
+
+    # Every configured slot, plus any slot that only survives on existing seat rows
+    slots = {}
+    for play_time in PlayTime.objects.select_related('play_id'):
+        for time_slot in filter(None, [play_time.time1, play_time.time2, play_time.time3]):
+            slots[(play_time.id, time_slot)] = play_time
+    play_times = PlayTime.objects.select_related('play_id').in_bulk()
+    for play_time_id, time_slot in Seat.objects.values_list('play_time_id', 'time_slot').distinct():
+        if (play_time_id, time_slot) not in slots and play_time_id in play_times:
+            slots[(play_time_id, time_slot)] = play_times[play_time_id]
+
+    Showtime.objects.bulk_create([
+        Showtime(play_id_id=play_time.play_id_id, play_time_id=play_time.id, play_date=play_time.play_date,
+                 time_slot=time_slot, starts_at=parse_show_time(play_time.play_date, time_slot),
+                 theater=play_time.play_id.theater)
+        for (play_time_id, time_slot), play_time in slots.items()
+    ], batch_size=500, ignore_conflicts=True)
+
+    for showtime in Showtime.objects.all().iterator():
+        Seat.objects.filter(play_time_id=showtime.play_time_id, time_slot=showtime.time_slot, showtime__isnull=True) \
+            .update(showtime=showtime)
+
+    # Tickets only recorded the play, date and slot text; the first show with those is the one they were sold for
+    shows = {}
+    for showtime in Showtime.objects.order_by('id').iterator():
+        shows.setdefault((showtime.play_id_id, showtime.play_date, showtime.time_slot), showtime)
+    for (play_id, play_date, time_slot), showtime in shows.items():
+        Ticket.objects.filter(play_id_id=play_id, play_date=play_date, play_time=time_slot, showtime__isnull=True) \
+            .update(showtime=showtime)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0019_showtime_remove_seat_seat_show_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_showtimes, migrations.RunPython.noop),
+    ]
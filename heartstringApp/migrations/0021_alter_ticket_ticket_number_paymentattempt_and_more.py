@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-18 01:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0020_backfill_showtimes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='EAA66BA386', max_length=10, unique=True),
+        ),
+        migrations.CreateModel(
+            name='PaymentAttempt',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('ticket', 'Ticket'), ('video', 'Video')], max_length=20)),
+                ('channel', models.CharField(choices=[('mpesa', 'M-Pesa'), ('airtel', 'Airtel Money')], default='mpesa', max_length=20)),
+                ('status', models.CharField(choices=[('initiated', 'Initiated'), ('pushed', 'Pushed'), ('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('expired', 'Expired')], default='initiated', max_length=20)),
+                ('oid', models.CharField(max_length=255, unique=True)),
+                ('sid', models.CharField(blank=True, max_length=255)),
+                ('status_hash', models.CharField(blank=True, max_length=255)),
+                ('phone', models.CharField(max_length=255)),
+                ('email', models.EmailField(max_length=254)),
+                ('amount', models.CharField(max_length=100)),
+                ('checks', models.PositiveIntegerField(default=0)),
+                ('next_check_at', models.DateTimeField(blank=True, null=True)),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('added_on', models.DateTimeField(auto_now_add=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='heartstringApp.payment')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='heartstringApp.ticket')),
+                ('user', models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('video', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='heartstringApp.video')),
+                ('video_payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='heartstringApp.videopayments')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='paymentattempt',
+            index=models.Index(fields=['status', 'next_check_at'], name='payment_attempt_due_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0023_jobcheckpoint_alter_ticket_ticket_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='admitted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='0B08671680', max_length=10, unique=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-18 01:25
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_rollup(apps, schema_editor):
+    # Frozen copy of revenue.rebuild(), so existing sales show on the dashboard as soon as it reads the rollup
+    RevenueRollup = apps.get_model('heartstringApp', 'RevenueRollup')
+    Ticket = apps.get_model('heartstringApp', 'Ticket')
+    VideoPayments = apps.get_model('heartstringApp', 'VideoPayments')
+
+    rows = []
+    for kind, queryset, amount in (('ticket', Ticket.objects.filter(purchased=True), 'price'),
+                                   ('stream', VideoPayments.objects.all(), 'amount')):
+        days = queryset.order_by().annotate(day=TruncDate('added_on')).values('day') \
+            .annotate(total=Sum(amount), sales=Count('id'))
+        rows += [RevenueRollup(kind=kind, day=day['day'], amount=day['total'], count=day['sales']) for day in days]
+    RevenueRollup.objects.all().delete()
+    RevenueRollup.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0024_ticket_admitted_at_alter_ticket_ticket_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('ticket', 'Ticket'), ('stream', 'Stream')], max_length=10)),
+                ('day', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='8FA06C02C5', max_length=10, unique=True),
+        ),
+        migrations.AddConstraint(
+            model_name='revenuerollup',
+            constraint=models.UniqueConstraint(fields=('kind', 'day'), name='revenue_rollup_kind_day_uniq'),
+        ),
+        migrations.RunPython(populate_rollup, migrations.RunPython.noop),
+    ]
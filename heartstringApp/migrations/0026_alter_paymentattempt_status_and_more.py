@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 01:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('heartstringApp', '0025_revenuerollup_alter_ticket_ticket_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='paymentattempt',
+            name='status',
+            field=models.CharField(choices=[('initiated', 'Initiated'), ('created', 'Created'), ('pushed', 'Pushed'), ('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('expired', 'Expired')], default='initiated', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='ticket_number',
+            field=models.CharField(default='3E665D737D', max_length=10, unique=True),
+        ),
+    ]
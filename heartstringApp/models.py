@@ -94,6 +94,28 @@ class PlayTime(models.Model):
     objects = models.Manager()
 
 
+class Showtime(models.Model):
+    # One performance: a PlayTime date combined with one of its time slots
+    id = models.AutoField(primary_key=True)
+    play_id = models.ForeignKey(Play, on_delete=models.CASCADE)
+    play_time = models.ForeignKey(PlayTime, on_delete=models.CASCADE)
+    play_date = models.DateField()
+    time_slot = models.CharField(max_length=255)  # the slot as entered, e.g. "18:00" or "6:30 PM"
+    starts_at = models.DateTimeField(null=True, blank=True)  # None when the slot text could not be parsed
+    theater = models.CharField(choices=Play.Theater.choices, max_length=255)
+    added_on = models.DateTimeField(auto_now_add=True)
+    objects = models.Manager()
+
+    class Meta:
+        unique_together = ('play_time', 'time_slot')
+        indexes = [
+            models.Index(fields=['play_id', 'starts_at'], name='showtime_play_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.play_date} {self.time_slot}"
+
+
 class OtherOffers(models.Model):
     id = models.AutoField(primary_key=True)
     play_id = models.ForeignKey(Play, on_delete=models.CASCADE)
@@ -122,9 +144,12 @@ class Ticket(models.Model):
     qr_code = models.ImageField(upload_to='qr_codes/')
     user = models.ForeignKey(UserAccount, on_delete=models.CASCADE, default=None)
     play_id = models.ForeignKey(Play, on_delete=models.CASCADE, default=None)
+    showtime = models.ForeignKey(Showtime, on_delete=models.SET_NULL, null=True, blank=True)
 
     # Additional fields for tracking purchase and payment status
     purchased = models.BooleanField(default=False)
+    # Set when the ticket is scanned at the door
+    admitted_at = models.DateTimeField(null=True, blank=True)
 
     # Add a ticket_number field
     ticket_number = models.CharField(max_length=10, unique=True, default=uuid.uuid4().hex[:10].upper())
@@ -205,6 +230,131 @@ class VideoPayments(models.Model):
     objects = models.Manager()
 
 
+class PaymentAttempt(models.Model):
+    """
+    One mobile-money payment as it moves through the gateway. Requests only create the attempt; the
+    process_payments worker (and the gateway callback) drive it from state to state.
+    """
+    class Kind(models.TextChoices):
+        TICKET = 'ticket', 'Ticket'
+        VIDEO = 'video', 'Video'
+
+    class Channel(models.TextChoices):
+        MPESA = 'mpesa', 'M-Pesa'
+        AIRTEL = 'airtel', 'Airtel Money'
+
+    class Status(models.TextChoices):
+        INITIATED = 'initiated', 'Initiated'
+        # Gateway transaction created, prompt not confirmed sent yet
+        CREATED = 'created', 'Created'
+        PUSHED = 'pushed', 'Pushed'
+        PENDING = 'pending', 'Pending'
+        COMPLETED = 'completed', 'Completed'
+        FAILED = 'failed', 'Failed'
+        EXPIRED = 'expired', 'Expired'
+
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    channel = models.CharField(max_length=20, choices=Channel.choices, default=Channel.MPESA)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.INITIATED)
+    oid = models.CharField(max_length=255, unique=True)
+    sid = models.CharField(max_length=255, blank=True)
+    status_hash = models.CharField(max_length=255, blank=True)
+    phone = models.CharField(max_length=255)
+    email = models.EmailField()
+    amount = models.CharField(max_length=100)
+    ticket = models.ForeignKey(Ticket, on_delete=models.SET_NULL, null=True, blank=True)
+    video = models.ForeignKey(Video, on_delete=models.SET_NULL, null=True, blank=True)
+    user = models.ForeignKey(UserAccount, on_delete=models.SET_NULL, null=True, blank=True, default=None)
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True)
+    video_payment = models.ForeignKey(VideoPayments, on_delete=models.SET_NULL, null=True, blank=True)
+    checks = models.PositiveIntegerField(default=0)
+    next_check_at = models.DateTimeField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    added_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+    objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # The worker's queue: open attempts that are due, oldest first
+            models.Index(fields=['status', 'next_check_at'], name='payment_attempt_due_idx'),
+            # reconcile_payments walks failed and expired attempts in the order they ended
+            models.Index(fields=['status', 'updated_on'], name='payment_attempt_ended_idx'),
+        ]
+
+    def __str__(self):
+        return f'PaymentAttempt {self.oid} ({self.status})'
+
+
+class JobCheckpoint(models.Model):
+    """
+    How far an incremental job got: the (position, last_id) of the last row it handled, so its next run
+    carries on from there.
+    """
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+    position = models.DateTimeField(null=True, blank=True)
+    last_id = models.PositiveIntegerField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+    objects = models.Manager()
+
+    def __str__(self):
+        return f'JobCheckpoint {self.name} at {self.position}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    An Idempotency-Key a client sent with a payment request, and the attempt that request started. A retry with
+    the same key gets that attempt back instead of starting (and charging) a second one.
+    """
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
+    key = models.CharField(max_length=64)
+    # Hash of the request the key was first used with; the same key on a different request is refused
+    fingerprint = models.CharField(max_length=64)
+    attempt = models.ForeignKey(PaymentAttempt, on_delete=models.CASCADE)
+    added_on = models.DateTimeField(auto_now_add=True)
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_user_key_uniq'),
+        ]
+        indexes = [
+            # purge_idempotency_keys deletes by age
+            models.Index(fields=['added_on'], name='idempotency_key_added_idx'),
+        ]
+
+    def __str__(self):
+        return f'IdempotencyKey {self.key}'
+
+
+class RevenueRollup(models.Model):
+    """
+    Ticket or stream revenue and number of sales for one day, added to as payments complete so the dashboard never
+    reads the sales tables themselves. rebuild_revenue_rollups recomputes it from history.
+    """
+    class Kind(models.TextChoices):
+        TICKET = 'ticket'
+        STREAM = 'stream'
+
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    day = models.DateField()
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'day'], name='revenue_rollup_kind_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f'RevenueRollup {self.kind} {self.day}'
+
+
 class VideoAvailability(models.Model):
     id = models.AutoField(primary_key=True)
     video_id = models.ForeignKey(Video, on_delete=models.CASCADE)
@@ -226,18 +376,48 @@ class ViewHistory(models.Model):
     objects = models.Manager()
 
 
+class SeatLayout(models.Model):
+    # One seat layout per theater, same shape as seating.SEAT_LAYOUT: [{"wing": ..., "seats": {row: count}}]
+    id = models.AutoField(primary_key=True)
+    theater = models.CharField(choices=Play.Theater.choices, max_length=255, unique=True)
+    layout = models.JSONField()
+    added_on = models.DateTimeField(auto_now_add=True)
+    objects = models.Manager()
+
+    def __str__(self):
+        return self.theater
+
+
 class Seat(models.Model):
+    # Indexed through seat_showtime_number_uniq, which leads with showtime
+    showtime = models.ForeignKey(Showtime, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     play_time = models.ForeignKey(PlayTime, on_delete=models.CASCADE)
     play_date = models.DateField()
     seat_number = models.CharField(max_length=10)  # e.g., "A1"
     wing = models.CharField(max_length=50)  # New field to represent seat's wing (Left, Center, Right)
     time_slot = models.CharField(max_length=255)  # e.g., "time1", "time2", "time3"
     is_booked = models.BooleanField(default=False)
+    # Temporary hold while the ticket's payment is in flight; an expired hold counts as free
+    held_until = models.DateTimeField(null=True, blank=True)
+    hold_ticket = models.ForeignKey(Ticket, on_delete=models.SET_NULL, null=True, blank=True, related_name='held_seats')
     objects = models.Manager()
 
     class Meta:
         # Ensure uniqueness per play_time, seat_number, wing, and potentially row if added
         unique_together = ('play_time', 'seat_number', 'wing','time_slot')
+        constraints = [
+            # Seat maps, bitmaps and bookings of one show are a single equality lookup on this index
+            models.UniqueConstraint(fields=['showtime', 'seat_number'], name='seat_showtime_number_uniq'),
+        ]
+        indexes = [
+            # SeatViewSet.list filters by date and time slot
+            models.Index(fields=['play_date', 'time_slot'], name='seat_date_slot_idx'),
+            # Availability lists only ever want unbooked seats (partial index where the backend supports it)
+            models.Index(fields=['showtime'], condition=models.Q(is_booked=False), name='seat_unbooked_idx'),
+            # Expired hold sweeps
+            models.Index(fields=['held_until'], condition=models.Q(held_until__isnull=False),
+                         name='seat_hold_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"{self.play_time.play_id.title} - {self.wing} Wing - {self.time_slot} - Seat {self.seat_number} - {'Booked' if self.is_booked else 'Available'}"
@@ -0,0 +1,39 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+# List endpoints answer one page at a time; clients follow "next" until it is null
+API_PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 50)
+API_MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 200)
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination on the primary key. Every page is one range scan on the primary key index however deep the
+    client pages, and rows added in the meantime never shift or repeat rows across pages.
+    """
+    ordering = '-id'
+    page_size = API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = API_MAX_PAGE_SIZE
+
+
+def paginate(request, queryset, serialize, message, ordering='-id'):
+    """
+    Answer with one page of queryset in the usual envelope, plus "next" and "previous" links. serialize turns the
+    page's rows into the response data. ?page_size= picks the page length (up to API_MAX_PAGE_SIZE) and ?count=true
+    adds the total number of rows, which costs a COUNT over the whole queryset.
+    """
+    paginator = IdCursorPagination()
+    paginator.ordering = ordering
+    page = paginator.paginate_queryset(queryset, request)
+    response = {
+        "error": False,
+        "message": message,
+        "data": serialize(page),
+        "next": paginator.get_next_link(),
+        "previous": paginator.get_previous_link(),
+    }
+    if request.query_params.get('count', '').lower() in ('1', 'true', 'yes'):
+        response["count"] = queryset.count()
+    return Response(response)
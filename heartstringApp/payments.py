@@ -0,0 +1,522 @@
+import hashlib
+import hmac
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from heartstringApp import booking, ipay, qr, revenue
+from heartstringApp.breaker import BulkheadFull, CircuitOpen
+from heartstringApp.models import IdempotencyKey, JobCheckpoint, PaymentAttempt, Payment, Seat, Ticket, \
+    VideoPayments
+
+Status = PaymentAttempt.Status
+
+# Seconds between status checks while the buyer confirms the prompt on their phone
+PAYMENT_POLL_SECONDS = getattr(settings, 'PAYMENT_POLL_SECONDS', 5)
+# An attempt that is not confirmed this long after it started is given up
+PAYMENT_EXPIRY_SECONDS = getattr(settings, 'PAYMENT_EXPIRY_SECONDS', 3 * 60)
+# A worker owns an attempt for this long while it talks to the gateway, so two workers never run the same step
+PAYMENT_LEASE_SECONDS = 60
+# An attempt whose step fails unexpectedly is retried with a doubling delay, up to this long
+PAYMENT_ERROR_MAX_BACKOFF_SECONDS = 5 * 60
+
+# Public URL of the callback endpoint (.../api/payments/callback/). When set, the gateway reports the outcome and
+# the worker only checks in now and then in case a callback is lost.
+PAYMENT_CALLBACK_URL = getattr(settings, 'PAYMENT_CALLBACK_URL', None)
+PAYMENT_CALLBACK_FALLBACK_SECONDS = getattr(settings, 'PAYMENT_CALLBACK_FALLBACK_SECONDS', 30)
+PAYMENT_CALLBACK_SECRET = getattr(settings, 'PAYMENT_CALLBACK_SECRET', settings.SECRET_KEY)
+
+# Gateway statuses that end a payment without success
+CALLBACK_FAILURES = {
+    'fe2707etr5s4wq': "Payment failed.",
+    'cr5i3pgy9867e1': "Transaction code already used.",
+    'dtfi4p7yty45wq': "Less than the full amount was paid.",
+    'eq3i7p5yt7645e': "More than the full amount was paid.",
+}
+
+# Idempotency keys are kept this long; a client retrying later than this starts a new payment
+IDEMPOTENCY_KEY_TTL = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60)
+
+# reconcile_payments asks the gateway about failed and expired attempts once they have been over this long, in
+# batches of RECONCILE_BATCH_SIZE with at most RECONCILE_CONCURRENCY gateway requests at a time
+RECONCILE_DELAY_SECONDS = getattr(settings, 'RECONCILE_DELAY_SECONDS', 5 * 60)
+RECONCILE_BATCH_SIZE = getattr(settings, 'RECONCILE_BATCH_SIZE', 100)
+RECONCILE_CONCURRENCY = getattr(settings, 'RECONCILE_CONCURRENCY', 4)
+RECONCILE_CHECKPOINT = 'reconcile_payments'
+
+# Left on a completed attempt whose ticket could not get its seats back
+SEATS_LOST_MESSAGE = "Paid after the seats were released; the ticket needs new seats or a refund."
+# An open attempt the gateway reports paid with another amount is failed with this message
+AMOUNT_MISMATCH_MESSAGE = "Paid amount does not match the payment."
+
+OPEN_STATUSES = (Status.INITIATED, Status.CREATED, Status.PUSHED, Status.PENDING)
+ENDED_STATUSES = (Status.FAILED, Status.EXPIRED)
+
+
+class IdempotencyConflict(Exception):
+    """
+    An Idempotency-Key was sent again with a different request.
+    """
+
+
+class PaymentInProgress(Exception):
+    """
+    The ticket already has an open payment; it has to finish or end before another one starts.
+    """
+
+    def __init__(self, attempt):
+        super().__init__("This ticket already has a payment in progress.")
+        self.attempt = attempt
+
+
+def start_ticket_payment(user, ticket, amount, phone, channel=PaymentAttempt.Channel.MPESA):
+    """
+    Record a ticket payment and queue it for the worker. No gateway request is made here.
+    Raises PaymentInProgress while another payment of the ticket is open, so its seats are only paid for once.
+    """
+    with transaction.atomic():
+        # The ticket's row lock makes concurrent starts for the same ticket take turns
+        Ticket.objects.select_for_update().filter(pk=ticket.pk).first()
+        open_attempt = PaymentAttempt.objects.filter(ticket=ticket, status__in=OPEN_STATUSES).first()
+        if open_attempt is not None:
+            raise PaymentInProgress(open_attempt)
+        return PaymentAttempt.objects.create(
+            kind=PaymentAttempt.Kind.TICKET,
+            channel=channel,
+            oid=f"{ticket.ticket_number}-{uuid.uuid4().hex[:8]}",
+            phone=phone,
+            email=user.email,
+            amount=str(amount),
+            ticket=ticket,
+            user=user,
+            next_check_at=timezone.now(),
+        )
+
+
+def start_video_payment(user, video, amount, phone, channel=PaymentAttempt.Channel.MPESA):
+    return PaymentAttempt.objects.create(
+        kind=PaymentAttempt.Kind.VIDEO,
+        channel=channel,
+        oid=f"{int(time.time())}-{uuid.uuid4()}",
+        phone=phone,
+        email=user.email,
+        amount=str(amount),
+        video=video,
+        user=user,
+        next_check_at=timezone.now(),
+    )
+
+
+def request_fingerprint(*parts):
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def start_once(user, key, fingerprint, start):
+    """
+    Call start() to create an attempt unless this user already sent key; then return that first attempt instead,
+    whatever state it has reached. Returns (attempt, replayed). Without a key start() is simply called.
+    Raises IdempotencyConflict when the key was first used with a request of another fingerprint.
+    """
+    if not key:
+        return start(), False
+
+    existing = IdempotencyKey.objects.select_related('attempt').filter(user=user, key=key).first()
+    if existing is None:
+        try:
+            with transaction.atomic():
+                attempt = start()
+                IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint, attempt=attempt)
+            return attempt, False
+        except IntegrityError:
+            # A concurrent retry with the same key committed first; its attempt is the one to answer with
+            existing = IdempotencyKey.objects.select_related('attempt').filter(user=user, key=key).first()
+            if existing is None:
+                raise
+
+    if existing.fingerprint != fingerprint:
+        raise IdempotencyConflict("This Idempotency-Key was already used for a different payment.")
+    return existing.attempt, True
+
+
+def purge_idempotency_keys():
+    """
+    Delete idempotency keys older than IDEMPOTENCY_KEY_TTL. Returns the number deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(added_on__lt=cutoff).delete()
+    return deleted
+
+
+def _move(attempt, from_status, to_status, **fields):
+    """
+    Apply a transition only if the attempt is still in from_status; the callback and the worker may race.
+    Returns True when this call made the transition.
+    """
+    fields.update(status=to_status, updated_on=timezone.now())
+    moved = PaymentAttempt.objects.filter(pk=attempt.pk, status=from_status).update(**fields)
+    if moved:
+        for name, value in fields.items():
+            setattr(attempt, name, value)
+    else:
+        attempt.refresh_from_db()
+    return bool(moved)
+
+
+def fail(attempt, message, to_status=Status.FAILED):
+    """
+    Give up on an open attempt and hand its seats back, unless another payment of the ticket is still open.
+    """
+    if attempt.status not in OPEN_STATUSES:
+        return attempt
+    with transaction.atomic():
+        if _move(attempt, attempt.status, to_status, message=message[:255], next_check_at=None) \
+                and attempt.ticket_id is not None \
+                and not PaymentAttempt.objects.filter(ticket_id=attempt.ticket_id, status__in=OPEN_STATUSES).exists():
+            booking.release_holds(attempt.ticket)
+    return attempt
+
+
+def _payment_record(attempt, data):
+    # The gateway does not always send every field; fall back to what the attempt knows, since the columns are
+    # NOT NULL and a confirmed payment must still be recorded
+    return {
+        'ref_number': data.get('txncd') or attempt.sid,
+        'payment_mode': data.get('channel') or attempt.channel.upper(),
+        'msisdn': data.get('msisdn_id') or '',
+        'msisdn_idnum': data.get('msisdn_idnum') or attempt.phone,
+        'amount': data.get('mc') or attempt.amount,
+        'user': attempt.user,
+    }
+
+
+def complete(attempt, data):
+    """
+    Record a confirmed payment of an open attempt: create the Payment or VideoPayments row, book the ticket's seats
+    and mark it purchased. A ticket that lost a seat to another buyer is not marked purchased; the attempt is
+    completed with a message flagging it for new seats or a refund, as in _settle().
+    Safe to call more than once for the same attempt; only the first call has an effect.
+    Ended attempts no longer hold their seats and are left alone; _settle() handles those.
+    data is the gateway's transaction data (txncd, channel, msisdn_id, msisdn_idnum, mc).
+    """
+    with transaction.atomic():
+        locked = PaymentAttempt.objects.select_for_update().select_related('ticket', 'video', 'user') \
+            .get(pk=attempt.pk)
+        if locked.status not in OPEN_STATUSES:
+            return locked
+
+        record = _payment_record(locked, data)
+        locked.message = ""
+        if locked.kind == PaymentAttempt.Kind.TICKET:
+            locked.payment = Payment.objects.create(ticket=locked.ticket, **record)
+            if locked.ticket is not None and not _book_seats(locked.ticket):
+                locked.message = SEATS_LOST_MESSAGE
+            elif locked.ticket is not None:
+                # Guarded, so a ticket paid for twice is only counted as sold once
+                sold = Ticket.objects.filter(pk=locked.ticket.pk, purchased=False).update(purchased=True)
+                locked.ticket.purchased = True
+                qr.enqueue([locked.ticket.pk])
+                if sold:
+                    revenue.record([revenue.ticket_sale(locked.ticket)])
+        else:
+            locked.video_payment = VideoPayments.objects.create(video=locked.video, **record)
+            revenue.record([revenue.stream_sale(locked.video_payment)])
+
+        locked.status = Status.COMPLETED
+        locked.next_check_at = None
+        locked.save()
+    return locked
+
+
+def callback_signature(oid):
+    return hmac.new(PAYMENT_CALLBACK_SECRET.encode(), f"callback:{oid}".encode(), hashlib.sha256).hexdigest()
+
+
+def callback_url(attempt):
+    # Every attempt gets its own URL; the signature proves the gateway is answering a transaction we created
+    if not PAYMENT_CALLBACK_URL:
+        return None
+    return f"{PAYMENT_CALLBACK_URL.rstrip('/')}/{attempt.oid}/{callback_signature(attempt.oid)}/"
+
+
+def _amount_matches(expected, paid):
+    try:
+        return paid is None or Decimal(str(paid)) == Decimal(str(expected))
+    except InvalidOperation:
+        return False
+
+
+def handle_callback(oid, signature):
+    """
+    Act on a gateway callback for its attempt. Returns the attempt, or None when the signature does not match.
+    The callback is only a nudge: the outcome is read from the gateway's status endpoint, never taken from the
+    callback's own parameters. Callbacks may be repeated or arrive after the attempt ended; a payment confirmed after
+    its attempt ended is settled like reconcile_payments would, rebooking its seats if they are still free.
+    """
+    if not hmac.compare_digest(callback_signature(oid), signature):
+        return None
+    attempt = PaymentAttempt.objects.filter(oid=oid).first()
+    if attempt is None or attempt.status == Status.COMPLETED or not attempt.sid:
+        # Without a transaction there is nothing the gateway could have confirmed yet
+        return attempt
+
+    data = _gateway_status(attempt.sid, attempt.status_hash)
+    if isinstance(data, Exception):
+        # The worker, or reconcile_payments for an ended attempt, asks the gateway again later
+        print(f"Payment {attempt.oid}: callback could not be confirmed: {data}")
+        return attempt
+
+    gateway_status = data.get('status')
+    if attempt.status in ENDED_STATUSES:
+        if gateway_status == ipay.STATUS_COMPLETE:
+            _settle([(attempt.pk, data)])
+            attempt.refresh_from_db()
+        return attempt
+    if gateway_status == ipay.STATUS_COMPLETE:
+        if not _amount_matches(attempt.amount, data.get('mc')):
+            return fail(attempt, AMOUNT_MISMATCH_MESSAGE)
+        return complete(attempt, data)
+    if gateway_status in CALLBACK_FAILURES:
+        return fail(attempt, CALLBACK_FAILURES[gateway_status])
+    # Still pending: nothing to do until the next callback or check
+    return attempt
+
+
+def _expired(attempt, now):
+    return attempt.added_on + timedelta(seconds=PAYMENT_EXPIRY_SECONDS) <= now
+
+
+def advance(attempt):
+    """
+    Run the next gateway step of an open attempt:
+    initiated -> created (transaction created), created -> pushed (prompt sent), pushed -> pending (status hash
+    obtained), pending -> completed, or pending again until the attempt expires.
+    """
+    now = timezone.now()
+    poll_seconds = PAYMENT_CALLBACK_FALLBACK_SECONDS if PAYMENT_CALLBACK_URL else PAYMENT_POLL_SECONDS
+    next_check_at = now + timedelta(seconds=poll_seconds)
+    if _expired(attempt, now):
+        return fail(attempt, "Payment was not confirmed in time.", Status.EXPIRED)
+
+    try:
+        if attempt.status == Status.INITIATED:
+            inv = attempt.ticket.ticket_number if attempt.ticket_id else str(attempt.video_id)
+            crl = "0" if attempt.channel == PaymentAttempt.Channel.AIRTEL else "1"
+            sid = ipay.create_transaction(attempt.oid, inv, attempt.amount, attempt.phone, attempt.email, crl,
+                                          callback_url=callback_url(attempt))
+            # Kept before pushing, so a push that goes wrong is never followed by a second transaction
+            _move(attempt, Status.INITIATED, Status.CREATED, sid=sid)
+
+        if attempt.status == Status.CREATED:
+            if attempt.checks:
+                # An earlier push got no clear answer and the prompt may have reached the phone; follow the
+                # transaction's status from here instead of prompting (and maybe charging) the buyer again
+                _move(attempt, Status.CREATED, Status.PUSHED, checks=0, next_check_at=next_check_at)
+            else:
+                _move(attempt, Status.CREATED, Status.CREATED, checks=1)
+                ipay.push(attempt.channel, attempt.phone, attempt.sid)
+                _move(attempt, Status.CREATED, Status.PUSHED, checks=0, next_check_at=next_check_at)
+
+        elif attempt.status == Status.PUSHED:
+            status_hash = ipay.status_hash(attempt.sid)
+            _move(attempt, Status.PUSHED, Status.PENDING, status_hash=status_hash, next_check_at=next_check_at)
+
+        elif attempt.status == Status.PENDING:
+            data = ipay.transaction_status(attempt.sid, attempt.status_hash)
+            if data.get("status") == ipay.STATUS_COMPLETE:
+                if not _amount_matches(attempt.amount, data.get('mc')):
+                    return fail(attempt, AMOUNT_MISMATCH_MESSAGE)
+                return complete(attempt, data)
+            if data.get("status") != ipay.STATUS_PENDING:
+                return fail(attempt, "Unexpected callback status")
+            _move(attempt, Status.PENDING, Status.PENDING, checks=attempt.checks + 1, next_check_at=next_check_at)
+
+    except ipay.GatewayError as e:
+        return fail(attempt, str(e))
+    except (CircuitOpen, BulkheadFull) as e:
+        # The gateway is known to be struggling; wait for the breaker's cool-down instead of adding load
+        print(f"Payment {attempt.oid}: {e}, retrying later")
+        # Refused before anything was sent, so a push held back here is still safe to send later
+        unsent = {'checks': 0} if attempt.status == Status.CREATED else {}
+        PaymentAttempt.objects.filter(pk=attempt.pk, status=attempt.status) \
+            .update(next_check_at=now + timedelta(seconds=ipay.breaker.open_seconds), **unsent)
+    except (requests.RequestException, ValueError) as e:
+        # Network trouble or a garbled response: try the same step again on the next round
+        print(f"Payment {attempt.oid}: {attempt.status} step failed, retrying: {e}")
+        PaymentAttempt.objects.filter(pk=attempt.pk, status=attempt.status).update(next_check_at=next_check_at)
+    return attempt
+
+
+def process_due(limit=50):
+    """
+    Advance every open attempt whose next check is due. Several workers can run this side by side.
+    Returns the number of attempts processed.
+    """
+    now = timezone.now()
+    due = PaymentAttempt.objects.filter(status__in=OPEN_STATUSES, next_check_at__lte=now) \
+        .order_by('next_check_at').values_list('pk', 'next_check_at')[:limit]
+
+    processed = 0
+    for pk, next_check_at in list(due):
+        # Lease the attempt; another worker that read the same row loses this conditional update
+        leased = PaymentAttempt.objects.filter(pk=pk, next_check_at=next_check_at) \
+            .update(next_check_at=now + timedelta(seconds=PAYMENT_LEASE_SECONDS))
+        if not leased:
+            continue
+        try:
+            advance(PaymentAttempt.objects.select_related('ticket', 'video', 'user').get(pk=pk))
+            cache.delete(_errors_key(pk))
+        except Exception as e:
+            # One broken attempt must not stop the worker; it is retried later, backing off while it keeps failing
+            _back_off(pk, e)
+        processed += 1
+    return processed
+
+
+def _errors_key(pk):
+    return f"payment:errors:{pk}"
+
+
+def _back_off(pk, error):
+    key = _errors_key(pk)
+    cache.add(key, 0, PAYMENT_ERROR_MAX_BACKOFF_SECONDS * 2)
+    errors = cache.incr(key)
+    delay = min(PAYMENT_POLL_SECONDS * 2 ** errors, PAYMENT_ERROR_MAX_BACKOFF_SECONDS)
+    print(f"Payment attempt {pk} failed unexpectedly ({errors} in a row), retrying in {delay}s: {error!r}")
+    try:
+        PaymentAttempt.objects.filter(pk=pk, status__in=OPEN_STATUSES) \
+            .update(next_check_at=timezone.now() + timedelta(seconds=delay))
+    except DatabaseError as e:
+        # The lease taken by process_due runs out by itself
+        print(f"Payment attempt {pk} could not be rescheduled: {e}")
+
+
+def _gateway_status(sid, status_hash):
+    # Runs in the reconcile thread pool, so it only talks to the gateway and never to the database
+    try:
+        return ipay.transaction_status(sid, status_hash or ipay.status_hash(sid))
+    except (ipay.GatewayError, CircuitOpen, BulkheadFull, requests.RequestException, ValueError) as e:
+        return e
+
+
+def _book_seats(ticket):
+    """
+    Book every seat of a paid ticket: confirm the seats still held for it and book again the ones it lost, e.g.
+    because its attempt ended and handed them back. All or nothing; returns False, holding none of the seats, when
+    another buyer has one of them by now.
+    """
+    seat_numbers = [seat_number.strip() for seat_number in ticket.seat_numbers.split(',') if seat_number.strip()]
+    kept = set(Seat.objects.filter(hold_ticket=ticket).values_list('seat_number', flat=True))
+    lost = [seat_number for seat_number in seat_numbers if seat_number not in kept]
+    if lost and (ticket.showtime is None or not booking.book_seat_numbers(
+            ticket.showtime, lost, all_or_nothing=True, ticket=ticket).complete):
+        booking.release_tickets([ticket])
+        return False
+    booking.confirm_holds(ticket)
+    return True
+
+
+def _settle(paid):
+    """
+    Complete the ended attempts the gateway reports as paid, given as [(attempt_id, data)], in one transaction with
+    one bulk update of the attempts. One paid with another amount is not settled but keeps a message saying so, for
+    someone to review or refund. Returns the settled attempts.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        attempts = PaymentAttempt.objects.select_for_update().select_related('ticket__showtime', 'video', 'user') \
+            .filter(pk__in=[pk for pk, data in paid], status__in=ENDED_STATUSES).in_bulk()
+        settled = []
+        for pk, data in paid:
+            if pk not in attempts:
+                continue
+            if _amount_matches(attempts[pk].amount, data.get('mc')):
+                settled.append((attempts[pk], data))
+            else:
+                # updated_on is left alone, so the flagged attempt does not come round to reconcile again
+                message = f"Paid {data.get('mc')} instead of {attempts[pk].amount}; needs review or a refund."
+                print(f"Payment {attempts[pk].oid}: {message}")
+                PaymentAttempt.objects.filter(pk=pk).update(message=message[:255])
+        if not settled:
+            return []
+
+        tickets = [(attempt, data) for attempt, data in settled if attempt.kind == PaymentAttempt.Kind.TICKET]
+        videos = [(attempt, data) for attempt, data in settled if attempt.kind == PaymentAttempt.Kind.VIDEO]
+        # One INSERT per payment: bulk_create() does not return primary keys on MySQL, and the attempts link to them
+        for attempt, data in tickets:
+            attempt.payment = Payment.objects.create(ticket=attempt.ticket, **_payment_record(attempt, data))
+        for attempt, data in videos:
+            attempt.video_payment = VideoPayments.objects.create(video=attempt.video, **_payment_record(attempt, data))
+
+        purchased = []
+        for attempt, data in settled:
+            attempt.status = Status.COMPLETED
+            attempt.message = ""
+            attempt.next_check_at = None
+            attempt.updated_on = now
+            if attempt.ticket is not None:
+                if _book_seats(attempt.ticket):
+                    purchased.append(attempt.ticket)
+                else:
+                    attempt.message = SEATS_LOST_MESSAGE
+        PaymentAttempt.objects.bulk_update(
+            [attempt for attempt, data in settled],
+            ['status', 'message', 'next_check_at', 'updated_on', 'payment', 'video_payment'])
+        sold = Ticket.objects.select_for_update().filter(pk__in=[ticket.pk for ticket in purchased], purchased=False) \
+            .only('id', 'price', 'added_on').in_bulk()
+        Ticket.objects.filter(pk__in=[ticket.pk for ticket in purchased]).update(purchased=True)
+        qr.enqueue(ticket.pk for ticket in purchased)
+        # Tickets that were already paid for by another attempt are not sold again
+        revenue.record([revenue.ticket_sale(ticket) for ticket in sold.values()] +
+                       [revenue.stream_sale(attempt.video_payment) for attempt, data in videos])
+    return [attempt for attempt, data in settled]
+
+
+def reconcile(limit=RECONCILE_BATCH_SIZE, workers=RECONCILE_CONCURRENCY):
+    """
+    Ask the gateway about the next batch of failed and expired attempts, in the order they ended, and settle the
+    ones that were paid after all (e.g. confirmed on the phone after the attempt expired). The checkpoint moves past
+    every attempt the gateway answered for, so each run only looks at attempts that ended since the last one.
+    Returns (checked, settled).
+    """
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=RECONCILE_CHECKPOINT)
+    # Give late confirmations time to reach the gateway before its answer is taken as final
+    until = timezone.now() - timedelta(seconds=RECONCILE_DELAY_SECONDS)
+    ended = PaymentAttempt.objects.filter(status__in=ENDED_STATUSES, updated_on__lte=until).exclude(sid='')
+    if checkpoint.position is not None:
+        ended = ended.filter(Q(updated_on__gt=checkpoint.position) |
+                             Q(updated_on=checkpoint.position, pk__gt=checkpoint.last_id))
+    batch = list(ended.order_by('updated_on', 'pk').values_list('pk', 'sid', 'status_hash', 'updated_on')[:limit])
+    if not batch:
+        return 0, 0
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        answers = list(pool.map(_gateway_status, [sid for pk, sid, status_hash, updated_on in batch],
+                                [status_hash for pk, sid, status_hash, updated_on in batch]))
+
+    paid = []
+    reached = None
+    checked = 0
+    for (pk, sid, status_hash, updated_on), answer in zip(batch, answers):
+        if isinstance(answer, Exception) and not isinstance(answer, ipay.GatewayError):
+            # No answer this time; the next run starts again from this attempt
+            print(f"Reconcile stopped at payment attempt {pk}: {answer}")
+            break
+        reached = (updated_on, pk)
+        checked += 1
+        if isinstance(answer, dict) and answer.get('status') == ipay.STATUS_COMPLETE:
+            paid.append((pk, answer))
+
+    settled = _settle(paid)
+    if reached is not None:
+        checkpoint.position, checkpoint.last_id = reached
+        checkpoint.save(update_fields=['position', 'last_id', 'updated_on'])
+    return checked, len(settled)
@@ -0,0 +1,104 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from heartstringApp import admission
+from heartstringApp.models import Ticket
+
+# Ticket QR codes are rendered by a small thread pool in each process once a payment completes, so the PNG encoding
+# never runs in a request or holds up the payment worker. The render_ticket_qr_codes sweep catches any that were lost.
+QR_RENDER_WORKERS = getattr(settings, 'QR_RENDER_WORKERS', 2)
+# A render claims its ticket for this long so two workers never render the same ticket
+QR_RENDER_LOCK_SECONDS = 60
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def png(data, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, fill_color="black",
+        back_color="white"):
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    buffer = BytesIO()
+    qr.make_image(fill_color=fill_color, back_color=back_color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def pending():
+    """
+    Purchased tickets that have no QR code yet.
+    """
+    return Ticket.objects.filter(purchased=True, qr_code='')
+
+
+def render(ticket):
+    """
+    Render and store the QR code of a purchased ticket that has none. Returns False without doing anything when
+    another worker is rendering the same ticket.
+    """
+    key = f"qr:rendering:{ticket.pk}"
+    if not cache.add(key, True, QR_RENDER_LOCK_SECONDS):
+        return False
+    try:
+        ticket.refresh_from_db(fields=['qr_code', 'purchased', 'showtime'])
+        if ticket.qr_code or not ticket.purchased:
+            return True
+
+        # The code only carries the signed admission token; the door looks the ticket up from it
+        image = png(admission.ticket_token(ticket), error_correction=qrcode.constants.ERROR_CORRECT_M)
+        ticket.qr_code.save(f"{ticket.ticket_number}.png", ContentFile(image), save=False)
+        # Only this column, so a concurrent save of the ticket's other fields is not overwritten
+        Ticket.objects.filter(pk=ticket.pk).update(qr_code=ticket.qr_code.name)
+        return True
+    finally:
+        cache.delete(key)
+
+
+def _render_by_id(ticket_id):
+    try:
+        render(Ticket.objects.get(pk=ticket_id))
+    except Exception as e:
+        # The ticket stays pending and the sweep tries it again
+        print(f"Rendering the QR code of ticket {ticket_id} failed: {e}")
+    finally:
+        connection.close()
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=QR_RENDER_WORKERS, thread_name_prefix='qr')
+    return _executor
+
+
+def enqueue(ticket_ids):
+    """
+    Render the tickets' QR codes in the background once the surrounding transaction commits.
+    """
+    ticket_ids = list(ticket_ids)
+    if ticket_ids:
+        transaction.on_commit(lambda: [executor().submit(_render_by_id, ticket_id) for ticket_id in ticket_ids])
+
+
+def render_pending(limit=100, workers=QR_RENDER_WORKERS):
+    """
+    Render up to limit pending QR codes with a pool of workers. Returns the number of tickets tried.
+    """
+    ticket_ids = list(pending().order_by('pk').values_list('pk', flat=True)[:limit])
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_render_by_id, ticket_ids))
+    return len(ticket_ids)
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+from heartstringApp import versions
+from heartstringApp.models import RevenueRollup, Ticket, VideoPayments
+
+Kind = RevenueRollup.Kind
+
+
+def _add(kind, day, amount, count):
+    # An UPDATE with F() expressions, so concurrent completions on the same day add up instead of overwriting
+    if RevenueRollup.objects.filter(kind=kind, day=day).update(amount=F('amount') + amount, count=F('count') + count):
+        return
+    try:
+        with transaction.atomic():
+            RevenueRollup.objects.create(kind=kind, day=day, amount=amount, count=count)
+    except IntegrityError:
+        # Another completion created the day's row first
+        RevenueRollup.objects.filter(kind=kind, day=day).update(amount=F('amount') + amount, count=F('count') + count)
+
+
+def _totals(sales):
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    for kind, day, amount in sales:
+        totals[kind, day][0] += Decimal(str(amount))
+        totals[kind, day][1] += 1
+    return sorted(totals.items())
+
+
+def record(sales):
+    """
+    Add completed sales, given as [(kind, day, amount)], to the rollup. Call it in the transaction that completes
+    them, so a rolled back payment is not counted. Sales on the same day cost one statement together.
+    """
+    totals = _totals(sales)
+    for (kind, day), (amount, count) in totals:
+        _add(kind, day, amount, count)
+    # Sales completed with update() and bulk_create() send no signals, so the dashboard is invalidated here
+    if totals:
+        versions.bump([versions.DASHBOARD])
+
+
+def remove(sales):
+    """
+    Take deleted sales, given as [(kind, day, amount)], back out of the rollup. Days without a row are left alone,
+    never written as negative totals.
+    """
+    totals = _totals(sales)
+    for (kind, day), (amount, count) in totals:
+        RevenueRollup.objects.filter(kind=kind, day=day, count__gte=count) \
+            .update(amount=F('amount') - amount, count=F('count') - count)
+    if totals:
+        versions.bump([versions.DASHBOARD])
+
+
+def ticket_sale(ticket):
+    # Tickets are counted on the day they were issued, as the dashboard always has
+    return Kind.TICKET, ticket.added_on.date(), ticket.price
+
+
+def stream_sale(video_payment):
+    return Kind.STREAM, video_payment.added_on.date(), video_payment.amount
+
+
+def rebuild():
+    """
+    Recompute the whole rollup from purchased tickets and video payments. Deletions are taken out as they happen, but
+    a ticket marked unpurchased again (a refund) or a sale written outside the payment flow is not, so run it after
+    those. Completions that commit while it runs may be missed, so run it when payments are quiet.
+    Returns the number of days written.
+    """
+    with transaction.atomic():
+        rows = []
+        for kind, queryset, amount in ((Kind.TICKET, Ticket.objects.filter(purchased=True), 'price'),
+                                       (Kind.STREAM, VideoPayments.objects.all(), 'amount')):
+            days = queryset.order_by().annotate(day=TruncDate('added_on')).values('day') \
+                .annotate(total=Sum(amount), sales=Count('id'))
+            rows += [RevenueRollup(kind=kind, day=day['day'], amount=day['total'], count=day['sales'])
+                     for day in days]
+        RevenueRollup.objects.all().delete()
+        RevenueRollup.objects.bulk_create(rows, batch_size=500)
+        versions.bump([versions.DASHBOARD])
+    return len(rows)
@@ -0,0 +1,401 @@
+import base64
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from heartstringApp import versions
+from heartstringApp.models import PlayTime, Seat, SeatLayout, Showtime
+
+# Seats per row for each wing of the house, used for any theater without a stored SeatLayout
+SEAT_LAYOUT = [
+    {"wing": "Left",
+     "seats": {"A": 3, "B": 4, "C": 5, "D": 6, "E": 7, "F": 8, "G": 0, "H": 0, "I": 0}},
+    {"wing": "Center",
+     "seats": {"A": 14, "B": 15, "C": 14, "D": 15, "E": 14, "F": 15, "G": 14, "H": 15, "I": 14}},
+    {"wing": "Right",
+     "seats": {"A": 3, "B": 4, "C": 5, "D": 6, "E": 7, "F": 8, "G": 0, "H": 0, "I": 0}},
+]
+
+SEAT_BATCH_SIZE = 500
+
+# Cached availability bitmaps expire quickly so a lost concurrent update heals itself
+SEAT_BITMAP_TIMEOUT = 60
+SEAT_LAYOUT_TIMEOUT = 60 * 10
+
+
+def lazy_seat_maps():
+    return getattr(settings, 'SEAT_MAP_MODE', 'eager') == 'lazy'
+
+
+def get_layout(theater):
+    """
+    Return the stored layout for a theater, falling back to the default house layout.
+    """
+    stored = SeatLayout.objects.filter(theater=theater).values_list('layout', flat=True).first()
+    return stored or SEAT_LAYOUT
+
+
+def available_q(now, ticket=None):
+    """
+    Seats that can be claimed: not booked, and not actively held for someone else.
+    A hold whose time has passed counts as free, so expired holds are released lazily on read.
+    """
+    free = Q(held_until__isnull=True) | Q(held_until__lte=now)
+    if ticket is not None:
+        free |= Q(hold_ticket=ticket)
+    return Q(is_booked=False) & free
+
+
+def layout_seats(layout=None):
+    """
+    Yield (wing, seat_number) for every seat in the layout, e.g. ("Left", "Left-A1").
+    """
+    for section in layout or SEAT_LAYOUT:
+        wing = section["wing"]
+        for row, seat_count in section["seats"].items():
+            for number in range(1, seat_count + 1):
+                yield wing, f"{wing}-{row}{number}"
+
+
+def time_slots(play_time):
+    # filter(None, ...) removes empty slots
+    return list(filter(None, [play_time.time1, play_time.time2, play_time.time3]))
+
+
+SHOW_TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M%p", "%I %p", "%I%p", "%H.%M")
+
+
+def parse_show_time(play_date, time_slot):
+    """
+    Combine a play date with a free-text time slot ("18:00", "6:30 PM", ...). Returns None when it does not parse.
+    """
+    text = str(time_slot).strip().upper()
+    for time_format in SHOW_TIME_FORMATS:
+        try:
+            return datetime.combine(play_date, datetime.strptime(text, time_format).time())
+        except ValueError:
+            continue
+    return None
+
+
+def sync_showtimes(play_times):
+    """
+    Make sure every time slot of the given PlayTimes has a Showtime row. Returns {(play_time_id, time_slot): Showtime}.
+    Pass PlayTimes with select_related('play_id'); the theater is copied from the play.
+    Read-only once the rows exist: only missing slots are inserted, so seat reads never take a write lock.
+    """
+    play_times = list(play_times)
+    keys = {(play_time.id, time_slot) for play_time in play_times for time_slot in time_slots(play_time)}
+
+    def existing():
+        return {
+            (showtime.play_time_id, showtime.time_slot): showtime
+            for showtime in Showtime.objects.filter(play_time__in=[play_time.id for play_time in play_times])
+            if (showtime.play_time_id, showtime.time_slot) in keys
+        }
+
+    found = existing()
+    missing = [
+        Showtime(play_id_id=play_time.play_id_id, play_time=play_time, play_date=play_time.play_date,
+                 time_slot=time_slot, starts_at=parse_show_time(play_time.play_date, time_slot),
+                 theater=play_time.play_id.theater)
+        for play_time in play_times
+        for time_slot in time_slots(play_time)
+        if (play_time.id, time_slot) not in found
+    ]
+    if missing:
+        # ignore_conflicts: another request may insert the same slot first; the row is read back either way
+        Showtime.objects.bulk_create(missing, ignore_conflicts=True)
+        found = existing()
+    return found
+
+
+def resolve_showtime(play_time, time_slot):
+    """
+    Map a legacy (PlayTime, time slot) pair onto its Showtime, creating it for play times added before showtimes
+    existed. Returns None when the slot is not one of the play time's slots.
+    """
+    if time_slot not in time_slots(play_time):
+        return None
+    showtime = Showtime.objects.filter(play_time=play_time, time_slot=time_slot).first()
+    if showtime is None:
+        showtime = sync_showtimes([play_time])[(play_time.id, time_slot)]
+    return showtime
+
+
+def iter_seats(showtimes, layout=None):
+    """
+    Yield unsaved Seat instances for every seat of every Showtime, in its theater's layout unless one is given.
+    """
+    seats_by_theater = {}
+    for showtime in showtimes:
+        theater = None if layout else showtime.theater
+        if theater not in seats_by_theater:
+            seats_by_theater[theater] = list(layout_seats(layout or get_layout(theater)))
+        for wing, seat_number in seats_by_theater[theater]:
+            yield Seat(
+                showtime=showtime,
+                play_time_id=showtime.play_time_id,
+                play_date=showtime.play_date,
+                seat_number=seat_number,
+                wing=wing,
+                time_slot=showtime.time_slot,
+                is_booked=False,
+            )
+
+
+def materialize_seats(play_times, layout=None, batch_size=SEAT_BATCH_SIZE):
+    """
+    Create the seat rows for the given PlayTimes with chunked bulk inserts in a single transaction. Without a layout
+    each show uses its theater's stored SeatLayout. Seats that already exist are left untouched, so this is safe to
+    re-run. Returns the number of rows sent.
+    """
+    created = 0
+    batch = []
+    with transaction.atomic():
+        showtimes = sync_showtimes(play_times).values()
+        versions.bump([versions.showtime_scope(showtime.id) for showtime in showtimes])
+        for seat in iter_seats(showtimes, layout):
+            batch.append(seat)
+            if len(batch) >= batch_size:
+                Seat.objects.bulk_create(batch, ignore_conflicts=True)
+                created += len(batch)
+                batch = []
+        if batch:
+            Seat.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+    return created
+
+
+def materialize_play_seats(play, layout=None, batch_size=SEAT_BATCH_SIZE):
+    play_times = PlayTime.objects.select_related('play_id').filter(play_id=play)
+    return materialize_seats(play_times, layout, batch_size)
+
+
+def prepare_play_seats(play):
+    """
+    Called when a play is added: creates its showtimes and, unless seat maps are lazy, their seat rows.
+    """
+    if lazy_seat_maps():
+        sync_showtimes(PlayTime.objects.select_related('play_id').filter(play_id=play))
+        return 0
+    return materialize_play_seats(play)
+
+
+def show_seats(showtime):
+    return Seat.objects.filter(showtime=showtime)
+
+
+def seats_on(play_date, time_slot):
+    return Seat.objects.filter(play_date=play_date, time_slot=time_slot)
+
+
+def unbooked_seats(showtimes):
+    """
+    Persisted seats of the given showtimes that can still be claimed (served by the partial seat_unbooked_idx).
+    """
+    return Seat.objects.filter(available_q(timezone.now()), showtime__in=showtimes)
+
+
+def seat_map(showtime, layout=None):
+    """
+    Return the full seat map of one show as a list of dicts shaped like SeatSerializer output.
+
+    Availability is the layout minus the persisted bookings, so this works whether or not the
+    free seats have rows of their own.
+    """
+    if layout is None:
+        layout = get_layout(showtime.theater)
+    now = timezone.now()
+    stored = {
+        row['seat_number']: row
+        for row in show_seats(showtime).values('id', 'seat_number', 'is_booked', 'held_until')
+    }
+
+    seats = []
+    for wing, seat_number in layout_seats(layout):
+        row = stored.get(seat_number)
+        seats.append({
+            "id": row['id'] if row else None,
+            "showtime": showtime.id,
+            "play_time": showtime.play_time_id,
+            "play_date": showtime.play_date,
+            "seat_number": seat_number,
+            "wing": wing,
+            "time_slot": showtime.time_slot,
+            "is_booked": bool(row and row['is_booked']),
+            "is_held": bool(row and not row['is_booked'] and row['held_until'] and row['held_until'] > now),
+        })
+    return seats
+
+
+def available_seats(showtimes):
+    """
+    Free seats of the given showtimes, computed from their theater layouts.
+    """
+    return [
+        seat
+        for showtime in showtimes
+        for seat in seat_map(showtime)
+        if not seat["is_booked"] and not seat["is_held"]
+    ]
+
+
+def layout_id(layout):
+    # Content-addressed, so clients can cache a layout for as long as it does not change
+    return hashlib.sha1(json.dumps(layout, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def layout_index(theater):
+    """
+    Return (layout_id, seats) for a theater where seats is the ordered list of (wing, seat_number).
+    Bit i of an availability bitmap refers to seats[i].
+    """
+    key = f"seatlayout:{hashlib.md5(str(theater).encode()).hexdigest()}"
+    cached = cache.get(key)
+    if cached is None:
+        layout = get_layout(theater)
+        cached = (layout_id(layout), list(layout_seats(layout)))
+        cache.set(key, cached, SEAT_LAYOUT_TIMEOUT)
+    return cached
+
+
+def _bitmap_key(showtime_id):
+    return f"seatmap:{showtime_id}"
+
+
+def _set_bits(bits, positions, seat_numbers):
+    for seat_number in seat_numbers:
+        position = positions.get(seat_number)
+        if position is not None:
+            bits[position // 8] |= 0x80 >> (position % 8)
+
+
+def availability_bitmap(showtime, rebuild=False):
+    """
+    Return the unavailable (booked or held) seats of one show as a bitset over the theater layout, cached per show.
+    The cached entry is {"theater", "layout_id", "size", "bits", "expires_at"} where bits is a bytearray, most
+    significant bit first. With rebuild=True the cached entry is ignored and replaced.
+    """
+    key = _bitmap_key(showtime.id)
+    entry = None if rebuild else cache.get(key)
+    if entry is None:
+        theater = showtime.theater
+        current_layout_id, seats = layout_index(theater)
+        bits = bytearray((len(seats) + 7) // 8)
+        positions = {seat_number: position for position, (wing, seat_number) in enumerate(seats)}
+        now = timezone.now()
+        timeout = SEAT_BITMAP_TIMEOUT
+        taken = show_seats(showtime) \
+            .filter(Q(is_booked=True) | Q(held_until__gt=now)) \
+            .values_list('seat_number', 'is_booked', 'held_until')
+        for seat_number, is_booked, held_until in taken:
+            _set_bits(bits, positions, [seat_number])
+            if not is_booked:
+                # Drop the entry when the first hold lapses so the seat shows up as free again
+                timeout = max(1, min(timeout, int((held_until - now).total_seconds()) + 1))
+        entry = {"theater": theater, "layout_id": current_layout_id, "size": len(seats), "bits": bits,
+                 "expires_at": now + timedelta(seconds=timeout)}
+        cache.set(key, entry, timeout)
+    return entry
+
+
+def encode_bitmap(entry):
+    return {
+        "layout_id": entry["layout_id"],
+        "size": entry["size"],
+        "encoding": "bitset-base64",
+        "unavailable": base64.b64encode(bytes(entry["bits"])).decode(),
+    }
+
+
+def mark_unavailable(changes, held_until=None):
+    """
+    Set bits in cached bitmaps once the surrounding transaction commits.
+    changes is an iterable of (showtime_id, seat_number); held_until is when the seats free up again, for holds.
+    Shows without a cached bitmap are skipped; they are rebuilt from the database on the next read.
+    """
+    by_show = {}
+    for showtime_id, seat_number in changes:
+        by_show.setdefault(showtime_id, []).append(seat_number)
+
+    def update():
+        now = timezone.now()
+        for showtime_id, seat_numbers in by_show.items():
+            key = _bitmap_key(showtime_id)
+            entry = cache.get(key)
+            if entry is None:
+                continue
+            current_layout_id, seats = layout_index(entry["theater"])
+            if current_layout_id != entry["layout_id"]:
+                cache.delete(key)
+                continue
+            positions = {seat_number: position for position, (wing, seat_number) in enumerate(seats)}
+            _set_bits(entry["bits"], positions, seat_numbers)
+            # Never outlive the entry's own expiry: it is when an earlier hold lapses and the seat is free again
+            expires_at = entry.get("expires_at") or now + timedelta(seconds=SEAT_BITMAP_TIMEOUT)
+            if held_until is not None:
+                expires_at = min(expires_at, held_until + timedelta(seconds=1))
+            entry["expires_at"] = expires_at
+            cache.set(key, entry, max(1, int((expires_at - now).total_seconds())))
+
+    if by_show:
+        transaction.on_commit(update)
+
+
+def invalidate_bitmaps(showtime_ids):
+    """
+    Drop cached bitmaps of the given showtimes after commit, e.g. once seats are released.
+    """
+    keys = [_bitmap_key(showtime_id) for showtime_id in showtime_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _row_of(seat_number):
+    # "Center-B12" -> ("Center", "B"); seat numbers are always built by layout_seats
+    match = re.match(r'^(?P<wing>.+)-(?P<row>[A-Za-z]+)(?P<number>\d+)$', seat_number)
+    return match.group('wing'), match.group('row')
+
+
+def best_blocks(bitmap, seats, party_size, wing=None):
+    """
+    Yield contiguous blocks of free seats for a party, best first, from one pass over the availability bitmap.
+
+    Blocks in the preferred wing come first, then rows nearer the stage, then blocks closer to the middle
+    of their row. Each block is a list of seat numbers.
+    """
+    candidates = []
+    rows = []
+    current = None
+    for position, (seat_wing, seat_number) in enumerate(seats):
+        key = _row_of(seat_number)
+        if key != current:
+            current = key
+            rows.append((key, []))
+        taken = bitmap["bits"][position // 8] & (0x80 >> (position % 8))
+        rows[-1][1].append(None if taken else seat_number)
+
+    row_rank = {}
+    for (seat_wing, row), row_seats in rows:
+        rank = row_rank.setdefault(row, len(row_rank))
+        middle = (len(row_seats) - 1) / 2
+        run = 0
+        for index, seat_number in enumerate(row_seats):
+            run = run + 1 if seat_number else 0
+            if run >= party_size:
+                start = index - party_size + 1
+                offset = abs((start + index) / 2 - middle)
+                wing_penalty = 0 if wing is None or seat_wing == wing else 1
+                candidates.append(((wing_penalty, rank, offset), row_seats[start:index + 1]))
+
+    candidates.sort(key=lambda candidate: candidate[0])
+    for score, block in candidates:
+        yield block
@@ -8,7 +8,7 @@ from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
 from heartstringApp.models import UserAccount, Play, PlayCast, Ticket, Payment, Video, VideoCast, \
-    VideoAvailability, OtherOffers, PlayTime, VideoPayments, Seat, ViewHistory
+    VideoAvailability, OtherOffers, PlayTime, VideoPayments, Seat, ViewHistory, PaymentAttempt
 
 User = get_user_model()
 
@@ -141,17 +141,41 @@ class TicketsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ticket
         fields = '__all__'
+        read_only_fields = ['admitted_at']
         extra_kwargs = {
             'qr_code': {'required': False}  # Mark qr_code as not required
         }
 
     def to_representation(self, instance):
+        # Reads the related rows through the instance, so querysets with select_related('user', 'play_id') serialize
+        # without a query per ticket
         response = super().to_representation(instance)
-        response["user"] = UserCreateSerializer(UserAccount.objects.get(id=instance.user_id)).data
+        response["user"] = UserCreateSerializer(instance.user).data
         response["play"] = PlaySerializer(instance.play_id).data
         return response
 
 
+class TicketListSerializer(serializers.ModelSerializer):
+    """
+    Flat, read-only ticket rows for long lists: the buyer and the play are reduced to the few columns a list shows.
+    Expects a queryset with select_related('user', 'play_id').
+    """
+    user_email = serializers.CharField(source='user.email', read_only=True)
+    user_name = serializers.SerializerMethodField()
+    play_title = serializers.CharField(source='play_id.title', read_only=True)
+    theater = serializers.CharField(source='play_id.theater', read_only=True)
+
+    class Meta:
+        model = Ticket
+        fields = ('id', 'ticket_number', 'seat_numbers', 'ticket_type', 'price', 'play_date', 'play_time',
+                  'showtime', 'purchased', 'admitted_at', 'qr_code', 'added_on', 'user', 'user_email', 'user_name',
+                  'play_id', 'play_title', 'theater')
+        read_only_fields = fields
+
+    def get_user_name(self, instance):
+        return f"{instance.user.first_name} {instance.user.last_name}"
+
+
 class PaymentSerializer(serializers.ModelSerializer):
     user = UserAccountSerializer(read_only=True)  # Use the UserAccountSerializer for the user field
 
@@ -166,6 +190,13 @@ class PaymentSerializer(serializers.ModelSerializer):
         return response
 
 
+class PaymentAttemptSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentAttempt
+        fields = ['id', 'kind', 'channel', 'status', 'message', 'amount', 'ticket', 'video', 'payment',
+                  'video_payment', 'added_on', 'updated_on']
+
+
 class VideoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Video
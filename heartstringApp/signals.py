@@ -0,0 +1,38 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from heartstringApp import revenue, versions
+from heartstringApp.models import Play, PlayTime, PlayCast, OtherOffers, Video, VideoCast, VideoAvailability, \
+    SeatLayout, Ticket, Payment, VideoPayments
+
+PLAY_CATALOG_MODELS = (Play, PlayTime, PlayCast, OtherOffers)
+VIDEO_CATALOG_MODELS = (Video, VideoCast, VideoAvailability)
+SALES_MODELS = (Ticket, Payment, VideoPayments)
+
+
+@receiver([post_save, post_delete])
+def bump_catalog_version(sender, instance, **kwargs):
+    """
+    Any write to a catalog model invalidates the ETags of the endpoints that list it, and any write to a sale the
+    cached dashboard.
+    """
+    if sender in PLAY_CATALOG_MODELS:
+        versions.bump([versions.PLAYS])
+    elif sender in VIDEO_CATALOG_MODELS:
+        versions.bump([versions.VIDEOS])
+    elif sender is SeatLayout:
+        versions.bump([versions.layout_scope(instance.theater)])
+    elif sender in SALES_MODELS:
+        versions.bump([versions.DASHBOARD])
+
+
+@receiver(post_delete, sender=Ticket)
+@receiver(post_delete, sender=VideoPayments)
+def remove_deleted_sale(sender, instance, **kwargs):
+    """
+    Deleting a sold ticket or a video payment takes it back out of the dashboard's revenue rollup.
+    """
+    if sender is VideoPayments:
+        revenue.remove([revenue.stream_sale(instance)])
+    elif instance.purchased:
+        revenue.remove([revenue.ticket_sale(instance)])
@@ -1,10 +1,26 @@
-from unittest import mock
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import requests
 from requests import Response
 from rest_framework import status
+from rest_framework.test import APIClient
 
-from heartstringApp.models import Ticket
+from heartstringApp import admission, booking, breaker, dashboard, events, ipay, payments, qr, revenue, seating
+from heartstringApp.ipay_simulator import IpaySimulator, make_server
+from heartstringApp.models import Ticket, Play, PlayTime, Seat, SeatLayout, Showtime, UserAccount, Payment, \
+    PaymentAttempt, IdempotencyKey, RevenueRollup, Video, VideoPayments
 from heartstringApp.views import PaymentViewSet
 
 
@@ -50,3 +66,1163 @@ class PaymentViewSetTests(TestCase):
         self.assertEqual(response.data["success"], False)
         self.assertEqual(response.data["message"], "Payment request failed.")
 
+
+class BookSeatsTests(TestCase):
+
+    def setUp(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        self.play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+        self.seats = [
+            Seat.objects.create(play_time=self.play_time, play_date=self.play_time.play_date,
+                                seat_number=f"Center-A{number}", wing="Center", time_slot="18:00")
+            for number in range(1, 5)
+        ]
+
+    def test_book_seats_reports_claimed_conflicting_and_missing(self):
+        Seat.objects.filter(pk=self.seats[1].pk).update(is_booked=True)
+
+        with self.assertNumQueries(4):  # savepoint, select, update, release
+            result = booking.book_seats([self.seats[0].pk, self.seats[1].pk, 9999])
+
+        self.assertEqual(result.claimed, [self.seats[0].pk])
+        self.assertEqual(result.conflicting, [self.seats[1].pk])
+        self.assertEqual(result.missing, [9999])
+        self.assertTrue(Seat.objects.get(pk=self.seats[0].pk).is_booked)
+
+    def test_book_seats_all_or_nothing_books_nothing_on_conflict(self):
+        Seat.objects.filter(pk=self.seats[1].pk).update(is_booked=True)
+
+        result = booking.book_seats([self.seats[0].pk, self.seats[1].pk], all_or_nothing=True)
+
+        self.assertEqual(result.claimed, [])
+        self.assertFalse(result.complete)
+        self.assertFalse(Seat.objects.get(pk=self.seats[0].pk).is_booked)
+
+
+class MaterializeSeatsTests(TestCase):
+
+    def test_materialize_seats_creates_every_slot_once(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="14:00", time2="18:00")
+        seats_per_slot = len(list(seating.layout_seats()))
+
+        seating.materialize_play_seats(play, batch_size=100)
+        # Re-running must not duplicate rows
+        seating.materialize_play_seats(play, batch_size=100)
+
+        self.assertEqual(Seat.objects.count(), 2 * seats_per_slot)
+
+    def test_materialize_seats_uses_each_theaters_stored_layout(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.NAIROBI_CINEMAS,
+                                   location="Nairobi", amount="1000")
+        SeatLayout.objects.create(theater=play.theater, layout=[{"wing": "Center", "seats": {"A": 2}}])
+        PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+
+        seating.materialize_seats(PlayTime.objects.all())
+
+        self.assertEqual(sorted(Seat.objects.values_list('seat_number', flat=True)), ["Center-A1", "Center-A2"])
+
+
+@override_settings(SEAT_MAP_MODE='lazy')
+class LazySeatMapTests(TestCase):
+
+    def setUp(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        SeatLayout.objects.create(theater=play.theater,
+                                  layout=[{"wing": "Center", "seats": {"A": 3, "B": 2}}])
+        play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+        seating.prepare_play_seats(play)
+        self.showtime = Showtime.objects.get(play_time=play_time, time_slot="18:00")
+        cache.clear()
+
+    def test_seats_are_only_persisted_once_booked(self):
+        self.assertEqual(Seat.objects.count(), 0)
+
+        result = booking.book_seat_numbers(self.showtime, ["Center-A1", "Center-B2", "Center-Z9"])
+
+        self.assertEqual(result.claimed, ["Center-A1", "Center-B2"])
+        self.assertEqual(result.missing, ["Center-Z9"])
+        self.assertEqual(Seat.objects.count(), 2)
+        available = [seat["seat_number"] for seat in seating.available_seats([self.showtime])]
+        self.assertEqual(available, ["Center-A2", "Center-A3", "Center-B1"])
+
+    def test_booking_a_booked_seat_number_conflicts(self):
+        booking.book_seat_numbers(self.showtime, ["Center-A1"])
+
+        result = booking.book_seat_numbers(self.showtime, ["Center-A1", "Center-A2"], all_or_nothing=True)
+
+        self.assertEqual(result.conflicting, ["Center-A1"])
+        self.assertEqual(Seat.objects.filter(is_booked=True).count(), 1)
+
+    def test_availability_bitmap_is_updated_on_booking(self):
+        bitmap = seating.encode_bitmap(seating.availability_bitmap(self.showtime))
+        self.assertEqual(bitmap["size"], 5)
+        self.assertEqual(bitmap["unavailable"], "AA==")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.book_seat_numbers(self.showtime, ["Center-A1", "Center-B2"])
+
+        # The cached bitmap is patched in place, no query needed to read it back
+        with self.assertNumQueries(0):
+            bitmap = seating.encode_bitmap(seating.availability_bitmap(self.showtime))
+        self.assertEqual(bitmap["unavailable"], "iA==")  # 0b10001000
+
+    def test_bitmap_expires_when_its_first_hold_lapses(self):
+        user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret", "normal")
+        ticket = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email=user.email, user=user,
+                                       play_id=self.showtime.play_id, ticket_number="T1")
+        seating.availability_bitmap(self.showtime)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.hold_seat_numbers(self.showtime, ["Center-A1"], ticket, seconds=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.book_seat_numbers(self.showtime, ["Center-B2"])
+
+        # Booking another seat must not keep the held seat shown as taken past its hold
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=time.time() + 10):
+            self.assertIsNone(cache.get(seating._bitmap_key(self.showtime.id)))
+
+
+class SeatHoldTests(TestCase):
+
+    def setUp(self):
+        user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret", "normal")
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+        self.seats = [
+            Seat.objects.create(play_time=play_time, play_date=play_time.play_date,
+                                seat_number=f"Center-A{number}", wing="Center", time_slot="18:00")
+            for number in range(1, 3)
+        ]
+        self.ticket = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email=user.email, user=user,
+                                            play_id=play, ticket_number="T1")
+        self.other_ticket = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email=user.email, user=user,
+                                                  play_id=play, ticket_number="T2")
+
+    def test_held_seat_cannot_be_booked_by_someone_else_until_it_expires(self):
+        seat_ids = [self.seats[0].pk]
+        self.assertTrue(booking.hold_seats(seat_ids, self.ticket).complete)
+
+        self.assertEqual(booking.book_seats(seat_ids).conflicting, seat_ids)
+        self.assertFalse(booking.hold_seats(seat_ids, self.other_ticket).complete)
+
+        Seat.objects.filter(pk=self.seats[0].pk).update(held_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(booking.book_seats(seat_ids).claimed, seat_ids)
+
+    def test_booking_after_an_expired_hold_takes_the_seat_from_its_ticket(self):
+        seat_ids = [self.seats[0].pk]
+        booking.hold_seats(seat_ids, self.ticket)
+        Seat.objects.filter(pk=self.seats[0].pk).update(held_until=timezone.now() - timedelta(seconds=1))
+        booking.book_seats(seat_ids, ticket=self.other_ticket)
+
+        # Releasing the first ticket's seats must not free the seat another ticket booked since
+        self.assertEqual(booking.release_tickets([self.ticket]), 0)
+        seat = Seat.objects.get(pk=self.seats[0].pk)
+        self.assertEqual((seat.is_booked, seat.hold_ticket_id), (True, self.other_ticket.pk))
+
+    def test_confirm_and_release_holds(self):
+        booking.hold_seats([self.seats[0].pk], self.ticket)
+        booking.hold_seats([self.seats[1].pk], self.other_ticket)
+
+        self.assertEqual(booking.confirm_holds(self.ticket), 1)
+        self.assertEqual(booking.release_holds(self.other_ticket), 1)
+
+        self.assertTrue(Seat.objects.get(pk=self.seats[0].pk).is_booked)
+        released = Seat.objects.get(pk=self.seats[1].pk)
+        self.assertFalse(released.is_booked)
+        self.assertIsNone(released.held_until)
+
+    def test_sweeper_releases_only_expired_holds(self):
+        booking.hold_seats([self.seats[0].pk], self.ticket)
+        booking.hold_seats([self.seats[1].pk], self.other_ticket, seconds=60)
+        Seat.objects.filter(pk=self.seats[0].pk).update(held_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(booking.release_expired_holds(), 1)
+        self.assertIsNotNone(Seat.objects.get(pk=self.seats[1].pk).held_until)
+
+
+@override_settings(SEAT_MAP_MODE='lazy')
+class AllocateSeatsTests(TestCase):
+
+    def setUp(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.ALLIANCE_FRANCAISE,
+                                   location="Nairobi", amount="1000")
+        SeatLayout.objects.create(theater=play.theater, layout=[
+            {"wing": "Left", "seats": {"A": 4, "B": 4}},
+            {"wing": "Center", "seats": {"A": 5, "B": 5}},
+        ])
+        play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+        self.showtime = seating.resolve_showtime(play_time, "18:00")
+        cache.clear()
+
+    def test_allocates_front_centre_block_in_preferred_wing(self):
+        result = booking.allocate_seats(self.showtime, 3, wing="Center")
+
+        self.assertEqual(result.claimed, ["Center-A2", "Center-A3", "Center-A4"])
+
+    def test_skips_rows_without_enough_adjacent_seats(self):
+        booking.book_seat_numbers(self.showtime, ["Center-A2", "Center-A4"])
+        cache.clear()
+
+        result = booking.allocate_seats(self.showtime, 2, wing="Center")
+
+        self.assertEqual(result.claimed, ["Center-B2", "Center-B3"])
+
+    def test_falls_back_to_next_block_when_bitmap_is_stale(self):
+        seating.availability_bitmap(self.showtime)
+        # Booked behind the cache's back, as another worker would
+        Seat.objects.create(showtime=self.showtime, play_time_id=self.showtime.play_time_id,
+                            play_date=self.showtime.play_date, seat_number="Center-A3", wing="Center",
+                            time_slot="18:00", is_booked=True)
+
+        result = booking.allocate_seats(self.showtime, 1, wing="Center")
+
+        self.assertEqual(result.claimed, ["Center-A2"])
+
+    def test_bitmap_of_an_old_layout_is_rebuilt(self):
+        bitmap = seating.availability_bitmap(self.showtime)
+        cache.set(seating._bitmap_key(self.showtime.id), dict(bitmap, layout_id="old"), 60)
+
+        result = booking.allocate_seats(self.showtime, 2, wing="Center")
+
+        self.assertEqual(result.claimed, ["Center-A2", "Center-A3"])
+
+
+class AvailableSeatsFilterTests(TestCase):
+
+    def setUp(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        SeatLayout.objects.create(theater=play.theater, layout=[{"wing": "Center", "seats": {"A": 3}}])
+        self.play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="14:00",
+                                                 time2="18:00")
+        seating.prepare_play_seats(play)
+        self.showtime = Showtime.objects.get(time_slot="18:00")
+        booking.book_seat_numbers(self.showtime, ["Center-A1"])
+
+    def test_filters_by_date_and_time_slot(self):
+        response = self.client.get("/api/seats/available/", {"date": "2024-03-01", "time_slot": "18:00"})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([seat["seat_number"] for seat in response.data["data"]], ["Center-A2", "Center-A3"])
+
+    def test_filters_by_showtime(self):
+        response = self.client.get("/api/seats/available/", {"showtime": self.showtime.id})
+
+        self.assertEqual({seat["showtime"] for seat in response.data["data"]}, {self.showtime.id})
+
+    def test_play_time_seat_list_only_reads_once_its_shows_exist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/available-seats/{self.play_time.id}/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+        self.assertFalse([query["sql"] for query in queries.captured_queries if "INSERT" in query["sql"]])
+
+
+@override_settings(SEAT_MAP_MODE='lazy')
+@override_settings(CACHE_SHARED=True)
+class SeatEventTests(TestCase):
+
+    def setUp(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        SeatLayout.objects.create(theater=play.theater, layout=[{"wing": "Center", "seats": {"A": 3}}])
+        play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+        self.showtime = seating.resolve_showtime(play_time, "18:00")
+        cache.clear()
+
+    def test_bookings_are_published_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.book_seat_numbers(self.showtime, ["Center-A1", "Center-A2"])
+
+        changes, seq, gap = events.since(self.showtime.id, 0)
+
+        self.assertEqual(changes, [(1, {"state": events.BOOKED, "seats": ["Center-A1", "Center-A2"]})])
+        self.assertEqual((seq, gap), (1, None))
+        self.assertEqual(events.since(self.showtime.id, seq), ([], 1, None))
+
+    def test_publishers_handed_the_same_number_keep_both_events(self):
+        # The database cache's incr() reads and then writes, so two publishers can both be handed 1
+        with mock.patch.object(cache, 'incr', side_effect=[1, 1, 2]):
+            first = events._append(self.showtime.id, events.BOOKED, ["Center-A1"])
+            second = events._append(self.showtime.id, events.HELD, ["Center-A2"])
+        cache.set(events._seq_key(self.showtime.id), 2)
+
+        changes, seq, gap = events.since(self.showtime.id, 0)
+
+        self.assertEqual((first, second), (1, 2))
+        self.assertEqual([event["seats"] for _, event in changes], [["Center-A1"], ["Center-A2"]])
+
+    @mock.patch.object(events, 'SEAT_EVENT_STREAM_SECONDS', 0)
+    async def test_stream_starts_with_snapshot_then_deltas(self):
+        response = await self.async_client.get(f"/api/seats/events/{self.showtime.id}/")
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertIn('event: snapshot\ndata: {"layout_id"', body)
+
+        events._append(self.showtime.id, events.HELD, ["Center-A3"])
+        response = await self.async_client.get(f"/api/seats/events/{self.showtime.id}/", headers={"Last-Event-ID": "0"})
+        body = "".join([chunk.decode() async for chunk in response.streaming_content])
+
+        self.assertNotIn("event: snapshot", body)
+        self.assertIn('id: 1\nevent: seats\ndata: {"state": "held", "seats": ["Center-A3"]}', body)
+
+    def test_wsgi_requests_get_a_poll_result_instead_of_a_stream(self):
+        url = f"/api/seats/events/{self.showtime.id}/"
+        first = self.client.get(url)
+
+        self.assertEqual(first["Content-Type"], "application/json")
+        self.assertEqual(first["Retry-After"], str(events.SEAT_EVENT_POLL_FALLBACK_SECONDS))
+        self.assertEqual(first.json()["data"]["last_event_id"], 0)
+        self.assertIsNotNone(first.json()["data"]["snapshot"])
+
+        events._append(self.showtime.id, events.HELD, ["Center-A3"])
+        data = self.client.get(url, {"last_event_id": 0}).json()["data"]
+
+        self.assertIsNone(data["snapshot"])
+        self.assertEqual(data["events"], [{"id": 1, "state": "held", "seats": ["Center-A3"]}])
+
+    @override_settings(CACHE_SHARED=False)
+    async def test_per_process_cache_always_polls_the_whole_map(self):
+        response = await self.async_client.get(f"/api/seats/events/{self.showtime.id}/", {"last_event_id": 0})
+
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertIsNotNone(response.json()["data"]["snapshot"])
+
+
+@override_settings(CACHE_SHARED=True)
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                        location="Nairobi", amount="1000")
+        SeatLayout.objects.create(theater=self.play.theater, layout=[{"wing": "Center", "seats": {"A": 3}}])
+        self.play_time = PlayTime.objects.create(play_id=self.play, play_date=date(2024, 3, 1), time1="18:00")
+        with self.captureOnCommitCallbacks(execute=True):
+            seating.prepare_play_seats(self.play)
+
+    def test_unchanged_catalog_is_not_modified_without_queries(self):
+        response = self.client.get("/api/plays/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/plays/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_catalog_write_changes_the_etag(self):
+        etag = self.client.get("/api/plays/").get("ETag")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.play.title = "Renamed"
+            self.play.save()
+
+        response = self.client.get("/api/plays/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["data"][0]["title"], "Renamed")
+
+    def test_seat_booking_and_hold_expiry_change_the_etag(self):
+        url = f"/api/available-seats/{self.play_time.id}/"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        showtime = Showtime.objects.get(play_time=self.play_time)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.book_seat_numbers(showtime, ["Center-A1"])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+        user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret", "normal")
+        ticket = Ticket.objects.create(seat_numbers="Center-A2", price=1000, email=user.email, user=user,
+                                       play_id=self.play, ticket_number="T1")
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.hold_seat_numbers(showtime, ["Center-A2"], ticket, seconds=60)
+        etag = self.client.get(url)["ETag"]
+
+        # Once the hold lapses the seat is free again even though nothing was written
+        with mock.patch("heartstringApp.versions.time.time", return_value=timezone.now().timestamp() + 120):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_write_in_the_same_second_fails_if_modified_since(self):
+        last_modified = self.client.get("/api/plays/")["Last-Modified"]
+        self.assertEqual(self.client.get("/api/plays/", HTTP_IF_MODIFIED_SINCE=last_modified).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.play.save()
+
+        response = self.client.get("/api/plays/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(CACHE_SHARED=False)
+    def test_per_process_cache_never_answers_not_modified(self):
+        response = self.client.get("/api/plays/")
+
+        self.assertNotIn("ETag", response)
+        self.assertEqual(self.client.get("/api/plays/", HTTP_IF_NONE_MATCH="*").status_code, status.HTTP_200_OK)
+
+
+@mock.patch.object(qr, 'enqueue')
+class PaymentAttemptTests(TestCase):
+
+    def setUp(self):
+        self.user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret",
+                                                    "normal")
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+        self.seat = Seat.objects.create(play_time=play_time, play_date=play_time.play_date, seat_number="Center-A1",
+                                        wing="Center", time_slot="18:00")
+        self.ticket = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email=self.user.email,
+                                            user=self.user, play_id=play, ticket_number="T1")
+        booking.hold_seats([self.seat.pk], self.ticket)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def run_worker(self):
+        # Make every open attempt due and run one round, as the worker would on its next tick
+        PaymentAttempt.objects.update(next_check_at=timezone.now())
+        return payments.process_due()
+
+    def test_initiate_returns_without_calling_the_gateway(self, enqueue_qr):
+        with mock.patch.object(ipay, "post") as post:
+            response = self.client.post("/api/payments/initiate_payment/",
+                                        {"ticket_id": self.ticket.id, "amount": "1000", "phone": "254700000000"})
+
+        post.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        attempt = PaymentAttempt.objects.get(pk=response.data["data"]["payment_id"])
+        self.assertEqual(attempt.status, PaymentAttempt.Status.INITIATED)
+
+        response = self.client.get(f"/api/payments/status/{attempt.id}/")
+        self.assertEqual(response.data["data"]["status"], "initiated")
+
+    @mock.patch.object(ipay, 'transaction_status')
+    @mock.patch.object(ipay, 'status_hash', return_value="abc123")
+    @mock.patch.object(ipay, 'push')
+    @mock.patch.object(ipay, 'create_transaction', return_value="SID1")
+    def test_worker_drives_attempt_to_completion(self, create_transaction, push, status_hash, transaction_status,
+                                                 enqueue_qr):
+        transaction_status.side_effect = [
+            {"status": ipay.STATUS_PENDING},
+            {"status": ipay.STATUS_COMPLETE, "txncd": "TX1", "channel": "MPESA", "msisdn_id": "Jane",
+             "msisdn_idnum": "254700000000", "mc": "1000"},
+        ]
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+
+        statuses = []
+        for _ in range(4):
+            self.run_worker()
+            attempt.refresh_from_db()
+            statuses.append(attempt.status)
+
+        self.assertEqual(statuses, ["pushed", "pending", "pending", "completed"])
+        push.assert_called_once_with("mpesa", "254700000000", "SID1")
+        self.assertEqual(Payment.objects.get(pk=attempt.payment_id).ref_number, "TX1")
+        self.ticket.refresh_from_db()
+        self.assertTrue(self.ticket.purchased)
+        self.assertTrue(Seat.objects.get(pk=self.seat.pk).is_booked)
+        enqueue_qr.assert_called_once()
+        self.assertEqual(self.run_worker(), 0)
+
+    def test_gateway_session_only_retries_idempotent_status_checks(self, enqueue_qr):
+        gateway = ipay.session()
+
+        self.assertIs(ipay.session(), gateway)
+        status_adapter = gateway.get_adapter(f"{ipay.IPAY_URL}/transact/mobilemoney")
+        push_adapter = gateway.get_adapter(f"{ipay.IPAY_URL}/transact/push/mpesa")
+        self.assertEqual(status_adapter.max_retries.read, None)
+        self.assertEqual(status_adapter.max_retries.status_forcelist, (502, 503, 504))
+        self.assertEqual(push_adapter.max_retries.read, 0)
+        self.assertEqual(push_adapter.max_retries.status, 0)
+
+    def pushed_attempt(self):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+        PaymentAttempt.objects.filter(pk=attempt.pk).update(status=PaymentAttempt.Status.PENDING, sid="SID1",
+                                                            status_hash="abc123")
+        attempt.refresh_from_db()
+        return attempt
+
+    @mock.patch.object(ipay, 'transaction_status')
+    def test_signed_callback_completes_the_payment_once(self, transaction_status, enqueue_qr):
+        attempt = self.pushed_attempt()
+        transaction_status.return_value = {"status": ipay.STATUS_COMPLETE, "txncd": "TX1", "channel": "MPESA",
+                                           "msisdn_id": "Jane", "msisdn_idnum": "254700000000", "mc": "1000.00"}
+        url = f"/api/payments/callback/{attempt.oid}/{payments.callback_signature(attempt.oid)}/"
+
+        forged = self.client.get(f"/api/payments/callback/{attempt.oid}/{'0' * 64}/")
+        first = self.client.get(url)
+        repeated = self.client.get(url)
+
+        self.assertEqual(forged.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(first.data["data"]["status"], "completed")
+        self.assertEqual(repeated.status_code, status.HTTP_200_OK)
+        transaction_status.assert_called_once_with("SID1", "abc123")
+        self.assertEqual(Payment.objects.filter(ticket=self.ticket).count(), 1)
+        self.assertTrue(Seat.objects.get(pk=self.seat.pk).is_booked)
+        rollup = RevenueRollup.objects.get(kind=RevenueRollup.Kind.TICKET)
+        self.assertEqual((rollup.day, rollup.amount, rollup.count), (self.ticket.added_on.date(), 1000, 1))
+
+    @mock.patch.object(ipay, 'transaction_status', return_value={"status": ipay.STATUS_COMPLETE, "mc": "1000"})
+    def test_payment_missing_gateway_fields_is_still_recorded(self, transaction_status, enqueue_qr):
+        attempt = self.pushed_attempt()
+
+        payments.handle_callback(attempt.oid, payments.callback_signature(attempt.oid))
+
+        payment = Payment.objects.get(ticket=self.ticket)
+        self.assertEqual((payment.ref_number, payment.payment_mode, payment.msisdn_idnum),
+                         ("SID1", "MPESA", "254700000000"))
+
+    @mock.patch.object(ipay, 'transaction_status', return_value={"status": ipay.STATUS_PENDING})
+    def test_callback_outcome_comes_from_the_gateway_not_the_request(self, transaction_status, enqueue_qr):
+        attempt = self.pushed_attempt()
+        url = f"/api/payments/callback/{attempt.oid}/{payments.callback_signature(attempt.oid)}/"
+
+        self.client.get(url, {"status": ipay.STATUS_COMPLETE, "mc": "1000"})
+
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.PENDING)
+        self.assertFalse(Payment.objects.exists())
+
+    @mock.patch.object(ipay, 'transaction_status', return_value={"status": ipay.STATUS_COMPLETE, "mc": "10"})
+    def test_callback_with_wrong_amount_fails_the_payment(self, transaction_status, enqueue_qr):
+        attempt = self.pushed_attempt()
+
+        payments.handle_callback(attempt.oid, payments.callback_signature(attempt.oid))
+
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.FAILED)
+        self.assertFalse(Payment.objects.exists())
+
+    @mock.patch.object(ipay, 'transaction_status')
+    def test_late_callback_does_not_sell_a_released_seat_again(self, transaction_status, enqueue_qr):
+        attempt = self.pushed_attempt()
+        payments.fail(attempt, "Payment was not confirmed in time.", PaymentAttempt.Status.EXPIRED)
+        other = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email="other@example.com",
+                                      user=self.user, play_id=self.ticket.play_id, ticket_number="T2")
+        booking.hold_seats([self.seat.pk], other)
+        transaction_status.return_value = {"status": ipay.STATUS_COMPLETE, "txncd": "TX1", "channel": "MPESA",
+                                           "msisdn_id": "Jane", "msisdn_idnum": "254700000000", "mc": "1000"}
+
+        payments.handle_callback(attempt.oid, payments.callback_signature(attempt.oid))
+
+        attempt.refresh_from_db()
+        self.ticket.refresh_from_db()
+        self.assertFalse(self.ticket.purchased)
+        self.assertEqual(attempt.status, PaymentAttempt.Status.COMPLETED)
+        self.assertIn("refund", attempt.message)
+        self.assertFalse(RevenueRollup.objects.exists())
+
+    def test_second_payment_is_refused_while_the_ticket_has_one_open(self, enqueue_qr):
+        body = {"ticket_id": self.ticket.id, "amount": "1000", "phone": "254700000000"}
+        first = self.client.post("/api/payments/initiate_payment/", body)
+        second = self.client.post("/api/payments/initiate_payment/", body)
+
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(second.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(second.data["data"]["payment_id"], first.data["data"]["payment_id"])
+        self.assertEqual(PaymentAttempt.objects.count(), 1)
+
+    def test_failed_attempt_keeps_the_holds_of_an_open_sibling(self, enqueue_qr):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+        # Attempts from before starts were refused for tickets with an open payment
+        PaymentAttempt.objects.create(kind=PaymentAttempt.Kind.TICKET, oid="T1-sibling", phone="254700000000",
+                                      email=self.user.email, amount="1000", ticket=self.ticket, user=self.user,
+                                      status=PaymentAttempt.Status.PENDING)
+
+        payments.fail(attempt, "Payment failed.")
+
+        self.assertEqual(Seat.objects.get(pk=self.seat.pk).hold_ticket_id, self.ticket.pk)
+
+    def test_payment_for_a_ticket_that_lost_its_seat_is_flagged(self, enqueue_qr):
+        attempt = self.pushed_attempt()
+        Seat.objects.filter(pk=self.seat.pk).update(held_until=timezone.now() - timedelta(seconds=1))
+        other = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email="other@example.com",
+                                      user=self.user, play_id=self.ticket.play_id, ticket_number="T2")
+        booking.hold_seats([self.seat.pk], other)
+
+        attempt = payments.complete(attempt, {"status": ipay.STATUS_COMPLETE, "txncd": "TX1", "mc": "1000"})
+
+        self.ticket.refresh_from_db()
+        self.assertFalse(self.ticket.purchased)
+        self.assertEqual(attempt.status, PaymentAttempt.Status.COMPLETED)
+        self.assertEqual(attempt.message, payments.SEATS_LOST_MESSAGE)
+        self.assertEqual(Seat.objects.get(pk=self.seat.pk).hold_ticket_id, other.pk)
+        self.assertFalse(RevenueRollup.objects.exists())
+        enqueue_qr.assert_not_called()
+
+    @mock.patch.object(ipay, 'push', side_effect=ipay.GatewayError("STK PUSH request failed with status: 400"))
+    @mock.patch.object(ipay, 'create_transaction', return_value="SID1")
+    def test_failed_push_releases_the_seat_holds(self, create_transaction, push, enqueue_qr):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+
+        self.run_worker()
+
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.FAILED)
+        self.assertEqual(attempt.message, "STK PUSH request failed with status: 400")
+        self.assertIsNone(Seat.objects.get(pk=self.seat.pk).hold_ticket_id)
+
+    @mock.patch.object(ipay, 'push', side_effect=requests.Timeout("read timed out"))
+    @mock.patch.object(ipay, 'create_transaction', return_value="SID1")
+    def test_push_with_unknown_outcome_is_not_sent_again(self, create_transaction, push, enqueue_qr):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+
+        self.run_worker()
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.sid), (PaymentAttempt.Status.CREATED, "SID1"))
+
+        self.run_worker()
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.PUSHED)
+        create_transaction.assert_called_once()
+        push.assert_called_once()
+
+    def test_worker_survives_an_attempt_that_raises(self, enqueue_qr):
+        broken = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+        healthy = payments.start_video_payment(self.user, Video.objects.create(title="Video", duration="90",
+                                                                               synopsis="Synopsis"),
+                                               "250", "254700000000")
+
+        def create_transaction(oid, *args, **kwargs):
+            if oid == broken.oid:
+                raise RuntimeError("boom")
+            return "SID2"
+
+        with mock.patch.object(ipay, "create_transaction", side_effect=create_transaction) as create_transaction, \
+                mock.patch.object(ipay, "push"):
+            self.assertEqual(self.run_worker(), 2)
+
+        broken.refresh_from_db()
+        healthy.refresh_from_db()
+        self.assertEqual(create_transaction.call_count, 2)
+        self.assertEqual(broken.status, PaymentAttempt.Status.INITIATED)
+        self.assertGreater(broken.next_check_at, timezone.now() + timedelta(seconds=payments.PAYMENT_POLL_SECONDS))
+        self.assertEqual(healthy.status, PaymentAttempt.Status.PUSHED)
+
+    def test_attempts_that_never_reach_the_gateway_expire(self, enqueue_qr):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+        PaymentAttempt.objects.filter(pk=attempt.pk).update(
+            added_on=timezone.now() - timedelta(seconds=payments.PAYMENT_EXPIRY_SECONDS + 1))
+
+        with mock.patch.object(ipay, "create_transaction") as create_transaction:
+            self.run_worker()
+
+        attempt.refresh_from_db()
+        create_transaction.assert_not_called()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.EXPIRED)
+        self.assertIsNone(Seat.objects.get(pk=self.seat.pk).hold_ticket_id)
+
+    def test_initiate_fails_fast_while_the_gateway_circuit_is_open(self, enqueue_qr):
+        with mock.patch.object(ipay.breaker, "state", return_value=breaker.OPEN):
+            response = self.client.post("/api/payments/initiate_payment/",
+                                        {"ticket_id": self.ticket.id, "amount": "1000", "phone": "254700000000"})
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(PaymentAttempt.objects.exists())
+
+    def test_retry_with_the_same_idempotency_key_returns_the_first_payment(self, enqueue_qr):
+        body = {"ticket_id": self.ticket.id, "amount": "1000", "phone": "254700000000"}
+        first = self.client.post("/api/payments/initiate_payment/", body, HTTP_IDEMPOTENCY_KEY="retry-1")
+        PaymentAttempt.objects.update(status=PaymentAttempt.Status.PUSHED)
+
+        retry = self.client.post("/api/payments/initiate_payment/", body, HTTP_IDEMPOTENCY_KEY="retry-1")
+        changed = self.client.post("/api/payments/initiate_payment/", dict(body, amount="10"),
+                                   HTTP_IDEMPOTENCY_KEY="retry-1")
+
+        self.assertEqual(retry.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(retry.data["data"], {"payment_id": first.data["data"]["payment_id"], "status": "pushed"})
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(changed.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(PaymentAttempt.objects.count(), 1)
+
+    def test_old_idempotency_keys_are_purged(self, enqueue_qr):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+        IdempotencyKey.objects.create(user=self.user, key="old", fingerprint="x", attempt=attempt)
+        IdempotencyKey.objects.create(user=self.user, key="new", fingerprint="x", attempt=attempt)
+        IdempotencyKey.objects.filter(key="old").update(
+            added_on=timezone.now() - timedelta(seconds=payments.IDEMPOTENCY_KEY_TTL + 1))
+
+        self.assertEqual(payments.purge_idempotency_keys(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["new"])
+
+    def ended_attempt(self, sid, minutes_ago=10):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+        PaymentAttempt.objects.filter(pk=attempt.pk).update(
+            status=PaymentAttempt.Status.EXPIRED, sid=sid, status_hash="abc123", next_check_at=None,
+            updated_on=timezone.now() - timedelta(minutes=minutes_ago))
+        return attempt
+
+    @mock.patch.object(ipay, 'transaction_status')
+    def test_reconcile_settles_payments_confirmed_after_expiry(self, transaction_status, enqueue_qr):
+        self.ticket.showtime = seating.resolve_showtime(self.seat.play_time, "18:00")
+        self.ticket.save()
+        Seat.objects.filter(pk=self.seat.pk).update(showtime=self.ticket.showtime)
+        booking.release_holds(self.ticket)
+        attempt = self.ended_attempt("SID1")
+        transaction_status.return_value = {"status": ipay.STATUS_COMPLETE, "txncd": "TX1", "channel": "MPESA",
+                                           "msisdn_id": "Jane", "msisdn_idnum": "254700000000", "mc": "1000"}
+
+        self.assertEqual(payments.reconcile(), (1, 1))
+        self.assertEqual(payments.reconcile(), (0, 0))
+
+        attempt.refresh_from_db()
+        self.ticket.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.COMPLETED)
+        self.assertEqual(attempt.payment.ref_number, "TX1")
+        self.assertTrue(self.ticket.purchased)
+        self.assertTrue(Seat.objects.get(showtime=self.ticket.showtime, seat_number="Center-A1").is_booked)
+        enqueue_qr.assert_called_once()
+        self.assertEqual(RevenueRollup.objects.get(kind=RevenueRollup.Kind.TICKET).count, 1)
+
+    @mock.patch.object(ipay, 'transaction_status')
+    def test_reconcile_resumes_from_an_unanswered_attempt(self, transaction_status, enqueue_qr):
+        self.ended_attempt("SID1", minutes_ago=20)
+        self.ended_attempt("SID2", minutes_ago=10)
+        self.ended_attempt("SID3", minutes_ago=1)
+        pending = {"status": ipay.STATUS_PENDING}
+        transaction_status.side_effect = lambda sid, status_hash: (
+            pending if sid == "SID1" else ipay.requests.ConnectionError("timed out"))
+
+        self.assertEqual(payments.reconcile(), (1, 0))
+        transaction_status.side_effect = None
+        transaction_status.return_value = pending
+        # SID2 is asked about again; SID3 only ended a minute ago
+        self.assertEqual(payments.reconcile(), (1, 0))
+        self.assertFalse(Payment.objects.exists())
+
+    @mock.patch.object(ipay, 'transaction_status', return_value={"status": ipay.STATUS_COMPLETE, "mc": "10"})
+    def test_worker_fails_a_payment_with_the_wrong_amount(self, transaction_status, enqueue_qr):
+        attempt = self.pushed_attempt()
+
+        self.run_worker()
+
+        attempt.refresh_from_db()
+        self.assertEqual((attempt.status, attempt.message),
+                         (PaymentAttempt.Status.FAILED, payments.AMOUNT_MISMATCH_MESSAGE))
+        self.assertFalse(Payment.objects.exists())
+
+    @mock.patch.object(ipay, 'transaction_status', return_value={"status": ipay.STATUS_COMPLETE, "mc": "10"})
+    def test_reconcile_flags_a_payment_with_the_wrong_amount(self, transaction_status, enqueue_qr):
+        attempt = self.ended_attempt("SID1")
+        updated_on = PaymentAttempt.objects.get(pk=attempt.pk).updated_on
+
+        self.assertEqual(payments.reconcile(), (1, 0))
+
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.EXPIRED)
+        self.assertIn("Paid 10 instead of 1000", attempt.message)
+        self.assertEqual(attempt.updated_on, updated_on)
+        self.assertFalse(Payment.objects.exists())
+
+    @mock.patch.object(ipay, 'create_transaction', side_effect=breaker.CircuitOpen("ipay is unavailable"))
+    def test_open_circuit_postpones_the_attempt(self, create_transaction, enqueue_qr):
+        attempt = payments.start_ticket_payment(self.user, self.ticket, "1000", "254700000000")
+
+        self.run_worker()
+
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.INITIATED)
+        self.assertGreater(attempt.next_check_at, timezone.now() + timedelta(seconds=ipay.breaker.open_seconds - 5))
+
+
+class TicketQrTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        self.user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret",
+                                                    "normal")
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        self.ticket = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email=self.user.email,
+                                            user=self.user, play_id=play, ticket_number="T1", purchased=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_qr_codes_are_queued_once_the_payment_commits(self):
+        with mock.patch.object(qr, "executor") as executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                qr.enqueue([self.ticket.pk])
+                executor.assert_not_called()
+
+        executor.return_value.submit.assert_called_once_with(qr._render_by_id, self.ticket.pk)
+
+    def test_endpoint_renders_a_missing_qr_code_once(self):
+        with mock.patch.object(qr, "png", wraps=qr.png) as png:
+            first = self.client.get(f"/api/tickets/{self.ticket.pk}/qr/")
+            second = self.client.get(f"/api/tickets/{self.ticket.pk}/qr/")
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertTrue(first.data["data"]["qr_code"].endswith("/T1.png"))
+        self.assertEqual(second.data, first.data)
+        png.assert_called_once()
+        self.assertFalse(qr.pending().exists())
+
+    def test_endpoint_refuses_unpaid_tickets(self):
+        Ticket.objects.filter(pk=self.ticket.pk).update(purchased=False)
+
+        response = self.client.get(f"/api/tickets/{self.ticket.pk}/qr/")
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+
+class TicketListTests(TestCase):
+
+    def setUp(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        for n in range(5):
+            user = UserAccount.objects.create_user(f"buyer{n}@example.com", "Jane", f"Doe{n}", "0700000000", "secret",
+                                                   "normal")
+            Ticket.objects.create(seat_numbers=f"Center-A{n}", price=1000, email=user.email, user=user,
+                                  play_id=play, ticket_number=f"T{n}")
+        staff = UserAccount.objects.create_user("staff@example.com", "Staff", "User", "0700000001", "secret", "admin")
+        staff.is_staff = True
+        staff.save()
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+
+    def test_staff_list_does_not_query_per_ticket(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/tickets/")
+
+        self.assertEqual(len(response.data["data"]), 5)
+        self.assertEqual(response.data["data"][0]["user"]["email"], "buyer4@example.com")
+        self.assertEqual(response.data["data"][0]["play"]["title"], "Play")
+
+    def test_list_is_paged_by_cursor(self):
+        first = self.client.get("/api/tickets/", {"page_size": 2, "count": "true"})
+        second = self.client.get(first.data["next"])
+        Ticket.objects.create(seat_numbers="Center-B1", price=1000, email="late@example.com",
+                              user=UserAccount.objects.first(), play_id=Play.objects.first(), ticket_number="T9")
+        third = self.client.get(second.data["next"])
+
+        numbers = [[row["ticket_number"] for row in page.data["data"]] for page in (first, second, third)]
+        self.assertEqual(numbers, [["T4", "T3"], ["T2", "T1"], ["T0"]])
+        self.assertEqual(first.data["count"], 5)
+        self.assertIsNone(third.data["next"])
+
+    def test_compact_list_is_flat(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/tickets/compact/")
+
+        row = response.data["data"][0]
+        self.assertEqual((row["ticket_number"], row["user_email"], row["user_name"], row["play_title"]),
+                         ("T4", "buyer4@example.com", "Jane Doe4", "Play"))
+
+    def test_export_streams_csv(self):
+        Ticket.objects.filter(ticket_number="T0").update(added_on=datetime(2024, 1, 10, 12, 0))
+        response = self.client.get("/api/tickets/export/csv/", {"from": "2024-01-01", "to": "2024-01-31"})
+
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment", response["Content-Disposition"])
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("id,ticket_number,"))
+        self.assertIn(",T0,", lines[1])
+
+    def test_export_streams_ndjson_by_play(self):
+        other = Play.objects.create(title="Other", synopsis="Synopsis", theater=Play.Theater.NAIROBI_CINEMAS,
+                                    location="Nairobi", amount="500")
+        Ticket.objects.create(seat_numbers="Center-C1", price=500, email="other@example.com",
+                              user=UserAccount.objects.first(), play_id=other, ticket_number="T8")
+        response = self.client.get("/api/tickets/export/ndjson/", {"play": other.pk})
+
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row["ticket_number"], row["play_id__title"], row["price"]) for row in rows],
+                         [("T8", "Other", "500.00")])
+
+    def test_export_rejects_bad_dates_and_non_staff(self):
+        self.assertEqual(self.client.get("/api/tickets/export/csv/", {"from": "yesterday"}).status_code, 400)
+        self.client.force_authenticate(UserAccount.objects.get(email="buyer0@example.com"))
+        self.assertEqual(self.client.get("/api/tickets/export/csv/").status_code, 403)
+
+
+class AdmissionTests(TestCase):
+
+    def setUp(self):
+        user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret", "normal")
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00", time2="21:00")
+        self.showtime = seating.resolve_showtime(play_time, "18:00")
+        self.other_showtime = seating.resolve_showtime(play_time, "21:00")
+        self.ticket = Ticket.objects.create(seat_numbers="Center-A1", price=1000, email=user.email, user=user,
+                                            play_id=play, ticket_number="T1", showtime=self.showtime, purchased=True)
+        self.token = admission.ticket_token(self.ticket)
+        staff = UserAccount.objects.create_user("door@example.com", "Door", "Staff", "0700000001", "secret", "admin")
+        staff.is_staff = True
+        staff.save()
+        self.client = APIClient()
+        self.client.force_authenticate(staff)
+
+    def test_token_is_compact_and_signed(self):
+        self.assertLessEqual(len(self.token), 40)
+        self.assertRegex(self.token, r"^[0-9A-Z.]+$")
+        self.assertEqual(admission.parse(self.token), (self.ticket.pk, self.showtime.pk))
+        self.assertIsNone(admission.parse(self.token[:-1] + ("B" if self.token.endswith("A") else "A")))
+        self.assertIsNone(admission.parse(self.token.replace(".1.", ".2.", 1)))
+
+    def test_scan_admits_a_ticket_once(self):
+        first = self.client.post("/api/tickets/scan/", {"token": self.token, "showtime_id": self.showtime.pk})
+        second = self.client.post("/api/tickets/scan/", {"token": self.token, "showtime_id": self.showtime.pk})
+        elsewhere = self.client.post("/api/tickets/scan/", {"token": self.token,
+                                                            "showtime_id": self.other_showtime.pk})
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.data["data"]["seat_numbers"], "Center-A1")
+        self.assertEqual(second.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(second.data["outcome"], admission.ALREADY_ADMITTED)
+        self.assertEqual(elsewhere.data["outcome"], admission.WRONG_SHOW)
+
+    def test_malformed_showtime_id_is_rejected(self):
+        response = self.client.post("/api/tickets/scan/", {"token": self.token, "showtime_id": "18:00"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(admission.admit(self.token, "18:00"), (admission.INVALID, None))
+        self.ticket.refresh_from_db()
+        self.assertIsNone(self.ticket.admitted_at)
+
+    def test_offline_bundle_lists_token_hashes(self):
+        self.client.post("/api/tickets/scan/", {"token": self.token})
+
+        response = self.client.get(f"/api/tickets/admissions/{self.showtime.pk}/")
+
+        self.assertEqual(response.data["data"]["tickets"], [admission.token_hash(self.token)])
+        self.assertEqual(response.data["data"]["admitted"], [admission.token_hash(self.token)])
+        self.assertNotIn(self.token, str(response.data))
+
+
+class IpaySimulatorTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret",
+                                                    "normal")
+        self.video = Video.objects.create(title="Video", duration="90", synopsis="Synopsis")
+        self.simulator = IpaySimulator(confirm_seconds=0, seed=1)
+        server = make_server(self.simulator)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        # A session of its own, so the shared one keeps its adapters mounted for the real gateway URL
+        for patcher in (mock.patch.object(ipay, "IPAY_URL", f"http://127.0.0.1:{server.server_address[1]}/payments/v2"),
+                        mock.patch.object(ipay, "_session", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_worker(self):
+        PaymentAttempt.objects.update(next_check_at=timezone.now())
+        return payments.process_due()
+
+    def test_payment_completes_against_the_simulated_gateway(self):
+        attempt = payments.start_video_payment(self.user, self.video, "250", "254700000000")
+
+        for _ in range(3):
+            self.run_worker()
+
+        attempt.refresh_from_db()
+        self.assertEqual(attempt.status, PaymentAttempt.Status.COMPLETED)
+        self.assertEqual(attempt.video_payment.amount, Decimal("250"))
+        self.assertEqual(self.simulator.requests, 4)
+
+    def test_simulator_rejects_requests_with_a_bad_hash(self):
+        status_code, payload = self.simulator.handle("/payments/v2/transact", {"oid": "1", "hash": "bad"})
+
+        self.assertEqual(status_code, 400)
+        with self.assertRaises(ipay.GatewayError):
+            ipay.status_hash("unknown")
+
+
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.breaker = breaker.CircuitBreaker("test", failure_rate=0.5, min_calls=4, slow_call_seconds=1,
+                                              open_seconds=30)
+
+    def test_opens_once_the_failure_rate_is_reached(self):
+        self.breaker.record(True, 0.1)
+        self.breaker.record(True, 0.1)
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state(), breaker.CLOSED)
+
+        # Slow calls count as failures
+        self.breaker.record(True, 2)
+
+        self.assertEqual(self.breaker.state(), breaker.OPEN)
+        with self.assertRaises(breaker.CircuitOpen):
+            self.breaker.before_call()
+        self.assertEqual(self.breaker.stats()["times_opened"], 1)
+
+    def test_half_open_lets_one_probe_through(self):
+        for _ in range(4):
+            self.breaker.record(False, 0.1)
+        later = cache.get("breaker:test:state")["since"] + 31
+
+        with mock.patch("heartstringApp.breaker.time.time", return_value=later):
+            self.assertEqual(self.breaker.state(), breaker.HALF_OPEN)
+            self.breaker.before_call()
+            with self.assertRaises(breaker.CircuitOpen):
+                self.breaker.before_call()
+            self.breaker.record(True, 0.1)
+            self.assertEqual(self.breaker.state(), breaker.CLOSED)
+            self.breaker.before_call()
+
+    def test_gateway_errors_trip_the_gateway_breaker(self):
+        failing = mock.Mock(**{"post.side_effect": ipay.requests.ConnectionError("refused")})
+        with mock.patch.object(ipay, "session", return_value=failing):
+            for _ in range(ipay.breaker.min_calls):
+                with self.assertRaises(ipay.requests.ConnectionError):
+                    ipay.post("/transact")
+            with self.assertRaises(breaker.CircuitOpen):
+                ipay.post("/transact")
+
+        self.assertEqual(failing.post.call_count, ipay.breaker.min_calls)
+
+    def test_full_bulkhead_does_not_use_up_the_half_open_probe(self):
+        with mock.patch.object(ipay, "breaker", self.breaker), \
+                mock.patch.object(ipay, "bulkhead", breaker.Bulkhead("test", 1, wait_seconds=0.01)), \
+                mock.patch.object(ipay, "session") as session:
+            session.return_value.post.return_value = mock.Mock(status_code=200)
+            for _ in range(4):
+                self.breaker.record(False, 0.1)
+            later = cache.get("breaker:test:state")["since"] + 31
+
+            with mock.patch("heartstringApp.breaker.time.time", return_value=later):
+                with ipay.bulkhead:
+                    with self.assertRaises(breaker.BulkheadFull):
+                        ipay.post("/transact")
+                ipay.post("/transact")
+
+        self.assertEqual(self.breaker.state(), breaker.CLOSED)
+
+    def test_bulkhead_rejects_calls_beyond_its_capacity(self):
+        bulkhead = breaker.Bulkhead("test", 1, wait_seconds=0.01)
+
+        with bulkhead:
+            with self.assertRaises(breaker.BulkheadFull):
+                with bulkhead:
+                    pass
+        with bulkhead:
+            pass
+
+
+class DashboardTests(TestCase):
+
+    def setUp(self):
+        user = UserAccount.objects.create_user("buyer@example.com", "Jane", "Doe", "0700000000", "secret", "normal")
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000", is_available=True)
+        video = Video.objects.create(title="Video", duration="90", synopsis="Synopsis")
+        for number, (added_on, purchased) in enumerate([(datetime(2024, 1, 5, 10), True),
+                                                        (datetime(2024, 1, 5, 18), True),
+                                                        (datetime(2024, 1, 6, 12), False),
+                                                        (datetime(2024, 2, 1, 12), True)]):
+            ticket = Ticket.objects.create(seat_numbers=f"Center-A{number}", price=1000, email=user.email, user=user,
+                                           play_id=play, ticket_number=f"T{number}", purchased=purchased)
+            Ticket.objects.filter(pk=ticket.pk).update(added_on=added_on)
+        payment = VideoPayments.objects.create(ref_number="R1", payment_mode="mpesa", msisdn="0700000000",
+                                               msisdn_idnum="1", amount=250, video=video, user=user)
+        VideoPayments.objects.filter(pk=payment.pk).update(added_on=datetime(2024, 1, 6, 9))
+        revenue.rebuild()
+
+    def test_summary_reads_the_rollup(self):
+        with self.assertNumQueries(10):
+            summary = dashboard.summary(today=datetime(2024, 1, 6))
+
+        self.assertEqual(summary["daily_tickets"], [{"date": date(2024, 1, 5), "amt": 2000.0},
+                                                    {"date": date(2024, 2, 1), "amt": 1000.0}])
+        self.assertEqual(summary["monthly_ticket"], [{"date": date(2024, 1, 1), "amt": 2000.0},
+                                                     {"date": date(2024, 2, 1), "amt": 1000.0}])
+        self.assertEqual(summary["monthly_stream"], [{"date": date(2024, 1, 1), "amt": 250.0}])
+        self.assertEqual(summary["weekly_tickets"][0]["amt"], 2000.0)
+        self.assertEqual(summary["weekly_streams"][0]["amt"], 250.0)
+        self.assertEqual((summary["users"], summary["active_plays"], summary["tickets_sold"]), (1, 1, 3))
+
+    def test_sales_are_added_to_the_rollup(self):
+        revenue.record([(RevenueRollup.Kind.STREAM, date(2024, 1, 6), Decimal("100.50")),
+                        (RevenueRollup.Kind.STREAM, date(2024, 1, 7), 300)])
+
+        rows = RevenueRollup.objects.filter(kind=RevenueRollup.Kind.STREAM).order_by('day')
+        self.assertEqual([(row.day, row.amount, row.count) for row in rows],
+                         [(date(2024, 1, 6), Decimal("350.50"), 2), (date(2024, 1, 7), Decimal("300.00"), 1)])
+        # A rebuild recomputes the same days from the sales tables
+        revenue.rebuild()
+        self.assertEqual(RevenueRollup.objects.get(kind=RevenueRollup.Kind.STREAM).amount, Decimal("250.00"))
+
+    def test_deleted_sales_are_taken_out_of_the_rollup(self):
+        Ticket.objects.filter(ticket_number__in=["T0", "T2"]).delete()
+        VideoPayments.objects.all().delete()
+
+        rollup = RevenueRollup.objects.get(kind=RevenueRollup.Kind.TICKET, day=date(2024, 1, 5))
+        self.assertEqual((rollup.amount, rollup.count), (Decimal("1000.00"), 1))
+        stream = RevenueRollup.objects.get(kind=RevenueRollup.Kind.STREAM)
+        self.assertEqual((stream.amount, stream.count), (Decimal("0.00"), 0))
+
+    def test_snapshot_is_shared_until_a_sale(self):
+        cache.clear()
+        first = dashboard.cached_summary()
+        with self.assertNumQueries(0):
+            self.assertEqual(dashboard.cached_summary(), first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            revenue.record([(RevenueRollup.Kind.STREAM, date(2024, 1, 6), 100)])
+
+        self.assertEqual(dashboard.cached_summary()["monthly_stream"], [{"date": date(2024, 1, 1), "amt": 350.0}])
+
+    def test_stale_snapshot_is_served_while_another_worker_recomputes(self):
+        cache.clear()
+        stale = dashboard.cached_summary()
+        with self.captureOnCommitCallbacks(execute=True):
+            revenue.record([(RevenueRollup.Kind.STREAM, date(2024, 1, 6), 100)])
+        cache.add(dashboard.LOCK_KEY, True, dashboard.DASHBOARD_LOCK_SECONDS)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(dashboard.cached_summary(), stale)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Query plan assertions are written against SQLite's EXPLAIN output")
+class SeatQueryPlanTests(TestCase):
+
+    def setUp(self):
+        play = Play.objects.create(title="Play", synopsis="Synopsis", theater=Play.Theater.KENYA_NATIONAL_THEATER,
+                                   location="Nairobi", amount="1000")
+        play_time = PlayTime.objects.create(play_id=play, play_date=date(2024, 3, 1), time1="18:00")
+        self.showtime = seating.resolve_showtime(play_time, "18:00")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f"USING INDEX {index_name}", plan)
+
+    def test_seat_list_uses_date_slot_index(self):
+        self.assertUsesIndex(seating.seats_on(date(2024, 3, 1), "18:00"), "seat_date_slot_idx")
+
+    def test_available_seats_use_partial_unbooked_index(self):
+        self.assertUsesIndex(seating.unbooked_seats([self.showtime]), "seat_unbooked_idx")
+
+    def test_show_seat_map_uses_show_index(self):
+        queryset = seating.show_seats(self.showtime).values('id', 'seat_number', 'is_booked', 'held_until')
+        # SQLite backs the unique constraint with an autoindex, so check the lookup rather than the index name
+        plan = queryset.explain()
+        self.assertIn("SEARCH heartstringApp_seat USING INDEX", plan)
+        self.assertIn("(showtime_id=?)", plan)
+
+    def test_hold_sweep_uses_expiry_index(self):
+        queryset = Seat.objects.filter(held_until__lte=timezone.now(), is_booked=False)
+        self.assertUsesIndex(queryset, "seat_hold_expiry_idx")
@@ -0,0 +1,137 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+# Every scope (the plays catalog, the seats of one show, ...) has a version in the cache that changes on each write.
+# Responses built from a scope carry an ETag derived from its version, so a client revalidating an unchanged screen
+# gets a 304 without the endpoint touching the database. A version that was evicted simply comes back as a new one.
+# Writes in one process must be seen by all of them, so this is only switched on with a cache every process shares.
+PLAYS = 'plays'
+VIDEOS = 'videos'
+# Ticket and stream sales shown on the admin dashboard
+DASHBOARD = 'dashboard'
+
+
+def showtime_scope(showtime_id):
+    return f"showtime:{showtime_id}"
+
+
+def layout_scope(theater):
+    return f"layout:{hashlib.md5(str(theater).encode()).hexdigest()}"
+
+
+# Versions are dropped after this long, so even a missed bump cannot keep a stale copy valid forever
+VERSION_TTL = getattr(settings, 'VERSION_TTL', 24 * 60 * 60)
+
+
+def shared_cache():
+    """
+    Whether the default cache is shared by every process. CACHE_SHARED overrides the guess from the backend.
+    """
+    shared = getattr(settings, 'CACHE_SHARED', None)
+    if shared is not None:
+        return shared
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def _key(scope):
+    return f"version:{scope}"
+
+
+def _new_version(expires=(), previous=None):
+    # "at" is the Last-Modified second. It always moves past the previous version's, so a write in the same second as
+    # the copy a client holds still fails its If-Modified-Since.
+    at = max(int(time.time()) + 1, (previous or {}).get("at", 0) + 1)
+    return {"token": uuid.uuid4().hex[:12], "at": at, "expires": sorted(set(expires))}
+
+
+def get_versions(scopes):
+    """
+    Return {scope: version} for the given scopes, creating versions for scopes seen for the first time.
+    A version carries the time it was made ("at") and the times at which it stops being valid without any write
+    ("expires"), e.g. when seat holds lapse.
+    """
+    keys = {_key(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    now = time.time()
+    versions = {}
+    for key, scope in keys.items():
+        version = found.get(key)
+        if version is None or (version["expires"] and version["expires"][0] <= now):
+            version = _new_version([expires for expires in (version or {}).get("expires", []) if expires > now],
+                                   version)
+            cache.set(key, version, VERSION_TTL)
+        versions[scope] = version
+    return versions
+
+
+def bump(scopes, expires=None):
+    """
+    Give the scopes new versions once the surrounding transaction commits.
+    expires is a datetime after which the new versions lapse by themselves.
+    """
+    scopes = set(scopes)
+
+    def update():
+        found = cache.get_many([_key(scope) for scope in scopes])
+        now = time.time()
+        new_versions = {}
+        for scope in scopes:
+            # Carry over the lapse times of earlier writes that are still ahead
+            previous = found.get(_key(scope))
+            pending = [at for at in (previous or {}).get("expires", []) if at > now]
+            if expires is not None:
+                pending.append(int(expires.timestamp()) + 1)
+            new_versions[_key(scope)] = _new_version(pending, previous)
+        cache.set_many(new_versions, VERSION_TTL)
+
+    if scopes:
+        transaction.on_commit(update)
+
+
+def etag(request, versions):
+    # The representation also depends on the URL (filters, absolute media links), so it is part of the tag
+    parts = [request.get_full_path(), request.get_host()]
+    parts += [f"{scope}={versions[scope]['token']}" for scope in sorted(versions)]
+    return quote_etag(hashlib.md5("|".join(parts).encode()).hexdigest())
+
+
+def _not_modified(request, tag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return tag in [value.strip() for value in if_none_match.split(',')] or if_none_match.strip() == '*'
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since') or '')
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def conditional(request, scopes, build):
+    """
+    Answer a GET with 304 when the client's copy is current, otherwise build the response and tag it.
+    build is only called when the response has to be sent. Without a shared cache every request is built.
+    """
+    if not shared_cache():
+        return build()
+    versions = get_versions(scopes)
+    tag = etag(request, versions)
+    last_modified = max([version["at"] for version in versions.values()], default=0)
+
+    if _not_modified(request, tag, last_modified):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+    response['ETag'] = tag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep the body but must revalidate before using it
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -1,16 +1,10 @@
-import hashlib
-import hmac
 import json
 import uuid
-import re
-from datetime import datetime, timedelta, date
-from io import BytesIO
-from time import sleep
-import time
-
-import qrcode
-import requests
-from django.core.files.base import ContentFile, File
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
@@ -23,13 +17,15 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from heartstringApp import serializers
+from heartstringApp import serializers, admission, booking, breaker, dashboard, events, exports, ipay, payments, qr, \
+    seating, versions
+from heartstringApp.pagination import paginate
 from heartstringApp.models import Ticket, Payment, Play, Video, PlayCast, OtherOffers, PlayTime, \
-    VideoCast, VideoAvailability, UserAccount, VideoPayments, Seat, ViewHistory
-from heartstringApp.serializers import TicketsSerializer, PaymentSerializer, PlaySerializer, \
+    VideoCast, VideoAvailability, UserAccount, VideoPayments, ViewHistory, Showtime, PaymentAttempt
+from heartstringApp.serializers import TicketsSerializer, TicketListSerializer, PaymentSerializer, PlaySerializer, \
     PlayCastSerializer, VideoSerializer, VideoCastSerializer, VideoPaymentSerializer, \
     VideoAvailabilitySerializer, OtherOfferSerializer, PlayDateSerializer, UserAccountSerializer, \
-    MyPlaySerializer, MyStreamSerializer, SeatSerializer, ViewHistorySerializer
+    MyPlaySerializer, MyStreamSerializer, SeatSerializer, ViewHistorySerializer, PaymentAttemptSerializer
 
 from django.contrib.auth import get_user_model
 
@@ -121,15 +117,53 @@ class AvailableSeatsView(APIView):
     """
 
     def get(self, request, play_time_id, format=None):
+        # Revalidation only needs the show keys, not the seat rows
+        shows = Showtime.objects.filter(play_time_id=play_time_id).values_list('id', 'theater')
+        scopes = set()
+        for showtime_id, theater in shows:
+            scopes.update([versions.showtime_scope(showtime_id), versions.layout_scope(theater)])
+        if not scopes:
+            return self.available_seats(play_time_id)
+        return versions.conditional(request, scopes, lambda: self.available_seats(play_time_id))
+
+    def available_seats(self, play_time_id):
         try:
-            play_time = PlayTime.objects.get(id=play_time_id)
-            available_seats = Seat.objects.filter(play_time=play_time, is_booked=False)
+            play_time = PlayTime.objects.select_related('play_id').get(id=play_time_id)
+            showtimes = seating.sync_showtimes([play_time]).values()
+            if seating.lazy_seat_maps():
+                # Free seats have no rows of their own; derive them from the theater layout
+                return Response(seating.available_seats(showtimes))
+            available_seats = seating.unbooked_seats(showtimes)
             serializer = SeatSerializer(available_seats, many=True)
             return Response(serializer.data)
         except PlayTime.DoesNotExist:
             return Response({'error': 'PlayTime not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+def get_showtime(params):
+    """
+    Resolve the show a seat request refers to: either showtime, or the legacy play_time and time_slot pair.
+    """
+    showtime_id = params.get('showtime')
+    if showtime_id:
+        try:
+            return Showtime.objects.get(pk=int(showtime_id))
+        except (TypeError, ValueError):
+            raise ValidationError(detail="Invalid 'showtime' provided.")
+        except Showtime.DoesNotExist:
+            raise NotFound(detail="Showtime not found.")
+
+    play_time_id = params.get('play_time')
+    time_slot = params.get('time_slot')
+    if not play_time_id or not time_slot:
+        raise ValidationError(detail="Either 'showtime' or both 'play_time' and 'time_slot' are required.")
+    play_time = get_object_or_404(PlayTime.objects.select_related('play_id'), pk=play_time_id)
+    showtime = seating.resolve_showtime(play_time, time_slot)
+    if showtime is None:
+        raise NotFound(detail="No such time slot for this play time.")
+    return showtime
+
+
 class SeatViewSet(viewsets.ViewSet):
     authentication_classes = [JWTAuthentication]
     permission_classes = [AllowAny]  # Adjust as needed for your auth requirements
@@ -141,113 +175,299 @@ class SeatViewSet(viewsets.ViewSet):
         play_date = request.query_params.get('play_date')
         time_slot = request.query_params.get('time_slot')
 
+        if seating.lazy_seat_maps():
+            try:
+                showtimes = Showtime.objects.filter(play_date=play_date, time_slot=time_slot)
+                seats = [seat for showtime in showtimes for seat in seating.seat_map(showtime)]
+            except (ValueError, DjangoValidationError):
+                raise ValidationError(detail="Invalid 'date' or 'time_slot' provided.")
+            if not seats:
+                raise NotFound(detail="No seats found for the provided date and time slot.")
+            # A lazy map is built from the theater layout, so its size is bounded by the theater's seats
+            return Response({"error": False, "message": "All Seats List Data", "data": seats})
+
         try:
-            seats = Seat.objects.filter(play_date=play_date, time_slot=time_slot)
+            seats = seating.seats_on(play_date, time_slot)
             if not seats.exists():
                 raise NotFound(detail="No seats found for the provided date and time slot.")
         except ValueError:
             raise ValidationError(detail="Invalid 'date' or 'time_slot' provided.")
 
-        serializer = SeatSerializer(seats, many=True)
-        return Response({"error": False, "message": "All Seats List Data", "data": serializer.data})
+        return paginate(request, seats, lambda page: SeatSerializer(page, many=True).data, "All Seats List Data",
+                        ordering='id')
+
+    @action(detail=False, methods=['get'], url_path='map')
+    def seat_map(self, request):
+        """
+        Full seat map of one show (showtime, or play_time and time_slot), computed as the theater layout minus bookings.
+        """
+        seats = seating.seat_map(get_showtime(request.query_params))
+        return Response({"error": False, "message": "Seat Map", "data": seats})
+
+    @action(detail=False, methods=['get'], url_path='layout')
+    def layout(self, request):
+        """
+        Ordered seat list of the theater a show is staged in. Bit i of the availability bitset is seats[i].
+        """
+        if request.query_params.get('showtime') or request.query_params.get('time_slot'):
+            theater = get_showtime(request.query_params).theater
+        else:
+            play_time = get_object_or_404(PlayTime.objects.select_related('play_id'),
+                                          pk=request.query_params.get('play_time'))
+            theater = play_time.play_id.theater
+        current_layout_id, seats = seating.layout_index(theater)
+        return Response({"error": False, "message": "Seat Layout",
+                         "data": {"layout_id": current_layout_id, "seats": [seat_number for wing, seat_number in seats]}})
+
+    @action(detail=False, methods=['get'], url_path='availability')
+    def availability(self, request):
+        """
+        Compact availability of one show: a base64 bitset over the layout where a set bit means the seat is taken.
+        """
+        bitmap = seating.availability_bitmap(get_showtime(request.query_params))
+        return Response({"error": False, "message": "Seat Availability", "data": seating.encode_bitmap(bitmap)})
 
     @action(detail=False, methods=['post'], url_path='book')
     def book_seats(self, request):
         """
-        Book multiple seats by marking them as booked. Expects a list of seat IDs in the request body.
+        Book multiple seats by marking them as booked. Expects a list of seat IDs in the request body, or
+        showtime (or play_time and time_slot) and a list of seat_numbers (required for lazy seat maps).
+        Pass all_or_nothing=true to book none of the seats unless all of them are free.
         """
         seat_ids = request.data.get('seat_ids')
+        seat_numbers = request.data.get('seat_numbers')
+        all_or_nothing = str(request.data.get('all_or_nothing', '')).lower() in ('1', 'true', 'yes')
 
-        if not seat_ids:
+        if seat_numbers:
+            showtime = get_showtime(request.data)
+            result = booking.book_seat_numbers(showtime, seat_numbers, all_or_nothing=all_or_nothing)
+        elif seat_ids:
+            try:
+                result = booking.book_seats(seat_ids, all_or_nothing=all_or_nothing)
+            except (TypeError, ValueError):
+                return Response({'error': True, 'message': 'Seat IDs must be integers.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        else:
             return Response({'error': True, 'message': 'No seat IDs provided.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        booked_seats = []
-        not_found_seats = []
-        already_booked_seats = []
-
-        for seat_id in seat_ids:
-            try:
-                seat = Seat.objects.get(pk=seat_id)
-                if seat.is_booked:
-                    already_booked_seats.append(seat_id)
-                else:
-                    seat.is_booked = True
-                    seat.save()
-                    booked_seats.append(seat_id)
-            except Seat.DoesNotExist:
-                not_found_seats.append(seat_id)
+        if all_or_nothing and not result.complete:
+            return Response({
+                'error': True,
+                'message': "None of the seats were booked because some are unavailable.",
+                **result.as_dict()
+            }, status=status.HTTP_409_CONFLICT)
 
         message = "Seats booking status updated."
-        if not_found_seats:
-            message += f" Not found seats: {not_found_seats}."
-        if already_booked_seats:
-            message += f" Already booked seats: {already_booked_seats}."
+        if result.missing:
+            message += f" Not found seats: {result.missing}."
+        if result.conflicting:
+            message += f" Already booked seats: {result.conflicting}."
 
         return Response({
             'error': False,
             'message': message,
-            'booked_seats': booked_seats,
-            'already_booked_seats': already_booked_seats,
-            'not_found_seats': not_found_seats
+            **result.as_dict()
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='hold')
+    def hold_seats(self, request):
+        """
+        Hold seats for a ticket while it is being paid for. Expects ticket_id plus either seat_ids, or showtime
+        (or play_time and time_slot) and seat_numbers. All seats are held or none; the holds expire on their own if payment never
+        completes and are turned into bookings when it succeeds.
+        """
+        ticket = get_object_or_404(Ticket, pk=request.data.get('ticket_id'))
+        if not request.user.is_authenticated or (ticket.user_id != request.user.id and not request.user.is_staff):
+            return Response({'error': True, 'message': 'Unauthorized access'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        seat_ids = request.data.get('seat_ids')
+        seat_numbers = request.data.get('seat_numbers')
+        if seat_numbers:
+            showtime = get_showtime(request.data)
+            result = booking.hold_seat_numbers(showtime, seat_numbers, ticket)
+        elif seat_ids:
+            try:
+                result = booking.hold_seats(seat_ids, ticket)
+            except (TypeError, ValueError):
+                return Response({'error': True, 'message': 'Seat IDs must be integers.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        else:
+            return Response({'error': True, 'message': 'No seat IDs provided.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not result.complete:
+            return Response({
+                'error': True,
+                'message': "None of the seats were held because some are unavailable.",
+                **result.as_dict()
+            }, status=status.HTTP_409_CONFLICT)
+
+        return Response({
+            'error': False,
+            'message': "Seats held.",
+            'held_seats': result.claimed,
+            'held_until': result.held_until,
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='allocate')
+    def allocate_seats(self, request):
+        """
+        Pick and claim the best block of adjacent seats for a group. Expects showtime (or play_time and time_slot),
+        party_size and
+        optionally wing (Left, Center or Right). With ticket_id the seats are held for that ticket's payment,
+        otherwise they are booked.
+        """
+        showtime = get_showtime(request.data)
+
+        try:
+            party_size = int(request.data.get('party_size'))
+        except (TypeError, ValueError):
+            party_size = 0
+        if party_size < 1:
+            return Response({'error': True, 'message': 'party_size must be a positive integer.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        ticket = None
+        if request.data.get('ticket_id'):
+            ticket = get_object_or_404(Ticket, pk=request.data.get('ticket_id'))
+            if not request.user.is_authenticated or (ticket.user_id != request.user.id and not request.user.is_staff):
+                return Response({'error': True, 'message': 'Unauthorized access'},
+                                status=status.HTTP_401_UNAUTHORIZED)
+
+        result = booking.allocate_seats(showtime, party_size, wing=request.data.get('wing'), ticket=ticket)
+        if not result.claimed:
+            return Response({'error': True, 'message': f"No block of {party_size} adjacent seats is available."},
+                            status=status.HTTP_409_CONFLICT)
+
+        return Response({
+            'error': False,
+            'message': "Seats held." if ticket else "Seats booked.",
+            'seats': result.claimed,
+            'held_until': result.held_until,
         }, status=status.HTTP_200_OK)
 
     @action(detail=False, methods=['get'], url_path='available')
     def available_seats(self, request):
         """
-        List all available seats, optionally filtered by date and time slot.
+        List all available seats, optionally filtered by showtime, or by date and time slot.
         """
+        showtime_id = request.query_params.get('showtime')
         date = request.query_params.get('date')
         time_slot = request.query_params.get('time_slot')
-        queryset = Seat.objects.filter(is_booked=False)
+        showtimes = Showtime.objects.all()
 
-        if date and time_slot:
-            try:
-                queryset = queryset.filter(play_time__date=date, play_time__time_slot=time_slot)
-                if not queryset.exists():
-                    raise NotFound(detail="No available seats found for the provided date and time slot.")
-            except ValueError:
-                raise ValidationError(detail="Invalid 'date' or 'time_slot' provided.")
+        try:
+            if showtime_id:
+                showtimes = showtimes.filter(pk=int(showtime_id))
+            elif date and time_slot:
+                showtimes = showtimes.filter(play_date=date, time_slot=time_slot)
+            showtimes = list(showtimes)
+        except (ValueError, DjangoValidationError):
+            raise ValidationError(detail="Invalid 'showtime', 'date' or 'time_slot' provided.")
+
+        if seating.lazy_seat_maps():
+            # Free seats have no rows of their own; derive them from the theater layouts
+            seats = seating.available_seats(showtimes)
+        else:
+            seats = SeatSerializer(seating.unbooked_seats(showtimes), many=True).data
 
-        if not queryset.exists():
+        if not seats:
             return Response({'error': True, 'message': 'No available seats.'}, status=status.HTTP_404_NOT_FOUND)
 
-        serializer = SeatSerializer(queryset, many=True)
-        return Response({"error": False, "message": "All Available Seats", "data": serializer.data})
-
-
-def generate_qr_code(data):
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="white", back_color="transparent")
-    buffer = BytesIO()
-    img.save(buffer, format="PNG")
-    qr_code_image = buffer.getvalue()
+        return Response({"error": False, "message": "All Available Seats", "data": seats})
+
+
+def _seat_events_start(showtime_id, last_event_id):
+    showtime = Showtime.objects.filter(pk=showtime_id).first()
+    if showtime is None:
+        raise Http404("Showtime not found.")
+    if last_event_id is not None:
+        return last_event_id, None
+    # Read the position before the bitmap so no change can fall between the snapshot and the first delta
+    after = events.last_seq(showtime.id)
+    return after, seating.encode_bitmap(seating.availability_bitmap(showtime))
+
+
+def _seat_events_poll(showtime_id, last_event_id):
+    showtime = Showtime.objects.filter(pk=showtime_id).first()
+    if showtime is None:
+        raise Http404("Showtime not found.")
+    if versions.shared_cache():
+        after = events.last_seq(showtime.id)
+        if last_event_id is not None:
+            deltas, after, gap = events.since(showtime.id, last_event_id)
+            if gap is None and after >= last_event_id:
+                return {"last_event_id": after, "snapshot": None,
+                        "events": [dict(event, id=event_seq) for event_seq, event in deltas]}
+    else:
+        # Deltas published by other processes never reach this one, so every poll gets the whole map
+        after = None
+    return {"last_event_id": after, "snapshot": seating.encode_bitmap(seating.availability_bitmap(showtime)),
+            "events": []}
+
+
+async def seat_events(request, showtime_id):
+    """
+    Server-Sent Events stream of seat-state changes for one show, for the seat picker to use instead of polling.
+    Starts with a snapshot event (the availability bitset) followed by seats events like
+    {"state": "booked", "seats": ["Center-A1"]}. A reset event means deltas were lost and the map must be reloaded.
 
-    return qr_code_image
+    Streaming needs the ASGI application and a cache shared by every process. Otherwise (e.g. under WSGI, which
+    would hold a worker for the whole stream and send nothing until it ends) this answers with one JSON poll
+    result instead: {"last_event_id", "snapshot", "events"}, with Retry-After saying when to ask again.
+    """
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.GET.get('last_event_id'))
+    except (TypeError, ValueError):
+        last_event_id = None
+
+    if not isinstance(request, ASGIRequest) or not versions.shared_cache():
+        data = await sync_to_async(_seat_events_poll)(showtime_id, last_event_id)
+        response = JsonResponse({"error": False, "message": "Seat Events", "data": data},
+                                json_dumps_params={"default": str})
+        response['Cache-Control'] = 'no-cache'
+        response['Retry-After'] = str(events.SEAT_EVENT_POLL_FALLBACK_SECONDS)
+        return response
+
+    after, snapshot = await sync_to_async(_seat_events_start)(showtime_id, last_event_id)
+    response = StreamingHttpResponse(events.stream(showtime_id, after, snapshot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def stream_export(request, name, export_format):
+    try:
+        return exports.stream(name, export_format, request.query_params)
+    except ValueError as e:
+        return Response({"error": True, "message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class TicketViewSet(viewsets.ViewSet):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated | IsAdminUser]  # Allow both authenticated users and admin users
 
-    def list(self, request):
+    def visible_tickets(self, request):
         if request.user.is_staff:  # Check if the user is an admin
-            tickets = Ticket.objects.all().order_by('-id')  # Retrieve all tickets in the database
+            tickets = Ticket.objects.all()  # Retrieve all tickets in the database
         else:
-            tickets = Ticket.objects.filter(user=request.user).order_by('-id')  # Filter tickets for regular users
-
-        serializer = TicketsSerializer(tickets, many=True, context={"request": request})
+            tickets = Ticket.objects.filter(user=request.user)  # Filter tickets for regular users
+        # One JOINed query instead of two more per ticket for its buyer and play
+        return tickets.select_related('user', 'play_id').order_by('-id')
 
-        response_dict = {"error": False, "message": "All Tickets List Data", "data": serializer.data}
+    def list(self, request):
+        return paginate(request, self.visible_tickets(request),
+                        lambda page: TicketsSerializer(page, many=True, context={"request": request}).data,
+                        "All Tickets List Data")
 
-        return Response(response_dict)
+    @action(detail=False, methods=["get"], url_path='compact')
+    def compact(self, request):
+        """
+        The same tickets as list, as flat rows with only the buyer's and play's names; meant for long admin lists.
+        """
+        return paginate(request, self.visible_tickets(request),
+                        lambda page: TicketListSerializer(page, many=True, context={"request": request}).data,
+                        "All Tickets List Data")
 
     def create(self, request):
         try:
@@ -258,8 +478,15 @@ class TicketViewSet(viewsets.ViewSet):
             play = serializer.validated_data.get('play')  # Assuming you have a 'play' field in your serializer
             ticket_number = str(uuid.uuid4().hex[:10].upper())  # Generate a unique ticket number
 
+            # Link the ticket to its show when the client only sent the legacy date and time fields
+            showtime = serializer.validated_data.get('showtime')
+            if showtime is None and serializer.validated_data.get('play_time'):
+                showtime = Showtime.objects.filter(play_id=serializer.validated_data.get('play_id'),
+                                                   play_date=serializer.validated_data.get('play_date'),
+                                                   time_slot=serializer.validated_data.get('play_time')).first()
+
             # Save the ticket with the generated ticket number
-            ticket = serializer.save(user=request.user, ticket_number=ticket_number)
+            ticket = serializer.save(user=request.user, ticket_number=ticket_number, showtime=showtime)
 
             # Include only the ticket ID in the response
             dict_response = {"error": False, "message": "Ticket created Successfully", "ticket_id": ticket.id}
@@ -268,18 +495,8 @@ class TicketViewSet(viewsets.ViewSet):
 
         return Response(dict_response)
 
-        # Custom method to generate and set a default QR code for the ticket
-
-    def generate_default_qr_code(self, ticket):
-        qr_code_data = f"Default QR Code Data for Ticket {ticket.ticket_number}"
-        qr_code_image = generate_qr_code(qr_code_data)
-
-        # Save the default QR code to the ticket
-        ticket.qr_code.save("default_qr_code.png", ContentFile(qr_code_image))
-        ticket.save()
-
     def retrieve(self, request, pk=None):
-        queryset = Ticket.objects.filter(user=request.user)
+        queryset = Ticket.objects.filter(user=request.user).select_related('user', 'play_id')
         tickets = get_object_or_404(queryset, pk=pk)
         serializer = TicketsSerializer(tickets, context={"request": request})
 
@@ -288,6 +505,75 @@ class TicketViewSet(viewsets.ViewSet):
 
         return Response(dict_response)
 
+    @action(detail=True, methods=["get"], url_path='qr')
+    def qr_code(self, request, pk=None):
+        """
+        The ticket's QR code. Codes are rendered in the background after payment; one that is not ready yet is
+        rendered now and kept, so the next request just gets the stored image.
+        """
+        queryset = Ticket.objects.all()
+        if not request.user.is_staff:
+            queryset = queryset.filter(user=request.user)
+        ticket = get_object_or_404(queryset, pk=pk)
+        if not ticket.purchased:
+            return Response({"error": True, "message": "Ticket is not paid for yet."},
+                            status=status.HTTP_409_CONFLICT)
+
+        if not ticket.qr_code and not qr.render(ticket):
+            response = Response({"error": False, "message": "QR code is being generated.", "data": None},
+                                status=status.HTTP_202_ACCEPTED)
+            response['Retry-After'] = '1'
+            return response
+        return Response({"error": False, "message": "Ticket QR Code",
+                         "data": {"qr_code": request.build_absolute_uri(ticket.qr_code.url)}})
+
+    @action(detail=False, methods=["post"], url_path='scan', permission_classes=[IsAdminUser])
+    def scan(self, request):
+        """
+        Admit the ticket whose QR token was scanned at the door. Expects token and optionally showtime_id, the show
+        the door is admitting; a ticket is admitted once.
+        """
+        showtime_id = request.data.get('showtime_id') or None
+        if showtime_id is not None:
+            try:
+                showtime_id = int(showtime_id)
+            except (TypeError, ValueError):
+                return Response({'error': True, 'message': 'showtime_id must be an integer.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        outcome, ticket = admission.admit(request.data.get('token', ''), showtime_id)
+        data = None
+        if ticket is not None:
+            data = {"ticket_id": ticket.id, "ticket_number": ticket.ticket_number, "seat_numbers": ticket.seat_numbers,
+                    "showtime_id": ticket.showtime_id, "admitted_at": ticket.admitted_at}
+        if outcome == admission.ADMITTED:
+            return Response({"error": False, "message": "Admitted", "data": data})
+
+        messages = {
+            admission.INVALID: ("Invalid ticket.", status.HTTP_400_BAD_REQUEST),
+            admission.WRONG_SHOW: ("Ticket is for another show.", status.HTTP_409_CONFLICT),
+            admission.NOT_PAID: ("Ticket is not paid for.", status.HTTP_409_CONFLICT),
+            admission.ALREADY_ADMITTED: ("Ticket was already admitted.", status.HTTP_409_CONFLICT),
+        }
+        message, status_code = messages[outcome]
+        return Response({"error": True, "message": message, "outcome": outcome, "data": data}, status=status_code)
+
+    @action(detail=False, methods=["get"], url_path=r'admissions/(?P<showtime_id>[0-9]+)',
+            permission_classes=[IsAdminUser])
+    def admissions(self, request, showtime_id=None):
+        """
+        Hashes of the valid and already admitted ticket tokens of a show, for scanners working offline.
+        """
+        get_object_or_404(Showtime, pk=showtime_id)
+        return Response({"error": False, "message": "Admission Bundle", "data": admission.bundle(showtime_id)})
+
+    @action(detail=False, methods=["get"], url_path=r'export/(?P<export_format>csv|ndjson)',
+            permission_classes=[IsAdminUser])
+    def export(self, request, export_format=None):
+        """
+        Every ticket as a CSV or NDJSON download, streamed as it is read. Filter with ?from=, ?to= and ?play=.
+        """
+        return stream_export(request, 'tickets', export_format)
+
     def destroy(self, request, pk=None):
         try:
             queryset = Ticket.objects.all()
@@ -300,6 +586,59 @@ class TicketViewSet(viewsets.ViewSet):
         return Response(dict_response)
 
 
+def payment_started(attempt):
+    return Response({
+        "error": False,
+        "message": "Payment initiated. Confirm it on your phone.",
+        "data": {"payment_id": attempt.id, "status": attempt.status},
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+def start_payment_once(request, fingerprint, start):
+    """
+    Start a payment with start(), or answer a client's retry (same Idempotency-Key header) with the payment its
+    first request started, so a retried request never sends a second prompt or charge.
+    """
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if len(key) > 64:
+        return Response({"error": True, "message": "Idempotency-Key must be at most 64 characters."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    def start_when_available():
+        # Refuse new payments while the gateway's circuit is open instead of queueing work that cannot go through
+        if ipay.breaker.state() == breaker.OPEN:
+            raise breaker.CircuitOpen("ipay is unavailable")
+        return start()
+
+    try:
+        attempt, replayed = payments.start_once(request.user, key, fingerprint, start_when_available)
+    except breaker.CircuitOpen:
+        response = Response({"error": True, "message": "Payments are temporarily unavailable. Try again shortly."},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = str(ipay.breaker.open_seconds)
+        return response
+    except payments.IdempotencyConflict as e:
+        return Response({"error": True, "message": str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    except payments.PaymentInProgress as e:
+        return Response({"error": True, "message": str(e),
+                         "data": {"payment_id": e.attempt.id, "status": e.attempt.status}},
+                        status=status.HTTP_409_CONFLICT)
+
+    response = payment_started(attempt)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def payment_status(request, attempt_id, kind):
+    queryset = PaymentAttempt.objects.filter(kind=kind)
+    if not request.user.is_staff:
+        queryset = queryset.filter(user=request.user)
+    attempt = get_object_or_404(queryset, pk=attempt_id)
+    serializer = PaymentAttemptSerializer(attempt)
+    return Response({"error": False, "message": "Payment Status", "data": serializer.data})
+
+
 class PaymentViewSet(viewsets.ViewSet):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
@@ -313,253 +652,72 @@ class PaymentViewSet(viewsets.ViewSet):
             # Regular users can only access their own payments
             payments = Payment.objects.filter(user=request.user)
 
-        serializer = PaymentSerializer(payments, many=True, context={"request": request})
-
-        response_dict = {"error": False, "message": "Payments List Data", "data": serializer.data}
-
-        return Response(response_dict, status=status.HTTP_200_OK)
+        return paginate(request, payments.select_related('user'),
+                        lambda page: PaymentSerializer(page, many=True, context={"request": request}).data,
+                        "Payments List Data")
 
     @action(detail=False, methods=["post"])
     def initiate_payment(self, request):
-        # Replace 'ticket_id' with the actual ticket ID you want to associate with the payment
+        """
+        Start paying for a ticket over M-Pesa. Answers 202 with a payment_id straight away; the buyer confirms the
+        prompt on their phone while the process_payments worker follows the payment through the gateway.
+        Poll status/<payment_id>/ for the outcome. Send an Idempotency-Key header to make retries safe.
+        """
         ticket_id = request.data.get('ticket_id')
         amount = request.data.get('amount')
         user_phone = request.data.get('phone')
+        if not amount or not user_phone:
+            return Response({"error": True, "message": "Both 'amount' and 'phone' are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         try:
             # Retrieve the Ticket object based on the provided ID
             ticket = Ticket.objects.get(pk=ticket_id)
-        except Ticket.DoesNotExist:
+        except (Ticket.DoesNotExist, ValueError, TypeError):
             return Response({"error": True, "message": "Ticket not found"}, status=status.HTTP_404_NOT_FOUND)
+        if ticket.user_id != request.user.id and not request.user.is_staff:
+            return Response({"error": True, "message": "Unauthorized access"}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Retrieve user's phone from the authenticated user
-        user_email = request.user.email
-        # OEgn$6shMB9( :merchant password
-        # Define your transaction parameters here
-        live = "1"
-        oid = str(ticket.ticket_number)  # Use the retrieved Ticket object to get the ID
-        inv = ticket.ticket_number  # Use the retrieved Ticket object to get the ticket number
-        # amount = str(ticket.price)  # Use the retrieved Ticket object to get the price
-        tel = user_phone
-        eml = user_email
-        vid = "hstring"  # Replace with your Vendor ID
-        curr = "KES"
-        p1 = ""
-        p2 = ""
-        p3 = ""
-        p4 = ""
-        cst = "0"
-        crl = "1"
-        autopay = "1"
-        cbk = "http://heartstringsentertainment.co.ke"  # Replace with your callback URL
-
-        data_string = live + oid + inv + amount + tel + eml + vid + curr + p1 + p2 + p3 + p4 + cst + cbk
-
-        hash_key = "V5BHqdsbRBSc2#9rkky7kC2$NQ%fEEg8"  # Replace with your secret key
-
-        # Convert hashKey and dataString to bytes
-        hash_key_bytes = hash_key.encode()
-        data_string_bytes = data_string.encode()
-
-        # Create an HMAC-SHA256 hasher
-        hasher = hmac.new(hash_key_bytes, data_string_bytes, hashlib.sha256)
-
-        # Get the generated hash in hexadecimal format
-        generated_hash = hasher.hexdigest()
-
-        # Include the 'hash' parameter in your request data
-        request_data = {
-            'live': live,
-            'oid': oid,
-            'inv': inv,
-            'amount': amount,
-            'tel': tel,
-            'eml': eml,
-            'vid': vid,
-            'curr': curr,
-            'p1': p1,
-            'p2': p2,
-            'p3': p3,
-            'p4': p4,
-            'cst': cst,
-            'crl': crl,
-            'hash': generated_hash,  # Include the generated hash
-            'autopay': autopay,
-            'cbk': cbk
-        }
-
-        # Make a POST request to your payment gateway
-        response = requests.post('https://apis.ipayafrica.com/payments/v2/transact', data=request_data)
-
-        # Try to extract the SID from the response
-        sid = response.json().get('data', {}).get('sid')
-
-        if sid:
-            # Now, use the same method to hash the phone, sid, and vid
-            data_string_stk = user_phone + vid + sid
-            hasher_stk = hmac.new(hash_key_bytes, data_string_stk.encode(), hashlib.sha256)
-            generated_hash_stk = hasher_stk.hexdigest()
-
-            # Include the 'hash' parameter in your request data for STK PUSH
-            request_data_stk = {
-                'phone': user_phone,
-                'sid': sid,
-                'vid': vid,
-                'hash': generated_hash_stk,
-            }
-
-            # Make a POST request to your STK PUSH endpoint
-            response_stk = requests.post('https://apis.ipayafrica.com/payments/v2/transact/push/mpesa',
-                                         json=request_data_stk)
-
-            if response_stk.status_code == 200:
-                response_data_stk = response_stk.json()
-                header_status_stk = response_data_stk.get('header_status')
-                response_status_stk = response_data_stk.get('text')
-                if header_status_stk == 200:
-                    # STK PUSH request initiated successfully
-                    # Proceed to handle the callback action
-
-                    if sid:
-                        # 2. Calculate the hash for the callback
-                        data_string_callback = vid + sid  # Exclude the phone number
-
-                        # Convert hashKey and dataString to bytes
-                        hash_key_bytes = hash_key.encode()
-                        data_string_bytes = data_string_callback.encode()
-
-                        # Create an HMAC-SHA256 hasher for the callback
-                        hasher_callback = hmac.new(hash_key_bytes, data_string_bytes, hashlib.sha256)
-
-                        # Get the generated hash in hexadecimal format for the callback
-                        generated_hash_callback = hasher_callback.hexdigest()
-
-                        # 3. Include the 'hash' parameter in your request data for the callback
-                        request_data_callback = {
-                            'vid': vid,
-                            'sid': sid,
-                            'hash': generated_hash_callback,
-                        }
+        if ticket.purchased:
+            return Response({"error": True, "message": "Ticket is already paid for."},
+                            status=status.HTTP_409_CONFLICT)
 
-                        response_callback = requests.post(
-                            'https://apis.ipayafrica.com/payments/v2/transact/mobilemoney',
-                            json=request_data_callback)
+        fingerprint = payments.request_fingerprint(PaymentAttempt.Kind.TICKET, ticket.pk, amount, user_phone)
+        return start_payment_once(request, fingerprint, lambda: payments.start_ticket_payment(
+            request.user, ticket, amount, user_phone))
 
-                        if response_callback.status_code == 400:
-                            response_data_callback = response_callback.json()
+    @action(detail=False, methods=["get"], url_path=r'status/(?P<attempt_id>[0-9]+)')
+    def payment_status(self, request, attempt_id=None):
+        return payment_status(request, attempt_id, PaymentAttempt.Kind.TICKET)
 
-                            # 5. Extract the hash from the callback response using regular expressions
-                            callback_text = response_data_callback.get('error', [{}])[0].get('text')
-                            callback_hash = re.search(r'hash ([a-fA-F0-9]+)', callback_text).group(1)
+    @action(detail=False, methods=["get", "post"], url_path=r'callback/(?P<oid>[^/]+)/(?P<signature>[0-9a-f]+)',
+            authentication_classes=[], permission_classes=[AllowAny])
+    def callback(self, request, oid=None, signature=None):
+        """
+        Receives the gateway's payment notification for ticket and video payments alike. The URL is signed per
+        payment, and the outcome is confirmed with the gateway rather than read from the request. Repeated
+        notifications are answered the same way without recording anything twice.
+        """
+        attempt = payments.handle_callback(oid, signature)
+        if attempt is None:
+            return Response({"error": True, "message": "Invalid callback"}, status=status.HTTP_403_FORBIDDEN)
+        return Response({"error": False, "message": "Callback received", "data": {"status": attempt.status}})
 
-                            # 6. Include the extracted hash in your request data for the second callback
-                            request_data_second_callback = {
-                                'vid': vid,
-                                'sid': sid,
-                                'hash': callback_hash,  # Use the extracted hash
-                            }
+    @action(detail=False, methods=["get"], url_path='gateway', permission_classes=[IsAdminUser])
+    def gateway(self, request):
+        """
+        Circuit breaker state and call counts for the payment gateway.
+        """
+        return Response({"error": False, "message": "Payment Gateway Health", "data": ipay.breaker.stats()})
 
-                            # Define the maximum number of callback retries
-                            max_callback_retries = 8
-                            callback_retries = 0
-
-                            while callback_retries < max_callback_retries:
-                                # 7. Make a second POST request to the callback endpoint to get callback details
-                                response_second_callback = requests.post(
-                                    'https://apis.ipayafrica.com/payments/v2/transact/mobilemoney',
-                                    json=request_data_second_callback
-                                )
-
-                                if response_second_callback.status_code == 200:
-                                    response_data_second_callback = response_second_callback.json()
-                                    # Check if the status in the second callback response indicates completeness
-                                    if response_data_second_callback.get("status") == "aei7p7yrx4ae34":
-                                        # Status is complete, process the second callback response
-
-                                        # Construct the ticket details to include in the QR code
-                                        ticket_details = f"Ticket Number: {ticket.ticket_number}\n"
-                                        ticket_details += f"User Name: {request.user.first_name} {request.user.last_name}\n"
-                                        ticket_details += f"User Phone: {user_phone}\n"
-                                        ticket_details += f"User Email: {request.user.email}\n"
-                                        ticket_details += f"Amount: {response_data_second_callback.get('mc')}\n"  # Assuming 'mc' is the amount
-                                        ticket_details += f"Seat Numbers: {ticket.seat_numbers}\n"
-                                        ticket_details += f"Mode of Payment: {response_data_second_callback.get('channel')}"
-
-                                        # Store payment information in your database
-                                        payment = Payment.objects.create(
-                                            ref_number=response_data_second_callback.get('txncd'),
-                                            payment_mode=response_data_second_callback.get('channel'),
-                                            msisdn=response_data_second_callback.get('msisdn_id'),
-                                            msisdn_idnum=response_data_second_callback.get('msisdn_idnum'),
-                                            amount=response_data_second_callback.get('mc'),
-                                            ticket=ticket,
-                                            user=request.user,
-                                        )
-
-                                        # Update the ticket details with information you want to include in the QR code
-                                        ticket.details = ticket_details
-                                        ticket.purchased = True  # Update purchased status to True
-                                        ticket.save()
-
-                                        # Generate a new QR code with the updated ticket details
-                                        qr = qrcode.QRCode(
-                                            version=1,
-                                            error_correction=qrcode.constants.ERROR_CORRECT_L,
-                                            box_size=10,
-                                            border=4,
-                                        )
-
-                                        qr.add_data(ticket_details)
-                                        qr.make(fit=True)
-
-                                        # Create a QR code image
-                                        qr_code_img = qr.make_image(fill_color="black", back_color="white")
-
-                                        # Save the QR code image to a file
-                                        qr_code_path = "{}.png".format(
-                                            ticket.ticket_number)  # Modify the path as needed
-                                        buffer = BytesIO()
-                                        qr_code_img.save(buffer, format="PNG")
-                                        ticket.qr_code.save(qr_code_path, File(buffer))
-
-                                        # Update the ticket with the file path to the QR code image
-                                        ticket.save()
-
-                                        # Return a response indicating successful payment
-                                        return Response({"error": False, "message": "Payment completed successfully"})
-
-                                    elif response_data_second_callback.get("status") == "bdi6p2yy76etrs":
-                                        # Status is incomplete, increment retry count and wait before retrying
-                                        callback_retries += 1
-                                        sleep(5)  # Wait for 3 seconds before retrying
-
-                                    else:
-                                        # Handle unexpected status, you might want to log this
-                                        return Response({"error": True, "message": "Unexpected callback status"},
-                                                        status=status.HTTP_400_BAD_REQUEST)
-
-                                else:
-                                    # Handle the second callback request error
-                                    return Response({"error": True, "message": "Second Callback request failed"},
-                                                    status=status.HTTP_400_BAD_REQUEST)
-
-                            # If the loop completes without breaking, it means max_callback_retries was reached
-                            return Response({"error": True, "message": "Max retries reached"},
-                                            status=status.HTTP_400_BAD_REQUEST)
-
-                        else:
-                            # Handle first callback error
-                            return Response({"error": True, "message": "First Callback request failed"},
-                                            status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        return Response(
-                            {"error": True,
-                             "message": "STK PUSH request failed with status: " + str(header_status_stk)},
-                            status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    return Response({"error": True, "message": "STK PUSH request failed with status code: " + str(
-                        response_stk.status_code)},
-                                    status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=["get"], url_path=r'export/(?P<export_format>csv|ndjson)',
+            permission_classes=[IsAdminUser])
+    def export(self, request, export_format=None):
+        """
+        Every ticket payment as a CSV or NDJSON download, streamed as it is read. Filter with ?from=, ?to= and
+        ?play=.
+        """
+        return stream_export(request, 'payments', export_format)
 
     def retrieve(self, request, pk=None):
         queryset = Payment.objects.filter(user=request.user)
@@ -573,12 +731,12 @@ class PlayViewSet(viewsets.ViewSet):
     permission_classes = [AllowAny]
 
     def list(self, request):
-        plays = Play.objects.all().order_by('-id')
-        serializer = PlaySerializer(plays, many=True, context={"request": request})
-
-        response_dict = {"error": False, "message": "All Plays List Data", "data": serializer.data}
+        return versions.conditional(request, [versions.PLAYS], lambda: self.list_plays(request))
 
-        return Response(response_dict)
+    def list_plays(self, request):
+        return paginate(request, Play.objects.all(),
+                        lambda page: PlaySerializer(page, many=True, context={"request": request}).data,
+                        "All Plays List Data")
 
     def create(self, request):
         # Check if the user is an admin
@@ -701,36 +859,8 @@ class PlayViewSet(viewsets.ViewSet):
                 else:
                     print("Play Date Serializer Validation Errors:", serializer4.errors)
 
-                # Dynamic seat creation logic
-                seatLayout = [
-                    {"wing": "Left",
-                     "seats": {"A": 3, "B": 4, "C": 5, "D": 6, "E": 7, "F": 8, "G": 0, "H": 0, "I": 0}},
-                    {"wing": "Center",
-                     "seats": {"A": 14, "B": 15, "C": 14, "D": 15, "E": 14, "F": 15, "G": 14, "H": 15, "I": 14}},
-                    {"wing": "Right",
-                     "seats": {"A": 3, "B": 4, "C": 5, "D": 6, "E": 7, "F": 8, "G": 0, "H": 0, "I": 0}},
-                ]
-
-                playTimes = PlayTime.objects.filter(play_id=play_instance)
-
-                for playTime in playTimes:
-                    for section in seatLayout:
-                        wing = section["wing"]
-                        for row, seatCount in section["seats"].items():
-                            # For each PlayTime, create seats for each time slot
-                            time_slots = [playTime.time1, playTime.time2, playTime.time3]
-                            play_date = playTime.play_date
-                            for time_slot in filter(None, time_slots):  # filter(None, ...) removes empty slots
-                                for seatNumber in range(1, seatCount + 1):
-                                    seat_id = f"{wing}-{row}{seatNumber}"
-                                    Seat.objects.create(
-                                        play_time=playTime,
-                                        seat_number=seat_id,
-                                        wing=wing,
-                                        time_slot=time_slot,
-                                        is_booked=False,
-                                        play_date=play_date
-                                    )
+                # Create the seat map for every date and time slot in bulk (nothing to do for lazy seat maps)
+                seating.prepare_play_seats(play_instance)
 
                 dict_response = {"error": False, "message": "Play added successfully"}
             else:
@@ -752,7 +882,9 @@ class PlayViewSet(viewsets.ViewSet):
             play = get_object_or_404(queryset, pk=pk)
             serializer = PlaySerializer(play, data=request.data, context={"request": request})
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            play = serializer.save()
+            # Showtimes carry a copy of the theater so seat lookups don't have to join through the play
+            Showtime.objects.filter(play_id=play).update(theater=play.theater)
             dict_response = {"error": False, "message": "Play Updated Successfully"}
         except:
             dict_response = {"error": True, "message": "Play Not Updated Successfully"}
@@ -760,6 +892,9 @@ class PlayViewSet(viewsets.ViewSet):
         return Response(dict_response)
 
     def retrieve(self, request, pk=None):
+        return versions.conditional(request, [versions.PLAYS], lambda: self.retrieve_play(request, pk))
+
+    def retrieve_play(self, request, pk):
         queryset = Play.objects.all()
         play = get_object_or_404(queryset, pk=pk)
         serializer = PlaySerializer(play, context={"request": request})
@@ -880,10 +1015,12 @@ class VideoViewSet(viewsets.ViewSet):
     permission_classes = [AllowAny]
 
     def list(self, request):
-        videos = Video.objects.all().order_by('-id')
-        serializer = VideoSerializer(videos, many=True, context={"request": request})
-        response_dict = {"error": False, "message": "All Videos List Data", "data": serializer.data}
-        return Response(response_dict)
+        return versions.conditional(request, [versions.VIDEOS], lambda: self.list_videos(request))
+
+    def list_videos(self, request):
+        return paginate(request, Video.objects.all(),
+                        lambda page: VideoSerializer(page, many=True, context={"request": request}).data,
+                        "All Videos List Data")
 
     def create(self, request):
         # Check if the user is an admin
@@ -1268,417 +1405,56 @@ class VideoPaymentViewSet(viewsets.ViewSet):
             # User is not a staff member, so they can only access their payments
             videopayments = VideoPayments.objects.filter(user=request.user)
 
-        serializer = VideoPaymentSerializer(videopayments, many=True, context={"request": request})
-        response_dict = {"error": False, "message": "Payments List Data", "data": serializer.data}
-        return Response(response_dict)
+        return paginate(request, videopayments.select_related('user'),
+                        lambda page: VideoPaymentSerializer(page, many=True, context={"request": request}).data,
+                        "Payments List Data")
 
     @action(detail=False, methods=["post"])
     def initiate_airtel_payment(self, request):
-        video_id = request.data.get('video_id')
-        amount = request.data.get('amount')
-        user_phone = request.data.get('phone')
-
-        try:
-            # Retrieve the Video object based on the provided ID
-            video = Video.objects.get(pk=video_id)
-        except Video.DoesNotExist:
-            return Response({"error": True, "message": "Video not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        # Retrieve user's phone from the authenticated user
-        user_email = request.user.email
-        # OEgn$6shMB9( :merchant password
-        # Define your transaction parameters here
-        live = "1"
-        oid = f"{int(time.time())}-{uuid.uuid4()}"  # Use the retrieved Video object to get the ID
-        inv = str(video.id)  # Use the retrieved Video object to get the ticket number
-        tel = user_phone
-        eml = user_email
-        vid = "hstring"  # Replace with your Vendor ID
-        curr = "KES"
-        p1 = ""
-        p2 = ""
-        p3 = ""
-        p4 = ""
-        cst = "0"
-        crl = "0"
-        autopay = "1"
-        cbk = "http://heartstringsentertainment.co.ke"  # Replace with your callback URL
-
-        data_string = live + oid + inv + amount + tel + eml + vid + curr + p1 + p2 + p3 + p4 + cst + cbk
-
-        hash_key = "V5BHqdsbRBSc2#9rkky7kC2$NQ%fEEg8"  # Replace with your secret key
-
-        # Convert hashKey and dataString to bytes
-        hash_key_bytes = hash_key.encode()
-        data_string_bytes = data_string.encode()
-
-        # Create an HMAC-SHA256 hasher
-        hasher = hmac.new(hash_key_bytes, data_string_bytes, hashlib.sha256)
-
-        # Get the generated hash in hexadecimal format
-        generated_hash = hasher.hexdigest()
-
-        # Include the 'hash' parameter in your request data
-        request_data = {
-            'live': live,
-            'oid': oid,
-            'inv': inv,
-            'amount': amount,
-            'tel': tel,
-            'eml': eml,
-            'vid': vid,
-            'curr': curr,
-            'p1': p1,
-            'p2': p2,
-            'p3': p3,
-            'p4': p4,
-            'cst': cst,
-            'crl': crl,
-            'hash': generated_hash,  # Include the generated hash
-            'autopay': autopay,
-            'cbk': cbk
-        }
-
-        # Make a POST request to your payment gateway
-        response = requests.post('https://apis.ipayafrica.com/payments/v2/transact', data=request_data)
-        # print(response.text)
-        # print(request_data)
-
-        # Try to extract the SID from the response
-        sid = response.json().get('data', {}).get('sid')
-
-        if sid:
-            # Now, use the same method to hash the phone, sid, and vid
-            data_string_stk = user_phone + vid + sid
-            hasher_stk = hmac.new(hash_key_bytes, data_string_stk.encode(), hashlib.sha256)
-            generated_hash_stk = hasher_stk.hexdigest()
-
-            # Include the 'hash' parameter in your request data for STK PUSH
-            request_data_stk = {
-                'phone': user_phone,
-                'sid': sid,
-                'vid': vid,
-                'hash': generated_hash_stk,
-            }
-
-            # Make a POST request to your STK PUSH endpoint
-            response_stk = requests.post('https://apis.ipayafrica.com/payments/v2/transact/push/airtel',
-                                         json=request_data_stk)
-
-            if response_stk.status_code == 200:
-                response_data_stk = response_stk.json()
-                header_status_stk = response_data_stk.get('header_status')
-                response_status_stk = response_data_stk.get('text')
-                if header_status_stk == 200:
-                    # STK PUSH request initiated successfully
-                    # Proceed to handle the callback action
-
-                    if sid:
-                        # 2. Calculate the hash for the callback
-                        data_string_callback = vid + sid  # Exclude the phone number
-
-                        # Convert hashKey and dataString to bytes
-                        hash_key_bytes = hash_key.encode()
-                        data_string_bytes = data_string_callback.encode()
-
-                        # Create an HMAC-SHA256 hasher for the callback
-                        hasher_callback = hmac.new(hash_key_bytes, data_string_bytes, hashlib.sha256)
-
-                        # Get the generated hash in hexadecimal format for the callback
-                        generated_hash_callback = hasher_callback.hexdigest()
-
-                        # 3. Include the 'hash' parameter in your request data for the callback
-                        request_data_callback = {
-                            'vid': vid,
-                            'sid': sid,
-                            'hash': generated_hash_callback,
-                        }
-                        # print(request_data_callback)
-
-                        response_callback = requests.post(
-                            'https://apis.ipayafrica.com/payments/v2/transact/mobilemoney',
-                            json=request_data_callback)\
-
-                        if response_callback.status_code == 400:
-                            response_data_callback = response_callback.json()
-
-                            # 5. Extract the hash from the callback response using regular expressions
-                            callback_text = response_data_callback.get('error', [{}])[0].get('text')
-                            callback_hash = re.search(r'hash ([a-fA-F0-9]+)', callback_text).group(1)
-
-                            # 6. Include the extracted hash in your request data for the second callback
-                            request_data_second_callback = {
-                                'vid': vid,
-                                'sid': sid,
-                                'hash': callback_hash,  # Use the extracted hash
-                            }
-
-                            # Define the maximum number of callback retries
-                            max_callback_retries = 8
-                            callback_retries = 0
-
-                            while callback_retries < max_callback_retries:
-                                # 7. Make a second POST request to the callback endpoint to get callback details
-                                response_second_callback = requests.post(
-                                    'https://apis.ipayafrica.com/payments/v2/transact/mobilemoney',
-                                    json=request_data_second_callback
-                                )
-                                # print(response_second_callback.text)
-
-                                if response_second_callback.status_code == 200:
-                                    response_data_second_callback = response_second_callback.json()
-                                    # Check if the status in the second callback response indicates completeness
-                                    if response_data_second_callback.get("status") == "aei7p7yrx4ae34":
-                                        # Status is complete, process the second callback response
-
-                                        # Store payment information in your database
-                                        payment = VideoPayments.objects.create(
-                                            ref_number=response_data_second_callback.get('txncd'),
-                                            payment_mode=response_data_second_callback.get('channel'),
-                                            msisdn=response_data_second_callback.get('msisdn_id'),
-                                            msisdn_idnum=response_data_second_callback.get('msisdn_idnum'),
-                                            amount=response_data_second_callback.get('mc'),
-                                            video=video,
-                                            user=request.user,
-                                        )
-
-                                        # Return a response indicating successful payment
-                                        return Response({"error": False, "message": "Payment completed successfully"})
-
-                                    elif response_data_second_callback.get("status") == "bdi6p2yy76etrs":
-                                        # Status is incomplete, increment retry count and wait before retrying
-                                        callback_retries += 1
-                                        sleep(5)  # Wait for 3 seconds before retrying
-
-                                    else:
-                                        # Handle unexpected status, you might want to log this
-                                        return Response({"error": True, "message": "Unexpected callback status"},
-                                                        status=status.HTTP_400_BAD_REQUEST)
-
-                                else:
-                                    # Handle the second callback request error
-                                    return Response({"error": True, "message": "Second Callback request failed"},
-                                                    status=status.HTTP_400_BAD_REQUEST)
-
-                            # If the loop completes without breaking, it means max_callback_retries was reached
-                            return Response({"error": True, "message": "Max retries reached"},
-                                            status=status.HTTP_400_BAD_REQUEST)
-
-                        else:
-                            # Handle first callback error
-                            return Response({"error": True, "message": "First Callback request failed"},
-                                            status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        return Response(
-                            {"error": True,
-                             "message": "STK PUSH request failed with status: " + str(header_status_stk)},
-                            status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    return Response({"error": True, "message": "STK PUSH request failed with status code: " + str(
-                        response_stk.status_code)},
-                                    status=status.HTTP_400_BAD_REQUEST)
+        """
+        Start paying for a video over Airtel Money. Answers 202 with a payment_id; see initiate_payment.
+        """
+        return self.start_payment(request, PaymentAttempt.Channel.AIRTEL)
 
     @action(detail=False, methods=["post"])
     def initiate_payment(self, request):
+        """
+        Start paying for a video over M-Pesa. Answers 202 with a payment_id straight away; the buyer confirms the
+        prompt on their phone while the process_payments worker follows the payment through the gateway.
+        Poll status/<payment_id>/ for the outcome.
+        """
+        return self.start_payment(request, PaymentAttempt.Channel.MPESA)
+
+    def start_payment(self, request, channel):
         video_id = request.data.get('video_id')
         amount = request.data.get('amount')
         user_phone = request.data.get('phone')
+        if not amount or not user_phone:
+            return Response({"error": True, "message": "Both 'amount' and 'phone' are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
         try:
             # Retrieve the Video object based on the provided ID
             video = Video.objects.get(pk=video_id)
-        except Video.DoesNotExist:
+        except (Video.DoesNotExist, ValueError, TypeError):
             return Response({"error": True, "message": "Video not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Retrieve user's phone from the authenticated user
-        user_email = request.user.email
-        # OEgn$6shMB9( :merchant password
-        # Define your transaction parameters here
-        live = "1"
-        oid = f"{int(time.time())}-{uuid.uuid4()}"  # Use the retrieved Video object to get the ID
-        inv = str(video.id)  # Use the retrieved Video object to get the ticket number
-        tel = user_phone
-        eml = user_email
-        vid = "hstring"  # Replace with your Vendor ID
-        curr = "KES"
-        p1 = ""
-        p2 = ""
-        p3 = ""
-        p4 = ""
-        cst = "0"
-        crl = "1"
-        autopay = "1"
-        cbk = "http://heartstringsentertainment.co.ke"  # Replace with your callback URL
-
-        data_string = live + oid + inv + amount + tel + eml + vid + curr + p1 + p2 + p3 + p4 + cst + cbk
-
-        hash_key = "V5BHqdsbRBSc2#9rkky7kC2$NQ%fEEg8"  # Replace with your secret key
-
-        # Convert hashKey and dataString to bytes
-        hash_key_bytes = hash_key.encode()
-        data_string_bytes = data_string.encode()
-
-        # Create an HMAC-SHA256 hasher
-        hasher = hmac.new(hash_key_bytes, data_string_bytes, hashlib.sha256)
-
-        # Get the generated hash in hexadecimal format
-        generated_hash = hasher.hexdigest()
-
-        # Include the 'hash' parameter in your request data
-        request_data = {
-            'live': live,
-            'oid': oid,
-            'inv': inv,
-            'amount': amount,
-            'tel': tel,
-            'eml': eml,
-            'vid': vid,
-            'curr': curr,
-            'p1': p1,
-            'p2': p2,
-            'p3': p3,
-            'p4': p4,
-            'cst': cst,
-            'crl': crl,
-            'hash': generated_hash,  # Include the generated hash
-            'autopay': autopay,
-            'cbk': cbk
-        }
-
-        # Make a POST request to your payment gateway
-        response = requests.post('https://apis.ipayafrica.com/payments/v2/transact', data=request_data)
-
-        # Try to extract the SID from the response
-        sid = response.json().get('data', {}).get('sid')
-
-        if sid:
-            # Now, use the same method to hash the phone, sid, and vid
-            data_string_stk = user_phone + vid + sid
-            hasher_stk = hmac.new(hash_key_bytes, data_string_stk.encode(), hashlib.sha256)
-            generated_hash_stk = hasher_stk.hexdigest()
-
-            # Include the 'hash' parameter in your request data for STK PUSH
-            request_data_stk = {
-                'phone': user_phone,
-                'sid': sid,
-                'vid': vid,
-                'hash': generated_hash_stk,
-            }
-
-            # Make a POST request to your STK PUSH endpoint
-            response_stk = requests.post('https://apis.ipayafrica.com/payments/v2/transact/push/mpesa',
-                                         json=request_data_stk)
-
-            if response_stk.status_code == 200:
-                response_data_stk = response_stk.json()
-                header_status_stk = response_data_stk.get('header_status')
-                response_status_stk = response_data_stk.get('text')
-                if header_status_stk == 200:
-                    # STK PUSH request initiated successfully
-                    # Proceed to handle the callback action
-
-                    if sid:
-                        # 2. Calculate the hash for the callback
-                        data_string_callback = vid + sid  # Exclude the phone number
-
-                        # Convert hashKey and dataString to bytes
-                        hash_key_bytes = hash_key.encode()
-                        data_string_bytes = data_string_callback.encode()
-
-                        # Create an HMAC-SHA256 hasher for the callback
-                        hasher_callback = hmac.new(hash_key_bytes, data_string_bytes, hashlib.sha256)
-
-                        # Get the generated hash in hexadecimal format for the callback
-                        generated_hash_callback = hasher_callback.hexdigest()
-
-                        # 3. Include the 'hash' parameter in your request data for the callback
-                        request_data_callback = {
-                            'vid': vid,
-                            'sid': sid,
-                            'hash': generated_hash_callback,
-                        }
-
-                        response_callback = requests.post(
-                            'https://apis.ipayafrica.com/payments/v2/transact/mobilemoney',
-                            json=request_data_callback)
-
-                        if response_callback.status_code == 400:
-                            response_data_callback = response_callback.json()
+        fingerprint = payments.request_fingerprint(PaymentAttempt.Kind.VIDEO, video.pk, amount, user_phone, channel)
+        return start_payment_once(request, fingerprint, lambda: payments.start_video_payment(
+            request.user, video, amount, user_phone, channel))
 
-                            # 5. Extract the hash from the callback response using regular expressions
-                            callback_text = response_data_callback.get('error', [{}])[0].get('text')
-                            callback_hash = re.search(r'hash ([a-fA-F0-9]+)', callback_text).group(1)
-
-                            # 6. Include the extracted hash in your request data for the second callback
-                            request_data_second_callback = {
-                                'vid': vid,
-                                'sid': sid,
-                                'hash': callback_hash,  # Use the extracted hash
-                            }
+    @action(detail=False, methods=["get"], url_path=r'status/(?P<attempt_id>[0-9]+)')
+    def payment_status(self, request, attempt_id=None):
+        return payment_status(request, attempt_id, PaymentAttempt.Kind.VIDEO)
 
-                            # Define the maximum number of callback retries
-                            max_callback_retries = 8
-                            callback_retries = 0
-
-                            while callback_retries < max_callback_retries:
-                                # 7. Make a second POST request to the callback endpoint to get callback details
-                                response_second_callback = requests.post(
-                                    'https://apis.ipayafrica.com/payments/v2/transact/mobilemoney',
-                                    json=request_data_second_callback
-                                )
-
-                                if response_second_callback.status_code == 200:
-                                    response_data_second_callback = response_second_callback.json()
-                                    # Check if the status in the second callback response indicates completeness
-                                    if response_data_second_callback.get("status") == "aei7p7yrx4ae34":
-                                        # Status is complete, process the second callback response
-
-                                        # Store payment information in your database
-                                        payment = VideoPayments.objects.create(
-                                            ref_number=response_data_second_callback.get('txncd'),
-                                            payment_mode=response_data_second_callback.get('channel'),
-                                            msisdn=response_data_second_callback.get('msisdn_id'),
-                                            msisdn_idnum=response_data_second_callback.get('msisdn_idnum'),
-                                            amount=response_data_second_callback.get('mc'),
-                                            video=video,
-                                            user=request.user,
-                                        )
-
-                                        # Return a response indicating successful payment
-                                        return Response({"error": False, "message": "Payment completed successfully"})
-
-                                    elif response_data_second_callback.get("status") == "bdi6p2yy76etrs":
-                                        # Status is incomplete, increment retry count and wait before retrying
-                                        callback_retries += 1
-                                        sleep(5)  # Wait for 3 seconds before retrying
-
-                                    else:
-                                        # Handle unexpected status, you might want to log this
-                                        return Response({"error": True, "message": "Unexpected callback status"},
-                                                        status=status.HTTP_400_BAD_REQUEST)
-
-                                else:
-                                    # Handle the second callback request error
-                                    return Response({"error": True, "message": "Second Callback request failed"},
-                                                    status=status.HTTP_400_BAD_REQUEST)
-
-                            # If the loop completes without breaking, it means max_callback_retries was reached
-                            return Response({"error": True, "message": "Max retries reached"},
-                                            status=status.HTTP_400_BAD_REQUEST)
-
-                        else:
-                            # Handle first callback error
-                            return Response({"error": True, "message": "First Callback request failed"},
-                                            status=status.HTTP_400_BAD_REQUEST)
-                    else:
-                        return Response(
-                            {"error": True,
-                             "message": "STK PUSH request failed with status: " + str(header_status_stk)},
-                            status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    return Response({"error": True, "message": "STK PUSH request failed with status code: " + str(
-                        response_stk.status_code)},
-                                    status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=["get"], url_path=r'export/(?P<export_format>csv|ndjson)',
+            permission_classes=[IsAdminUser])
+    def export(self, request, export_format=None):
+        """
+        Every video payment as a CSV or NDJSON download, streamed as it is read. Filter with ?from=, ?to= and
+        ?video=.
+        """
+        return stream_export(request, 'video-payments', export_format)
 
 
 class ViewHistoryViewSet(viewsets.ViewSet):
@@ -1804,94 +1580,8 @@ class HomeApiViewSet(viewsets.ViewSet):
             return Response({"error": True, "message": "User does not have enough permission to perform this task"}, \
                             status=status.HTTP_401_UNAUTHORIZED)
         try:
-            # Get the current week and year
-            current_date = datetime.today()
-            current_week = current_date.isocalendar()[1]
-            current_year = current_date.year
-
-            # Calculate weekly ticket totals
-            weekly_ticket_data = Ticket.objects.filter(added_on__week=current_week, added_on__year=current_year,
-                                                       purchased=True)
-            weekly_ticket_total = sum(float(weekly_single_ticket.price) for weekly_single_ticket in weekly_ticket_data)
-            ticket_weekly_chart_list = []
-            ticket_weekly_chart_list.append({"date": current_date.strftime("%Y-%m-%d"), "amt": weekly_ticket_total})
-
-            # Calculate weekly stream totals
-            weekly_stream_data = VideoPayments.objects.filter(added_on__week=current_week, added_on__year=current_year)
-            weekly_stream_total = sum(float(weekly_single_stream.amount) for weekly_single_stream in weekly_stream_data)
-
-            # get daily ticket data
-            ticket_dates = Ticket.objects.order_by().values("added_on__date").distinct()
-            ticket_daily_chart_list = []
-            for dates in ticket_dates:
-                access_date = dates["added_on__date"]
-
-                ticket_data = Ticket.objects.filter(added_on__date=access_date, purchased=True)
-                ticket_amt_inner = 0
-
-                for ticketsingle in ticket_data:
-                    ticket_amt_inner += float(ticketsingle.price)
-
-                ticket_daily_chart_list.append({"date": access_date, "amt": ticket_amt_inner})
-
-            # get daily stream data
-            stream_dates = VideoPayments.objects.order_by().values("added_on__date").distinct()
-            stream_daily_chart_list = []
-            for dates in stream_dates:
-                access_date = dates["added_on__date"]
-
-                stream_data = VideoPayments.objects.filter(added_on__date=access_date)
-                stream_amt_inner = 0
-
-                for streamsingle in stream_data:
-                    stream_amt_inner += float(streamsingle.amount)
-
-                stream_daily_chart_list.append({"date": access_date, "amt": stream_amt_inner})
-
-            # get monthly stream data
-            stream_month = VideoPayments.objects.order_by().values("added_on__month", "added_on__year").distinct()
-            stream_monthly_chart_list = []
-            for month in stream_month:
-                access_month = month["added_on__month"]
-                access_year = month["added_on__year"]
-
-                stream_data = VideoPayments.objects.filter(added_on__month=access_month, added_on__year=access_year)
-                stream_month_inner = 0
-                access_date = date(year=access_year, month=access_month, day=1)
-                for streammonth in stream_data:
-                    stream_month_inner += float(streammonth.amount)
-
-                stream_monthly_chart_list.append({"date": access_date, "amt": stream_month_inner})
-
-            # get monthly ticket data
-            ticket_month = Ticket.objects.order_by().values("added_on__month", "added_on__year").distinct()
-            ticket_monthly_chart_list = []
-            for month in ticket_month:
-                access_month = month["added_on__month"]
-                access_year = month["added_on__year"]
-
-                stream_data = Ticket.objects.filter(added_on__month=access_month, added_on__year=access_year, purchased=True)
-                stream_month_inner = 0
-                access_date = date(year=access_year, month=access_month, day=1)
-                for streammonth in stream_data:
-                    stream_month_inner += float(streammonth.price)
-
-                ticket_monthly_chart_list.append({"date": access_date, "amt": stream_month_inner})
-
-            dict_response = {
-                "error": False,
-                "message": "Dashboard api",
-                "users": len(UserAccount.objects.filter(is_staff=0)),
-                "active_streams": len(Video.objects.all()),
-                "active_plays": len(Play.objects.filter(is_available=1)),
-                "tickets_sold": len(Ticket.objects.filter(purchased=1)),
-                "weekly_tickets": ticket_weekly_chart_list,
-                "weekly_streams": [{"date": current_date.strftime("%Y-%m-%d"), "amt": weekly_stream_total}],
-                "daily_tickets": ticket_daily_chart_list,
-                "daily_stream": stream_daily_chart_list,
-                "monthly_stream": stream_monthly_chart_list,
-                "monthly_ticket": ticket_monthly_chart_list,
-            }
+            # Shared by all admins and recomputed only after sales change; see heartstringApp.dashboard
+            dict_response = {"error": False, "message": "Dashboard api", **dashboard.cached_summary()}
         except Exception as e:
             dict_response = {"error": True, "message": f"Error performing task: {str(e)}"}
 
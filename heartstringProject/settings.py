@@ -85,6 +85,14 @@ REST_FRAMEWORK = {
     )
 }
 
+# List endpoints are paginated by cursor (heartstringApp.pagination): rows per page, and the most a client may ask for
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+# Rows fetched per database round trip by the streaming CSV/NDJSON exports (heartstringApp.exports)
+EXPORT_CHUNK_SIZE = 2000
+# Seconds the admin dashboard snapshot is shared between requests; sales invalidate it sooner (heartstringApp.dashboard)
+DASHBOARD_CACHE_SECONDS = 30
+
 AUTHENTICATION_BACKENDS = (
     'social_core.backends.google.GoogleOAuth2',
     'django.contrib.auth.backends.ModelBackend'
@@ -152,6 +160,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'heartstringProject.wsgi.application'
+# Live seat updates (api/seats/events/) hold a connection open per client; serve them with an ASGI server,
+# e.g. uvicorn heartstringProject.asgi:application
+ASGI_APPLICATION = 'heartstringProject.asgi.application'
 
 
 # Database
@@ -177,6 +188,21 @@ DATABASES = {
 #     }
 # }
 
+# Cache
+# Seat availability bitmaps and sessions live here. Use a shared backend (Redis/Memcached)
+# when running more than one worker process so they all see the same entries.
+
+# Conditional GETs, seat events, seat holds and the payment circuit breaker coordinate through this cache, so in
+# production it must be shared by every web process and the workers, e.g. CACHE_BACKEND=
+# django.core.cache.backends.db.DatabaseCache with CACHE_LOCATION=heartstring_cache (after createcachetable).
+# With the per-process default, ETags and seat event streams are switched off (heartstringApp.versions.shared_cache).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'heartstring'),
+    }
+}
+
 # Email settings
 # Email backend
 # email verification
@@ -236,3 +262,54 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'heartstringApp.UserAccount'
+
+# Seat maps
+# 'eager' creates a Seat row for every seat of every show when a play is added.
+# 'lazy' keeps one SeatLayout per theater and only stores seats once they are booked or held.
+SEAT_MAP_MODE = 'eager'
+
+# Seconds a seat stays held for a ticket while its payment is in flight
+SEAT_HOLD_SECONDS = 10 * 60
+
+# Live seat updates are relayed through the cache, so every worker must share one cache backend.
+# Seconds a seat change stays replayable for reconnecting clients, and how often open streams check for changes
+SEAT_EVENT_TTL = 2 * 60
+SEAT_EVENT_POLL_SECONDS = 0.5
+
+# iPay gateway. For load tests run python manage.py run_ipay_simulator and set
+# IPAY_URL = 'http://127.0.0.1:8765/payments/v2'
+IPAY_VENDOR_ID = 'hstring'
+IPAY_HASH_KEY = 'V5BHqdsbRBSc2#9rkky7kC2$NQ%fEEg8'
+IPAY_CALLBACK_URL = 'http://heartstringsentertainment.co.ke'
+# (connect, read) timeouts in seconds, and pooled keep-alive connections to the gateway per process
+IPAY_TIMEOUT = (3.05, 15)
+IPAY_POOL_SIZE = 10
+# Concurrent gateway calls per process, and the circuit breaker: it opens when at least IPAY_BREAKER_FAILURE_RATE of
+# IPAY_BREAKER_MIN_CALLS or more calls in a minute failed or took IPAY_BREAKER_SLOW_CALL_SECONDS, and lets a probe
+# through after IPAY_BREAKER_OPEN_SECONDS
+IPAY_MAX_CONCURRENCY = 8
+IPAY_BREAKER_FAILURE_RATE = 0.5
+IPAY_BREAKER_MIN_CALLS = 10
+IPAY_BREAKER_SLOW_CALL_SECONDS = 5
+IPAY_BREAKER_OPEN_SECONDS = 30
+
+# Payments are driven by the process_payments worker (python manage.py process_payments --loop).
+# Seconds between status checks, and how long a buyer has to confirm the prompt before the attempt expires
+PAYMENT_POLL_SECONDS = 5
+PAYMENT_EXPIRY_SECONDS = 3 * 60
+# Public URL of api/payments/callback/. Once set the gateway reports outcomes itself and the worker only checks
+# pending payments every PAYMENT_CALLBACK_FALLBACK_SECONDS in case a callback is lost.
+PAYMENT_CALLBACK_URL = None
+PAYMENT_CALLBACK_FALLBACK_SECONDS = 30
+# A retried payment request with the same Idempotency-Key gets the first payment back for this many seconds.
+# Older keys are deleted by python manage.py purge_idempotency_keys.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# python manage.py reconcile_payments (every minute) settles failed or expired payments the gateway later reports as
+# paid. It asks about attempts RECONCILE_DELAY_SECONDS after they ended, RECONCILE_BATCH_SIZE at a time with up to
+# RECONCILE_CONCURRENCY concurrent gateway requests.
+RECONCILE_DELAY_SECONDS = 5 * 60
+RECONCILE_BATCH_SIZE = 100
+RECONCILE_CONCURRENCY = 4
+# Background threads per process that render ticket QR codes after payment; python manage.py render_ticket_qr_codes
+# renders any that were missed
+QR_RENDER_WORKERS = 2
@@ -37,6 +37,7 @@ urlpatterns = [
     path('api/video-payments/initiate_payment/', views.VideoPaymentViewSet.as_view({'post': 'initiate_payment'}), name='initiate_payment'),
     path('api/video-payments/initiate_airtel_payment/', views.VideoPaymentViewSet.as_view({'post': 'initiate_airtel_payment'}), name='initiate_airtel_payment'),
     path('api/available-seats/<int:play_time_id>/', AvailableSeatsView.as_view(), name='available-seats'),
+    path('api/seats/events/<int:showtime_id>/', views.seat_events, name='seat-events'),
     path('api/update-user/', UserAccountUpdateView.as_view(), name='update-user'),
     path('api/delete-user/<int:pk>/', UserAccountDeleteView.as_view(), name='user-delete'),
     path('api/my-plays/', MyPlayListView.as_view(), name='my-plays'),
@@ -1,28 +1,21 @@
 import os
+import sys
 
 import django
 
-from heartstringApp.models import Seat
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'heartstringProject.settings')
 django.setup()
 
+from heartstringApp import seating
+from heartstringApp.models import PlayTime
 
-def create_initial_seats():
-    seat_layout = [
-        {'wing': 'Left', 'seats': {'A': 3, 'B': 4, 'C': 5, 'D': 6, 'E': 7, 'F': 8, 'G': 0, 'H': 0, 'I': 0}},
-        {'wing': 'Center', 'seats': {'A': 14, 'B': 15, 'C': 14, 'D': 15, 'E': 14, 'F': 15, 'G': 14, 'H': 15, 'I': 14}},
-        {'wing': 'Right', 'seats': {'A': 3, 'B': 4, 'C': 5, 'D': 6, 'E': 7, 'F': 8, 'G': 0, 'H': 0, 'I': 0}},
-    ]
 
-    for layout in seat_layout:
-        wing = layout['wing']
-        seats_info = layout['seats']
+def create_initial_seats(play_id=None):
+    play_times = PlayTime.objects.select_related('play_id')
+    if play_id:
+        play_times = play_times.filter(play_id=play_id)
+    return seating.materialize_seats(play_times)
 
-        for row, cols in seats_info.items():
-            for col in range(1, cols + 1):
-                seat_id = f"{wing}-{row}{col}"
-                seat = Seat(seat_id=seat_id, row=row, column=col, wing=wing)
-                seat.save()
 
-create_initial_seats()
\ No newline at end of file
+if __name__ == '__main__':
+    create_initial_seats(sys.argv[1] if len(sys.argv) > 1 else None)